@@ -0,0 +1,251 @@
+"""
+Run one benchmark stage in the current process and print its measurements.
+
+Started by run.py with the working directory set to the project the stage
+belongs to, so the project's own modules and Python environment are used:
+
+    python ../benchmarks/bench_worker.py STAGE CORPUS_DIR [--stand-in]
+
+Prints one JSON object: items processed per run, their unit, seconds per
+run, items per second, the number of runs, peak RSS in MB and which NER
+model was used. Only the stage itself is timed; reading its input happens
+before the clock starts. Stages faster than MIN_SECONDS are run again until
+their runs add up to it, so short stages are not measured on timer noise.
+"""
+from contextlib import redirect_stdout
+from pathlib import Path
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+
+# Total time a stage is repeated for, at least
+MIN_SECONDS = 1.0
+
+
+def scene_texts(corpus: Path):
+    from scenestore import scene_sort_key
+
+    files = sorted((corpus / "scenes").glob("*.json"), key=scene_sort_key)
+    texts = []
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            texts.append(json.load(f)["scene_text"])
+    return texts
+
+
+def ner_processor(processor_class, corpus: Path, stand_in: bool):
+    """
+    A SpacyProcessor of the project, or one whose pipeline is a stand-in.
+
+    The stand-in is a blank English pipeline with an entity ruler for the
+    corpus names: it exercises the same code around the pipeline at tokenizer
+    speed, but says nothing about transformer throughput.
+    """
+    import spacy
+
+    from_module = sys.modules[processor_class.__module__]
+    if not stand_in and spacy.util.is_package(from_module.NER_MODEL):
+        return processor_class(), from_module.NER_MODEL
+
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    names = json.loads((corpus / "names.json").read_text(encoding="utf-8"))
+    ruler.add_patterns([{"label": "PERSON", "pattern": name} for name in names])
+
+    processor = processor_class.__new__(processor_class)
+    processor.nlp = nlp
+    processor._coref_nlp = None
+    return processor, "stand-in"
+
+
+# Each stage prepares its input and returns (run, unit, model); run() does the
+# timed work and returns the number of items it processed.
+
+def segment(engine):
+    def stage(corpus, stand_in):
+        from main import split_text_into_scenes
+
+        text = (corpus / "book.txt").read_text(encoding="utf-8")
+
+        def run():
+            split_text_into_scenes(text, engine=engine)
+            return len(text)
+        return run, "chars", None
+    return stage
+
+
+def scenestore_write(corpus, stand_in):
+    from scenestore import SceneStore
+
+    scenes = [{"scene_text": text} for text in scene_texts(corpus)]
+
+    def run():
+        SceneStore.create(corpus / "scenes.store", scenes).close()
+        return len(scenes)
+    return run, "scenes", None
+
+
+def scenestore_read(corpus, stand_in):
+    from scenestore import SceneStore
+
+    def run():
+        with SceneStore(corpus / "scenes.store") as store:
+            return sum(1 for _ in store)
+    return run, "scenes", None
+
+
+def fileutils_io(corpus, stand_in):
+    from fileutils import get_json_files, update_scene, validate_and_load_scene_file
+
+    def run():
+        json_files = get_json_files(str(corpus / "scenes"))
+        for path in json_files:
+            update_scene(path, validate_and_load_scene_file(path))
+        return len(json_files)
+    return run, "scenes", None
+
+
+def extract_present(corpus, stand_in):
+    import spacy_ner_extractor
+
+    processor, model = ner_processor(spacy_ner_extractor.SpacyProcessor, corpus, stand_in)
+    spacy_ner_extractor.get_processor = lambda: processor
+    texts = scene_texts(corpus)
+
+    def run():
+        return sum(1 for _ in spacy_ner_extractor.extract_characters_from_scenes(texts))
+    return run, "scenes", model
+
+
+def dossier_process(corpus, stand_in):
+    from registrystore import write_registry
+    from tracker import CharacterTracker, SpacyProcessor
+
+    processor, model = ner_processor(SpacyProcessor, corpus, stand_in)
+    scenes = [(f"scene_{number:03d}", text) for number, text in enumerate(scene_texts(corpus), 1)]
+
+    def run():
+        tracker = CharacterTracker()
+        tracker._processor = processor
+        tracker.process_scenes(scenes)
+        # The registry is the input of the gazetteer and registry stages
+        tracker.registry.save_to_json(corpus / "characters.json")
+        write_registry(tracker.registry, corpus / "characters.twreg")
+        return len(scenes)
+    return run, "scenes", model
+
+
+def gazetteer_scan(corpus, stand_in):
+    from registry import CharacterRegistry
+    from tracker import registry_gazetteer
+
+    gazetteer = registry_gazetteer(CharacterRegistry.load_from_json(corpus / "characters.json"))
+    texts = scene_texts(corpus)
+
+    def run():
+        return sum(1 for _ in gazetteer.scan(texts))
+    return run, "scenes", None
+
+
+def registry_load(file_name):
+    def stage(corpus, stand_in):
+        from registrystore import load_registry
+
+        def run():
+            return len(load_registry(corpus / file_name).characters)
+        return run, "characters", None
+    return stage
+
+
+QUERIES = 2000
+
+
+def registry_query(file_name):
+    def stage(corpus, stand_in):
+        from registrystore import load_registry
+
+        registry = load_registry(corpus / file_name)
+        book_chars = len((corpus / "book.txt").read_text(encoding="utf-8"))
+        names = json.loads((corpus / "names.json").read_text(encoding="utf-8"))
+
+        def run():
+            # One playback tick: who is here, and the dossier of one of them
+            for i in range(QUERIES):
+                position = book_chars * i // QUERIES
+                registry.names_at(position)
+                registry.character_at(names[i % len(names)], position)
+            return QUERIES
+        return run, "queries", None
+    return stage
+
+
+STAGES = {
+    "segment_numpy": segment("numpy"),
+    "segment_nltk": segment("nltk"),
+    "scenestore_write": scenestore_write,
+    "scenestore_read": scenestore_read,
+    "fileutils_io": fileutils_io,
+    "extract_present": extract_present,
+    "dossier_process": dossier_process,
+    "gazetteer_scan": gazetteer_scan,
+    "registry_json_load": registry_load("characters.json"),
+    "registry_compact_load": registry_load("characters.twreg"),
+    "registry_json_query": registry_query("characters.json"),
+    "registry_compact_query": registry_query("characters.twreg"),
+}
+
+
+def peak_rss_mb() -> float:
+    # On Linux ru_maxrss also counts the runner's memory from before the
+    # fork; VmHWM belongs to this process image only
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one benchmark stage")
+    parser.add_argument("stage", choices=sorted(STAGES))
+    parser.add_argument("corpus")
+    parser.add_argument("--stand-in", action="store_true", help="Use the stand-in NER pipeline even if models are installed")
+    args = parser.parse_args()
+
+    # The stages print progress per scene; keep it out of the measurement output
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        run, unit, model = STAGES[args.stage](Path(args.corpus).resolve(), args.stand_in)
+        runs = 0
+        start = time.perf_counter()
+        while True:
+            items = run()
+            runs += 1
+            seconds = time.perf_counter() - start
+            if seconds >= MIN_SECONDS:
+                break
+
+    print(json.dumps({
+        "items": items,
+        "unit": unit,
+        "seconds": seconds / runs,
+        "items_per_second": items * runs / seconds if seconds else None,
+        "runs": runs,
+        "peak_rss_mb": peak_rss_mb(),
+        "model": model,
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Synthetic book corpora for the benchmarks.
+
+A corpus at scale N is alice-full.txt repeated N times. In every copy after
+the first, the character names get a copy-specific suffix, so the vocabulary
+and the number of characters grow with the book, as they would in a long
+series, instead of repeating. The book is also cut into scene JSON files of
+roughly equal size at paragraph breaks, so the stages after scene detection
+do not depend on its output.
+
+Corpus layout:
+
+    book.txt          the synthetic book
+    names.json        every character name in the book
+    scenes/           scene_NNN.json files with a scene_text field, NNN as wide as
+                      the largest scene number
+"""
+from pathlib import Path
+from typing import List
+import json
+import re
+import string
+
+
+SOURCE_BOOK = Path(__file__).parent / "../../assets/books/alice-in-wonderland/text/alice-full.txt"
+
+NAMES = [
+    "Alice", "Dinah", "White Rabbit", "Rabbit", "Duchess", "Hatter", "March Hare", "Dormouse", "Queen",
+    "King", "Gryphon", "Mock Turtle", "Caterpillar", "Cheshire Cat", "Bill", "Knave", "Pat", "Mouse",
+]
+NAME_PATTERN = re.compile(r"\b(" + "|".join(sorted(NAMES, key=len, reverse=True)) + r")\b")
+
+DEFAULT_SCENE_CHARS = 3000
+
+
+def copy_suffix(copy: int) -> str:
+    """Name suffix of a copy: nothing for copy 0, then b, c, ..., z, ba, bb and so on."""
+    suffix = ""
+    while copy:
+        copy, digit = divmod(copy, 26)
+        suffix = string.ascii_lowercase[digit] + suffix
+    return suffix
+
+
+def rename(name: str, copy: int) -> str:
+    return name + copy_suffix(copy)
+
+
+def split_scenes(text: str, scene_chars: int) -> List[str]:
+    """Cut text at the first paragraph break after every scene_chars characters."""
+    scenes = []
+    start = 0
+    while start < len(text):
+        cut = text.find("\n\n", start + scene_chars)
+        end = len(text) if cut == -1 else cut + 2
+        scenes.append(text[start:end])
+        start = end
+    return scenes
+
+
+def build_corpus(scale: int, out_dir, source=SOURCE_BOOK, scene_chars: int = DEFAULT_SCENE_CHARS) -> dict:
+    """Write a corpus of scale copies of source to out_dir. Returns its size."""
+    out_dir = Path(out_dir)
+    scenes_dir = out_dir / "scenes"
+    scenes_dir.mkdir(parents=True, exist_ok=True)
+
+    text = Path(source).read_text(encoding="utf-8")
+    copies = [NAME_PATTERN.sub(lambda m: rename(m.group(), copy), text) for copy in range(scale)]
+    book = "\n\n".join(copies)
+    (out_dir / "book.txt").write_text(book, encoding="utf-8")
+
+    names = [rename(name, copy) for copy in range(scale) for name in NAMES]
+    (out_dir / "names.json").write_text(json.dumps(names), encoding="utf-8")
+
+    scenes = split_scenes(book, scene_chars)
+    # Padded to the widest number, so the files list in reading order even when sorted by name
+    width = max(3, len(str(len(scenes))))
+    # Scenes of an earlier build may be numbered differently
+    for stale in scenes_dir.glob("*.json"):
+        stale.unlink()
+    for number, scene in enumerate(scenes, 1):
+        with open(scenes_dir / f"scene_{number:0{width}d}.json", "w", encoding="utf-8") as f:
+            json.dump({"scene_text": scene}, f, ensure_ascii=False)
+
+    return {"scale": scale, "chars": len(book), "scenes": len(scenes), "names": len(names)}
@@ -0,0 +1,167 @@
+"""
+Benchmark the pipeline stages on synthetic books.
+
+Builds a corpus per scale (see corpus.py), runs every stage in a fresh
+process of its own project (see bench_worker.py) and reports time, items per
+second and peak RSS. Results are written as JSON and compared against
+thresholds.json; the exit status is 1 when any stage regressed past them.
+
+Usage:
+    python run.py [--scales 1,10,100] [--stages segment_numpy,...] [--output results.json]
+"""
+from pathlib import Path
+from typing import List, Optional, Set
+import argparse
+import json
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from corpus import build_corpus
+
+
+MODELS_DIR = Path(__file__).resolve().parent.parent
+WORKER = Path(__file__).resolve().parent / "bench_worker.py"
+DEFAULT_THRESHOLDS = Path(__file__).resolve().parent / "thresholds.json"
+
+# Stage, project it runs in and the largest scale it runs at by default
+STAGES = [
+    ("segment_numpy", "scene-detection", None),
+    # nltk's TextTiling takes about a minute for one copy of the book
+    ("segment_nltk", "scene-detection", 1),
+    ("scenestore_write", "scene-detection", None),
+    ("scenestore_read", "scene-detection", None),
+    ("fileutils_io", "characters-in-scene", None),
+    ("extract_present", "characters-in-scene", None),
+    ("dossier_process", "character-dossier", None),
+    ("gazetteer_scan", "character-dossier", None),
+    ("registry_json_load", "character-dossier", None),
+    ("registry_compact_load", "character-dossier", None),
+    ("registry_json_query", "character-dossier", None),
+    ("registry_compact_query", "character-dossier", None),
+]
+
+# Stages that read what another stage writes into the corpus directory, or
+# are compared against its result
+REQUIRES = {
+    "scenestore_read": "scenestore_write",
+    "gazetteer_scan": "dossier_process",
+    "registry_json_load": "dossier_process",
+    "registry_compact_load": "dossier_process",
+    "registry_json_query": "dossier_process",
+    "registry_compact_query": "registry_json_query",
+}
+
+
+def run_stage(stage: str, project: str, corpus: Path, python: List[str], stand_in: bool) -> dict:
+    """Run one stage in a fresh interpreter and return its measurements."""
+    command = [*python, str(WORKER), stage, str(corpus)] + (["--stand-in"] if stand_in else [])
+    result = subprocess.run(command, cwd=MODELS_DIR / project, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check(result: dict, thresholds: dict, results: List[dict] = ()) -> List[str]:
+    """Threshold violations of one result, as messages; results holds the earlier results of the run."""
+    limits = thresholds.get(result["stage"], {}).get(str(result["scale"]), {})
+    problems = []
+    if "error" in result:
+        problems.append(f"failed: {result['error']}")
+        return problems
+    # Limits measured with one NER model say nothing about another
+    if "model" in limits and limits["model"] != result["model"]:
+        return problems
+    if "min_items_per_second" in limits and result["items_per_second"] < limits["min_items_per_second"]:
+        problems.append(f"{result['items_per_second']:.1f} {result['unit']}/s "
+                        f"< {limits['min_items_per_second']} {result['unit']}/s")
+    if "max_peak_rss_mb" in limits and result["peak_rss_mb"] > limits["max_peak_rss_mb"]:
+        problems.append(f"peak RSS {result['peak_rss_mb']:.0f} MB > {limits['max_peak_rss_mb']} MB")
+    # Speed relative to another stage of the same scale, measured on the same machine
+    for other, ratio in limits.get("min_ratio_to", {}).items():
+        baseline = next((r for r in results if r["stage"] == other and r["scale"] == result["scale"]
+                         and "error" not in r), None)
+        if baseline is not None and result["items_per_second"] < ratio * baseline["items_per_second"]:
+            problems.append(f"{result['items_per_second']:.1f} {result['unit']}/s < {ratio} x {other} "
+                            f"({baseline['items_per_second']:.1f} {result['unit']}/s)")
+    return problems
+
+
+def run_benchmarks(scales: List[int], stages: Optional[Set[str]], work_dir: Path, python: List[str],
+                   stand_in: bool, thresholds: dict) -> dict:
+    results = []
+    for scale in scales:
+        corpus = work_dir / f"scale-{scale}"
+        size = build_corpus(scale, corpus)
+        print(f"Corpus {scale}x: {size['chars']} chars, {size['scenes']} scenes, {size['names']} names")
+
+        for stage, project, max_scale in STAGES:
+            if stages is not None:
+                if stage not in stages:
+                    continue
+            elif max_scale is not None and scale > max_scale:
+                continue
+
+            result = {"stage": stage, "scale": scale, **run_stage(stage, project, corpus, python, stand_in)}
+            result["problems"] = check(result, thresholds, results)
+            results.append(result)
+
+            if "error" in result:
+                print(f"  {stage:24} FAILED {result['error']}")
+            else:
+                model = f" ({result['model']})" if result["model"] else ""
+                print(f"  {stage:24} {result['seconds']:8.2f}s {result['items_per_second']:12.1f} "
+                      f"{result['unit']}/s {result['peak_rss_mb']:8.0f} MB{model}")
+            for problem in result["problems"]:
+                print(f"    REGRESSION: {problem}")
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version()},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic books")
+    parser.add_argument("--scales", default="1,10,100", help="Comma-separated multiples of alice-full.txt")
+    parser.add_argument("--stages", help="Comma-separated stages to run, at every scale (default: all)")
+    parser.add_argument("--output", default="results.json", help="Where to write the JSON results")
+    parser.add_argument("--thresholds", default=str(DEFAULT_THRESHOLDS), help="Regression thresholds JSON file")
+    parser.add_argument("--work-dir", help="Directory for the corpora (default: a temporary directory)")
+    parser.add_argument("--python", default="uv run python",
+                        help="Command that runs Python with a project's environment, run in the project directory")
+    parser.add_argument("--stand-in", action="store_true",
+                        help="Use the stand-in NER pipeline even where the spaCy models are installed")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    stages = None
+    if args.stages:
+        stages = set(args.stages.split(","))
+        required = {REQUIRES[stage] for stage in stages if stage in REQUIRES}
+        while not required <= stages:
+            stages |= required
+            required = {REQUIRES[stage] for stage in stages if stage in REQUIRES}
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="threadwell-bench-") as tmp_dir:
+        work_dir = Path(args.work_dir) if args.work_dir else Path(tmp_dir)
+        report = run_benchmarks(scales, stages, work_dir, shlex.split(args.python), args.stand_in, thresholds)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    regressions = [result for result in report["results"] if result["problems"]]
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed past their thresholds")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
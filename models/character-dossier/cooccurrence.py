@@ -0,0 +1,204 @@
+"""
+Scene-by-character co-occurrence index for relationship queries.
+
+Built from the characters_present (and optionally characters_mentioned)
+fields characters-in-scene writes into every scene. Scenes are numbered from
+1 in reading order, like scene_NNN.json. The index is a set of numpy arrays:
+
+    scene_ptr, scene_chars          characters of every scene (CSR incidence matrix)
+    char_ptr, char_scenes           scenes of every character, ascending (CSC)
+    pair_keys                       a * C + b of every pair a < b sharing a scene, ascending
+    pair_ptr, pair_scenes           scenes every pair shares, ascending
+    partner_ptr, partners,          partners of every character, ordered by the scene
+    partner_first                   in which they first shared one
+
+Every array is a prefix-sorted list, so "who had X met by scene N" is one
+searchsorted over X's partners, "how many scenes had X and Y shared by N"
+one over their pair's scenes, and the counts of all pairs up to N a single
+vectorized pass over pair_scenes, instead of rescanning every scene.
+
+Stored as an .npz file of these arrays plus the character names.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from registry import character_id
+
+
+FIELDS = ("characters_present",)
+# Scene number past the end of any book, for queries over the whole book
+END = np.iinfo(np.int32).max
+
+
+def csr_ptr(counts: np.ndarray) -> np.ndarray:
+    ptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ptr[1:])
+    return ptr
+
+
+class CooccurrenceIndex:
+    """Which characters shared scenes, and from which scene on. Queries take a scene number N, counting scenes 1..N."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.names = [str(name) for name in arrays["names"]]
+        self.scene_count = len(arrays["scene_ptr"]) - 1
+
+        lookup = {}
+        # Aliases first, so ids and then primary names take precedence
+        for name, owner in zip(arrays["alias_names"], arrays["alias_owner"]):
+            lookup[str(name).casefold()] = int(owner)
+        for i, name in enumerate(self.names):
+            lookup[character_id(name).casefold()] = i
+        for i, name in enumerate(self.names):
+            lookup[name.casefold()] = i
+        self._lookup = lookup
+
+    @classmethod
+    def build(cls, scenes: Iterable[dict], fields: Tuple[str, ...] = FIELDS) -> "CooccurrenceIndex":
+        """Index scene dicts in reading order, counting the characters listed in fields as in a scene."""
+        ids = {}
+        names = []
+        aliases = []
+        rows = []
+        for scene in scenes:
+            present = set()
+            for field in fields:
+                for entry in scene.get(field) or []:
+                    # characters_present holds character dicts, characters_mentioned plain names
+                    name = entry["primary_name"] if isinstance(entry, dict) else str(entry)
+                    cid = character_id(name)
+                    if cid not in ids:
+                        ids[cid] = len(names)
+                        names.append(name)
+                        aliases.append(set())
+                    aliases[ids[cid]].update([name, *(entry.get("aliases", []) if isinstance(entry, dict) else [])])
+                    present.add(ids[cid])
+            rows.append(np.array(sorted(present), dtype=np.int32))
+
+        char_count = len(names)
+        lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        scene_chars = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+        entry_scenes = np.repeat(np.arange(1, len(rows) + 1, dtype=np.int32), lengths)
+
+        # Entries are in scene order already; a stable sort by character keeps it within each character
+        order = np.argsort(scene_chars, kind="stable")
+        char_scenes = entry_scenes[order]
+        char_ptr = csr_ptr(np.bincount(scene_chars, minlength=char_count))
+
+        pair_a, pair_b, pair_scene = [], [], []
+        for number, row in enumerate(rows, 1):
+            if len(row) > 1:
+                a, b = np.triu_indices(len(row), 1)
+                pair_a.append(row[a])
+                pair_b.append(row[b])
+                pair_scene.append(np.full(len(a), number, dtype=np.int32))
+        if pair_a:
+            pair_a, pair_b, pair_scene = np.concatenate(pair_a), np.concatenate(pair_b), np.concatenate(pair_scene)
+        else:
+            pair_a, pair_b, pair_scene = (np.zeros(0, dtype=np.int32) for _ in range(3))
+
+        keys = pair_a.astype(np.int64) * char_count + pair_b
+        order = np.argsort(keys, kind="stable")
+        pair_keys, pair_counts = np.unique(keys[order], return_counts=True)
+        pair_ptr = csr_ptr(pair_counts)
+        pair_scenes = pair_scene[order]
+
+        # Both directions of every pair, ordered by character and then by the scene they first met in
+        first = pair_scenes[pair_ptr[:-1]]
+        a = (pair_keys // max(char_count, 1)).astype(np.int32)
+        b = (pair_keys % max(char_count, 1)).astype(np.int32)
+        source, partner, partner_first = np.concatenate([a, b]), np.concatenate([b, a]), np.concatenate([first, first])
+        order = np.lexsort((partner, partner_first, source))
+
+        alias_pairs = sorted((alias, i) for i, names_of in enumerate(aliases) for alias in names_of)
+        return cls({
+            "names": np.array(names, dtype=str),
+            "alias_names": np.array([alias for alias, _ in alias_pairs], dtype=str),
+            "alias_owner": np.array([i for _, i in alias_pairs], dtype=np.int32),
+            "scene_ptr": csr_ptr(lengths),
+            "scene_chars": scene_chars,
+            "char_ptr": char_ptr,
+            "char_scenes": char_scenes,
+            "pair_keys": pair_keys,
+            "pair_ptr": pair_ptr,
+            "pair_scenes": pair_scenes,
+            "partner_ptr": csr_ptr(np.bincount(source, minlength=char_count)),
+            "partners": partner[order],
+            "partner_first": partner_first[order],
+        })
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, **self.arrays)
+
+    @classmethod
+    def load(cls, path) -> "CooccurrenceIndex":
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def find(self, name: str) -> Optional[int]:
+        """Index of the character with this id, name or alias, in any case."""
+        return self._lookup.get(name.casefold())
+
+    def _character(self, name: str) -> int:
+        i = self.find(name)
+        if i is None:
+            raise KeyError(name)
+        return i
+
+    def characters_in(self, scene: int) -> List[str]:
+        ptr = self.arrays["scene_ptr"]
+        return [self.names[i] for i in self.arrays["scene_chars"][ptr[scene - 1]:ptr[scene]]]
+
+    def appearances(self, name: str, scene: int = END) -> int:
+        """Number of scenes up to scene the character is in."""
+        i = self._character(name)
+        ptr = self.arrays["char_ptr"]
+        return int(np.searchsorted(self.arrays["char_scenes"][ptr[i]:ptr[i + 1]], scene, side="right"))
+
+    def _pair(self, a: int, b: int) -> Optional[np.ndarray]:
+        """Scenes characters a and b share, ascending, or None if they share none."""
+        a, b = min(a, b), max(a, b)
+        key = a * len(self.names) + b
+        keys = self.arrays["pair_keys"]
+        k = int(np.searchsorted(keys, key))
+        if k == len(keys) or keys[k] != key:
+            return None
+        ptr = self.arrays["pair_ptr"]
+        return self.arrays["pair_scenes"][ptr[k]:ptr[k + 1]]
+
+    def count(self, a: str, b: str, scene: int = END) -> int:
+        """Number of scenes up to scene that characters a and b are both in."""
+        scenes = self._pair(self._character(a), self._character(b))
+        return 0 if scenes is None else int(np.searchsorted(scenes, scene, side="right"))
+
+    def first_met(self, a: str, b: str) -> Optional[int]:
+        """The first scene characters a and b are both in, or None."""
+        scenes = self._pair(self._character(a), self._character(b))
+        return None if scenes is None else int(scenes[0])
+
+    def met(self, name: str, scene: int = END) -> List[Tuple[str, int, int]]:
+        """
+        (partner, first shared scene, shared scenes up to scene) of everyone the
+        character shared a scene with up to scene, in the order they first met.
+        """
+        i = self._character(name)
+        ptr = self.arrays["partner_ptr"]
+        firsts = self.arrays["partner_first"][ptr[i]:ptr[i + 1]]
+        end = int(np.searchsorted(firsts, scene, side="right"))
+        partners = self.arrays["partners"][ptr[i]:ptr[i] + end]
+        return [(self.names[p], int(first), int(np.searchsorted(self._pair(i, int(p)), scene, side="right")))
+                for p, first in zip(partners, firsts[:end])]
+
+    def pair_counts(self, scene: int = END) -> List[Tuple[str, str, int]]:
+        """(a, b, shared scenes up to scene) of every pair that shared one, most shared first."""
+        keys = self.arrays["pair_keys"]
+        if len(keys) == 0:
+            return []
+        shared = (self.arrays["pair_scenes"] <= scene).astype(np.int64)
+        counts = np.add.reduceat(shared, self.arrays["pair_ptr"][:-1])
+        order = np.lexsort((keys, -counts))
+        order = order[counts[order] > 0]
+        n = len(self.names)
+        return [(self.names[keys[k] // n], self.names[keys[k] % n], int(counts[k])) for k in order]
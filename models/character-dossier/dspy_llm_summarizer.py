@@ -0,0 +1,63 @@
+"""
+Character summaries written by an LM through DSPy.
+
+LLMSummarizer implements the Summarizer interface of summaries.py: every call
+asks the LM to update the previous summary of a character with the passages
+of the following scenes, so the checkpoints and the result cache of
+SummaryEngine work the same as with ExtractiveSummarizer, which stays the
+offline fallback. The LM is set up as in characters-in-scene: dspy.LM with
+the key from anthropic-api-key.secret, or any LM passed in, like
+dspy.utils.DummyLM in tests.
+"""
+from typing import List
+
+import dspy
+
+
+class SummaryUpdate(dspy.Signature):
+    """Update the summary of a character of a book with the passages that follow it.
+    Use only the previous summary and the passages; never mention anything that happens later in the book."""
+
+    character: str = dspy.InputField(desc="Name of the character")
+    aliases: List[str] = dspy.InputField(desc="Other names of the character in the book")
+    previous_summary: str = dspy.InputField(desc="Summary of the character so far, empty before the first passages")
+    passages: List[str] = dspy.InputField(desc="The following scenes of the book that involve the character, in order")
+    summary: str = dspy.OutputField(desc="The updated summary of the character, a few sentences long")
+
+
+# Using Anthropic's Claude model, as characters-in-scene does
+MODEL = "anthropic/claude-opus-4-20250514"
+
+
+def signature_fields(signature):
+    return {name: field.json_schema_extra["desc"] for name, field in signature.fields.items()}
+
+
+def create_lm(model: str = MODEL):
+    # Load API key from secret file
+    with open("anthropic-api-key.secret", "r") as f:
+        api_key = f.read().strip()
+
+    return dspy.LM(model, api_key=api_key)
+
+
+class LLMSummarizer:
+    """Summarizer that has an LM update each summary with the passages since it."""
+
+    def __init__(self, lm=None, model: str = MODEL):
+        self.lm = lm if lm is not None else create_lm(model)
+        self.predictor = dspy.Predict(SummaryUpdate)
+        # Prompt and model, so cached summaries are dropped when either changes
+        self.identity = {
+            "summarizer": "dspy",
+            "module": "Predict",
+            "signature": SummaryUpdate.__name__,
+            "instructions": SummaryUpdate.instructions,
+            "fields": signature_fields(SummaryUpdate),
+            "model": self.lm.model,
+        }
+
+    def summarize(self, name: str, aliases: List[str], previous: str, passages: List[str]) -> str:
+        with dspy.context(lm=self.lm):
+            result = self.predictor(character=name, aliases=aliases, previous_summary=previous, passages=passages)
+        return result.summary.strip()
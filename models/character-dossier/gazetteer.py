@@ -0,0 +1,96 @@
+"""
+Alias gazetteer that finds known character names without the transformer.
+
+Once a book has been through NER, the names and aliases of its characters are
+known. The gazetteer finds them with spaCy's PhraseMatcher on a blank English
+tokenizer, so a scene is scanned at tokenizer speed. A scene counts as
+explained when every capitalized word in it is part of a known name or an
+ordinary word opening a sentence or quote: a stop word, a common interjection
+or a word the scene also uses in lower case. Only scenes that are not
+explained need the transformer.
+
+The same module is kept in characters-in-scene and character-dossier;
+test_shared_modules.py there fails when the copies differ.
+"""
+from typing import Iterable, Iterator, List, Optional, Tuple
+import hashlib
+
+
+# Tokens after which a capitalized word is expected anyway
+SENTENCE_OPENERS = {".", "!", "?", "...", "…", ":", ";", '"', "“", "‘", "(", "—", "--"}
+ALWAYS_CAPITALIZED = {"I"}
+# Sentence openers that are not spaCy stop words but rarely names
+INTERJECTIONS = {"oh", "ah", "o", "yes", "alas", "hush", "dear"}
+# Version of the matching rules, part of the gazetteer's cache identity
+GAZETTEER_VERSION = 2
+
+
+def opens_sentence(token) -> bool:
+    """True if token starts the text, a paragraph or a sentence."""
+    i = token.i - 1
+    while i >= 0 and token.doc[i].is_space:
+        if "\n" in token.doc[i].text:
+            return True
+        i -= 1
+    if i < 0:
+        return True
+
+    return token.doc[i].text in SENTENCE_OPENERS
+
+
+def ordinary_opener(token, lower_words: set) -> bool:
+    """True if token opens a sentence and is a stop word, an interjection or a word the text uses in lower case."""
+    return opens_sentence(token) and (token.is_stop or token.lower_ in INTERJECTIONS or token.lower_ in lower_words)
+
+
+class AliasGazetteer:
+    """Known character names, matched as PERSON spans."""
+
+    def __init__(self, names: Iterable[str]):
+        import spacy
+        from spacy.matcher import PhraseMatcher
+
+        self.names = sorted({name for name in names if name.strip()})
+        self.nlp = spacy.blank("en")
+        self.matcher = PhraseMatcher(self.nlp.vocab)
+        self.matcher.add("PERSON", list(self.nlp.tokenizer.pipe(self.names)))
+
+    def identity(self):
+        """Identify the gazetteer by its names, for result caching."""
+        digest = hashlib.sha256("\n".join(self.names).encode("utf-8")).hexdigest()
+        return {"extractor": "gazetteer", "version": GAZETTEER_VERSION, "names": digest, "count": len(self.names)}
+
+    def match_doc(self, doc) -> Tuple[List, List]:
+        """
+        PERSON spans of the known names in doc, longest match first where they
+        overlap, and the capitalized words they leave unexplained: those that
+        are neither part of a known name nor an ordinary_opener. A name
+        opening a sentence ("Bill was coming") or a quote ("“Bill!”") is
+        unexplained, as it may be a character the gazetteer does not know.
+        """
+        from spacy.tokens import Span
+        from spacy.util import filter_spans
+
+        spans = filter_spans([Span(doc, start, end, label="PERSON") for _, start, end in self.matcher(doc)])
+        covered = {i for span in spans for i in range(span.start, span.end)}
+        lower_words = {token.lower_ for token in doc if token.is_lower}
+        unexplained = [token for token in doc
+                       if token.i not in covered and token.is_title and token.text not in ALWAYS_CAPITALIZED
+                       and not ordinary_opener(token, lower_words)]
+        return spans, unexplained
+
+    def scan_doc(self, doc) -> Optional[List]:
+        """
+        PERSON spans of the known names in doc, longest match first where they overlap.
+
+        None if doc has a capitalized word that is neither a known name nor an
+        ordinary sentence opener, since it may be a character the gazetteer
+        does not know yet.
+        """
+        spans, unexplained = self.match_doc(doc)
+        return None if unexplained else spans
+
+    def scan(self, texts: Iterable[str]) -> Iterator[Optional[List]]:
+        """scan_doc for many texts. Yields in input order."""
+        for doc in self.nlp.tokenizer.pipe(texts):
+            yield self.scan_doc(doc)
@@ -1,123 +1,54 @@
 import json
 from pathlib import Path
-import sys
 import click
-import spacy
-from dataclasses import dataclass, asdict
-from typing import List, Tuple
+from dataclasses import asdict
 import logging
+from cooccurrence import END, CooccurrenceIndex
+from registry import CharacterRegistry
+from registrystore import RegistryFile, load_registry, write_registry
+from resultcache import ResultCache
+from retrieval import SearchIndex
+from scenestore import SceneStore, is_scene_store, scene_sort_key
+from summaries import DEFAULT_CHECKPOINT_EVERY, ExtractiveSummarizer, SummaryEngine
+from service import DEFAULT_BUCKET_SIZE, DEFAULT_CACHE_SIZE, DossierService, create_server
+from tracing import LEVELS, collector, configure
+from tracker import DEFAULT_BATCH_SIZE, DEFAULT_N_PROCESS, CharacterTracker, registry_gazetteer
+from whoshere import DEFAULT_PAGE_SIZE, write_bundle
 
 logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.INFO)
 
-@dataclass
-class Mention:
-    start: int
-    end: int
-    text: str
-    context: str
-
-@dataclass
-class Character:
-    primary_name: str
-    aliases: List[str]
-    first_appearance: int
-    mentions: List[Mention]
-
-class CharacterRegistry:
-    def __init__(self):
-        self.metadata = {}
-        self.characters = {}
-
-    def add_character(self, char_id: str, character: Character):
-        self.characters[char_id] = character
-
-    def save_to_json(self, filepath: str):
-        data = {
-            "book_metadata": self.metadata,
-            "characters": {
-                cid: {
-                    "primary_name": ch.primary_name,
-                    "aliases": ch.aliases,
-                    "first_appearance": ch.first_appearance,
-                    "mentions": [asdict(m) for m in ch.mentions]
-                } for cid, ch in self.characters.items()
-            }
-        }
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
-
-    @staticmethod
-    def load_from_json(filepath: str) -> 'CharacterRegistry':
-        with open(filepath) as f:
-            data = json.load(f)
-        reg = CharacterRegistry()
-        reg.metadata = data.get("book_metadata", {})
-        for cid, cdata in data.get("characters", {}).items():
-            mentions = [Mention(**m) for m in cdata.get("mentions", [])]
-            char = Character(cdata["primary_name"], cdata["aliases"], cdata["first_appearance"], mentions)
-            reg.add_character(cid, char)
-        return reg
-
-class SpacyProcessor:
-    def __init__(self):
-        logging.info("Loading spaCy model 'en_core_web_trf'")
-        self.nlp = spacy.load("en_core_web_trf")
-
-        # Debug: print pipeline components before adding coref
-        logging.info(f"Pipeline components before coref: {self.nlp.pipe_names}")
-
-        logging.info("Loading pre-trained coreference model")
-        # Load the pre-trained coreference model instead of adding experimental component
-        self.coref_nlp = spacy.load("en_coreference_web_trf")
-        logging.info("Pre-trained coreference model loaded successfully")
-
-    def extract_entities_and_coref(self, text: str) -> Tuple[List, List]:
-        # Use main NLP model for NER
-        doc = self.nlp(text)
-
-        # Debug: print all entities with their labels
-        logging.info(f"All entities found: {[(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in doc.ents]}")
-        print(json.dumps(doc.to_json(), indent=2))
-
-        persons = [ent for ent in doc.ents if ent.label_ == "PERSON"]
-
-        # Use separate coref model
-        coref_doc = self.coref_nlp(text)
-        coref = coref_doc.spans.get("coref_clusters", [])
-
-        return persons, coref
-
-class CharacterTracker:
-    def __init__(self):
-        self.processor = SpacyProcessor()
-        self.registry = CharacterRegistry()
-
-    def process_scene(self, text: str):
-        logging.info(f"Processing scene text of length {len(text)} ({text[:50]}...)")
-        # Process a single scene text and extract character mentions
-        persons, _ = self.processor.extract_entities_and_coref(text)
-        logging.info(f"Found {len(persons)} person entities in scene")
-        for ent in persons:
-            logging.info(f"Entity '{ent.text}' at tokens {ent.start_char}-{ent.end_char}")
-            cid = ent.text.lower().replace(' ', '_')
-            if cid not in self.registry.characters:
-                logging.info(f"Adding new character '{ent.text}' with id '{cid}' at position {ent.start}")
-                self.registry.add_character(cid, Character(ent.text, [ent.text], ent.start_char, []))
-
-            # TODO: this should be the whole sentence actually
-            context = text[max(ent.start_char-5, 0):ent.end_char+5]
-            mention = Mention(ent.start_char, ent.end_char, ent.text, context)
-            self.registry.characters[cid].mentions.append(mention)
-
-    def get_character_at_position(self, registry: CharacterRegistry, char_name: str, position: int):
-        for ch in registry.characters.values():
-            if ch.primary_name.lower() == char_name.lower():
-                safe = [m for m in ch.mentions if m.start_token <= position]
-                return Character(ch.primary_name, ch.aliases, ch.first_appearance, safe)
-        return None
-
-    def list_characters(self, registry: CharacterRegistry, position: int):
-        return [ch.primary_name for ch in registry.characters.values() if ch.first_appearance <= position]
+
+def read_scene_data(scene_dir: str):
+    """(scene id, scene data) of every scene in a store, JSON file or directory of JSON files, in reading order."""
+    if is_scene_store(scene_dir):
+        with SceneStore(scene_dir) as store:
+            return [(f"scene_{number:03d}", scene) for number, scene in store.items()]
+
+    if scene_dir.endswith(".json"):
+        scene_files = [Path(scene_dir)]
+    else:
+        scene_files = sorted(Path(scene_dir).glob("*.json"), key=scene_sort_key)
+
+    scenes = []
+    for scene_file in scene_files:
+        with open(scene_file) as f:
+            scenes.append((scene_file.stem, json.load(f)))
+    return scenes
+
+
+def read_scenes(scene_dir: str):
+    """(scene id, scene text) of every scene in a store, JSON file or directory of JSON files, in reading order."""
+    return [(scene_id, scene.get("scene_text", "")) for scene_id, scene in read_scene_data(scene_dir)]
+
+
+def load_previous(path: str) -> CharacterRegistry:
+    """Load an earlier build of a registry fully into memory, so path can be overwritten."""
+    registry = load_registry(path)
+    if isinstance(registry, RegistryFile):
+        with registry:
+            return registry.to_registry()
+    return registry
+
 
 # CLI
 # Remove placeholder main
@@ -128,26 +59,49 @@ def cli():
 
 @cli.command()
 @click.argument('scene-dir', type=click.Path(exists=True))
-@click.option('--output', '-o', default='characters.json')
-def process(scene_dir, output):
-    """Process book and extract character data"""
+@click.option('--output', '-o', default='characters.json',
+              help='Character data file; written as a compact registry file unless it ends in .json')
+@click.option('--no-cache', is_flag=True, help='Rerun NER on every scene instead of reusing cached results')
+@click.option('--full', is_flag=True, help='Rebuild from scratch instead of reusing unchanged scenes of the existing output')
+@click.option('--gazetteer', is_flag=True,
+              help="Match the existing output's character names in changed scenes, running NER only where they do not explain a scene")
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True, help='Scenes per nlp.pipe batch')
+@click.option('--n-process', type=int, default=DEFAULT_N_PROCESS, show_default=True, help='Processes used by nlp.pipe')
+@click.option('--trace', type=click.Path(dir_okay=False),
+              help='Append a JSONL record of every traced stage and scene to this file')
+@click.option('--trace-level', type=click.Choice(sorted(LEVELS)), default='spans', show_default=True,
+              help='What --trace and --profile record; debug adds every spaCy doc')
+@click.option('--profile', is_flag=True, help='Print the time spent per stage and the costliest scenes')
+def process(scene_dir, output, no_cache, full, gazetteer, batch_size, n_process, trace, trace_level, profile):
+    """Process book and extract character data
+
+    SCENE_DIR is a scene JSON file, a directory of scene JSON files or a scene store.
+    """
     logging.info(f"Starting process command: scene-dir={scene_dir}, output={output}")
-    tracker = CharacterTracker()
+    tracer = configure(trace, trace_level, collect=profile)
+    with tracer.span("load", path=output):
+        previous = load_previous(output) if Path(output).exists() and not full else None
+    tracker = CharacterTracker(cache=None if no_cache else ResultCache(), previous=previous)
 
-    if scene_dir.endswith(".json"):
-        with open(scene_dir) as f:
-            text = json.load(f).get("scene_text", "")
-            tracker.process_scene(text)
-    else:
-        for scene_file in Path(scene_dir).glob("*.json"):
-            with open(scene_file) as f:
-                text = json.load(f).get("scene_text", "")
-                tracker.process_scene(text)
+    with tracer.span("load", path=scene_dir):
+        scenes = read_scenes(scene_dir)
+    changed = tracker.process_scenes(scenes, batch_size=batch_size, n_process=n_process,
+                                     gazetteer=registry_gazetteer(previous) if gazetteer and previous else None)
+    click.echo(f"Processed {changed} new or changed scenes, reused {len(scenes) - changed}")
 
     # TODO:
     #tracker.registry.metadata = {"title": book_file, "total_tokens": len(text.split()), "processed_date": ""}
-    tracker.registry.save_to_json(output)
+    with tracer.span("write", path=output):
+        if output.endswith(".json"):
+            tracker.registry.save_to_json(output)
+        else:
+            write_registry(tracker.registry, output)
     click.echo(f"Saved character data to {output}")
+    if tracker.cache is not None:
+        click.echo(f"Result cache: {tracker.cache.hits} hits, {tracker.cache.misses} misses")
+    if profile:
+        click.echo(collector(tracer).summary())
+    tracer.close()
 
 @cli.command()
 @click.option('--book', required=True, type=click.Path(exists=True), help='Character data file')
@@ -155,9 +109,8 @@ def process(scene_dir, output):
 @click.option('--position', type=int, required=True, help='Reading position')
 def query(book, character, position):
     """Get character history up to position"""
-    reg = CharacterRegistry.load_from_json(book)
-    tracker = CharacterTracker()
-    result = tracker.get_character_at_position(reg, character, position)
+    reg = load_registry(book)
+    result = reg.character_at(character, position)
     if result:
         click.echo(json.dumps(asdict(result), indent=2))
     else:
@@ -168,10 +121,191 @@ def query(book, character, position):
 @click.option('--position', type=int, required=True, help='Reading position')
 def list_characters_cmd(book, position):
     """List all characters known at position"""
-    reg = CharacterRegistry.load_from_json(book)
-    tracker = CharacterTracker()
-    names = tracker.list_characters(reg, position)
+    reg = load_registry(book)
+    names = reg.names_at(position)
     click.echo("\n".join(names))
 
+@cli.command()
+@click.option('--book', 'books', required=True, multiple=True, metavar='NAME=PATH',
+              help='Book name and its character data file; repeat for more books')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', type=int, default=8765, show_default=True)
+@click.option('--bucket-size', type=int, default=DEFAULT_BUCKET_SIZE, show_default=True,
+              help='Reading positions per cached result')
+@click.option('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, show_default=True,
+              help='Cached results kept in memory')
+def serve(books, host, port, bucket_size, cache_size):
+    """Answer query and list requests over HTTP, keeping registries loaded"""
+    paths = {}
+    for book in books:
+        name, sep, path = book.partition('=')
+        if not sep or not Path(path).exists():
+            raise click.BadParameter(f"Expected NAME=PATH of an existing file, got {book}", param_hint='--book')
+        paths[name] = path
+
+    server = create_server(DossierService(paths, bucket_size, cache_size), host, port)
+    click.echo(f"Serving {', '.join(paths)} on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+@cli.command()
+@click.argument('scene-dir', type=click.Path(exists=True))
+@click.option('--output', '-o', default='whoshere.twhere', show_default=True, help='Bundle file')
+@click.option('--page-size', type=int, default=DEFAULT_PAGE_SIZE, show_default=True,
+              help='Scenes per page the app loads at once')
+@click.option('--mentioned', is_flag=True, help='Also list characters only mentioned in a scene')
+def whoshere(scene_dir, output, page_size, mentioned):
+    """Export the characters of every scene as a compact bundle for the app
+
+    SCENE_DIR is a scene JSON file, a directory of scene JSON files or a scene store.
+    """
+    fields = ("characters_present", "characters_mentioned") if mentioned else ("characters_present",)
+    size = write_bundle((scene for _, scene in read_scene_data(scene_dir)), output, page_size, fields)
+    click.echo(f"Wrote {size['scenes']} scenes, {size['characters']} characters in {size['pages']} pages "
+               f"to {output} ({Path(output).stat().st_size} bytes)")
+
+@cli.group()
+def cooccurrence():
+    """Who shared scenes with whom, from the characters-in-scene fields of the scenes"""
+    pass
+
+@cooccurrence.command(name='build')
+@click.argument('scene-dir', type=click.Path(exists=True))
+@click.option('--output', '-o', default='cooccurrence.npz', show_default=True, help='Index file')
+@click.option('--mentioned', is_flag=True, help='Also count characters only mentioned in a scene as being in it')
+def cooccurrence_build(scene_dir, output, mentioned):
+    """Index the characters of every scene
+
+    SCENE_DIR is a scene JSON file, a directory of scene JSON files or a scene store.
+    """
+    fields = ("characters_present", "characters_mentioned") if mentioned else ("characters_present",)
+    index = CooccurrenceIndex.build((scene for _, scene in read_scene_data(scene_dir)), fields)
+    index.save(output)
+    click.echo(f"Indexed {len(index.names)} characters in {index.scene_count} scenes, "
+               f"{len(index.arrays['pair_keys'])} pairs, to {output}")
+
+def load_cooccurrence(path, *characters):
+    index = CooccurrenceIndex.load(path)
+    for name in characters:
+        if name is not None and index.find(name) is None:
+            raise click.BadParameter(f"Character {name} not found")
+    return index
+
+@cooccurrence.command(name='met')
+@click.option('--index', 'index_path', required=True, type=click.Path(exists=True), help='Co-occurrence index file')
+@click.option('--character', required=True, help='Character name')
+@click.option('--scene', type=int, default=END, help='Count scenes up to this scene number [default: all]')
+@click.option('--before', 'before', help='Only those met before first sharing a scene with this character')
+def cooccurrence_met(index_path, character, scene, before):
+    """List who a character shared scenes with, in the order they first met"""
+    index = load_cooccurrence(index_path, character, before)
+    if before is not None:
+        first = index.first_met(character, before)
+        if first is None:
+            raise click.BadParameter(f"{character} and {before} never share a scene", param_hint='--before')
+        scene = min(scene, first - 1)
+
+    for partner, first, shared in index.met(character, scene):
+        click.echo(f"{partner}\tfirst in scene {first}\t{shared} scene(s) together")
+
+@cooccurrence.command(name='pairs')
+@click.option('--index', 'index_path', required=True, type=click.Path(exists=True), help='Co-occurrence index file')
+@click.option('--scene', type=int, default=END, help='Count scenes up to this scene number [default: all]')
+@click.option('--top', type=int, default=20, show_default=True, help='Number of pairs to list')
+def cooccurrence_pairs(index_path, scene, top):
+    """List the pairs of characters sharing the most scenes"""
+    index = load_cooccurrence(index_path)
+    for a, b, shared in index.pair_counts(scene)[:top]:
+        click.echo(f"{a}\t{b}\t{shared}")
+
+@cli.group()
+def search():
+    """Spoiler-bounded full-text search over the scene texts"""
+    pass
+
+@search.command(name='build')
+@click.argument('scene-dir', type=click.Path(exists=True))
+@click.option('--output', '-o', default='search.json', show_default=True, help='Index file')
+@click.option('--full', is_flag=True, help='Rebuild from scratch instead of reusing unchanged scenes of the existing index')
+def search_build(scene_dir, output, full):
+    """Index the text of every scene
+
+    SCENE_DIR is a scene JSON file, a directory of scene JSON files or a scene store.
+    """
+    previous = SearchIndex.load(output) if not full and Path(output).exists() else None
+    index, tokenized = SearchIndex.build(read_scenes(scene_dir), previous)
+    index.save(output)
+    click.echo(f"Indexed {len(index)} scenes ({tokenized} new or changed), "
+               f"{len(index.postings)} terms, to {output}")
+
+@search.command(name='query')
+@click.argument('text')
+@click.option('--index', 'index_path', required=True, type=click.Path(exists=True), help='Search index file')
+@click.option('--scene', type=int, default=END, help='Only search scenes up to this scene number [default: all]')
+@click.option('--top', type=int, default=5, show_default=True, help='Number of passages to list')
+def search_query(text, index_path, scene, top):
+    """List the passages best matching TEXT, best first"""
+    index = SearchIndex.load(index_path)
+    for hit in index.search(text, scene, top):
+        passage = " ".join(hit.passage.split())
+        click.echo(f"{hit.scene_id}\t{hit.score:.2f}\t{hit.position}\t{passage}")
+
+def llm_summarizer():
+    # dspy is only imported when summaries are written by an LM
+    from dspy_llm_summarizer import LLMSummarizer
+    try:
+        return LLMSummarizer()
+    except FileNotFoundError:
+        raise click.UsageError("The llm summarizer needs anthropic-api-key.secret; "
+                               "use --summarizer extractive to summarize offline")
+
+SUMMARIZERS = {"extractive": ExtractiveSummarizer, "llm": llm_summarizer}
+
+def summary_engine(scene_dir, summarizer, checkpoint_every, no_cache):
+    scenes = [scene for _, scene in read_scene_data(scene_dir)]
+    return SummaryEngine(scenes, SUMMARIZERS[summarizer](), None if no_cache else ResultCache(), checkpoint_every)
+
+def summary_options(command):
+    command = click.option('--summarizer', type=click.Choice(sorted(SUMMARIZERS)), default='extractive',
+                           show_default=True, help='Model updating the summaries')(command)
+    command = click.option('--checkpoint-every', type=int, default=DEFAULT_CHECKPOINT_EVERY, show_default=True,
+                           help="Checkpoint the summary every this many of the character's scenes")(command)
+    command = click.option('--no-cache', is_flag=True, help='Summarize again instead of reusing cached summaries')(command)
+    return click.argument('scene-dir', type=click.Path(exists=True))(command)
+
+@cli.group()
+def summaries():
+    """Spoiler-safe character summaries, rolled forward from checkpoints"""
+    pass
+
+@summaries.command(name='build')
+@summary_options
+def summaries_build(scene_dir, summarizer, checkpoint_every, no_cache):
+    """Precompute the summary checkpoints of every character into the cache
+
+    SCENE_DIR is a scene JSON file, a directory of scene JSON files or a scene store.
+    """
+    engine = summary_engine(scene_dir, summarizer, checkpoint_every, no_cache)
+    checkpoints = sum(engine.precompute(cid) for cid in engine.names)
+    click.echo(f"{checkpoints} checkpoints of {len(engine.names)} characters, "
+               f"{engine.calls} summarizer calls on {engine.scenes_sent} scenes")
+
+@summaries.command(name='query')
+@summary_options
+@click.option('--character', required=True, help='Character name')
+@click.option('--position', type=int, required=True, help='Reading position')
+def summaries_query(scene_dir, summarizer, checkpoint_every, no_cache, character, position):
+    """Summarize a character from the text up to a reading position"""
+    engine = summary_engine(scene_dir, summarizer, checkpoint_every, no_cache)
+    if engine.find(character) is None:
+        raise click.BadParameter(f"Character {character} not found")
+    summary = engine.summary(character, position)
+    click.echo(summary if summary is not None else f"{character} has not appeared by position {position}")
+    logging.info(f"{engine.calls} summarizer calls on {engine.scenes_sent} scenes")
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,144 @@
+"""
+Character data of a book and position queries on it.
+
+Kept free of spaCy so commands that only read characters.json start quickly.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+import json
+
+
+def character_id(name: str) -> str:
+    """Id of the character with this primary name: lower-cased, spaces as underscores."""
+    return name.lower().replace(' ', '_')
+
+
+@dataclass
+class Mention:
+    start: int
+    end: int
+    text: str
+    context: str
+
+@dataclass
+class Character:
+    primary_name: str
+    aliases: List[str]
+    first_appearance: int
+    mentions: List[Mention]
+
+class CharacterRegistry:
+    """
+    Characters of a book by id, with an index for position queries.
+
+    The index maps case-folded ids, names and aliases to character ids and
+    keeps every character's mention starts and all first appearances sorted,
+    so queries at a reading position are dictionary lookups and bisects. It
+    is built on first query and dropped by add_character/add_mention.
+    """
+
+    def __init__(self):
+        self.metadata = {}
+        self.characters = {}
+        self._index = None
+
+    def add_character(self, char_id: str, character: Character):
+        self.characters[char_id] = character
+        self._index = None
+
+    def add_mention(self, char_id: str, mention: Mention):
+        self.characters[char_id].mentions.append(mention)
+        self._index = None
+
+    def save_to_json(self, filepath: str):
+        data = {
+            "book_metadata": self.metadata,
+            "characters": {
+                cid: {
+                    "primary_name": ch.primary_name,
+                    "aliases": ch.aliases,
+                    "first_appearance": ch.first_appearance,
+                    "mentions": [asdict(m) for m in ch.mentions]
+                } for cid, ch in self.characters.items()
+            }
+        }
+        with open(filepath, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    @staticmethod
+    def load_from_json(filepath: str) -> 'CharacterRegistry':
+        with open(filepath) as f:
+            data = json.load(f)
+        reg = CharacterRegistry()
+        reg.metadata = data.get("book_metadata", {})
+        for cid, cdata in data.get("characters", {}).items():
+            mentions = [Mention(**m) for m in cdata.get("mentions", [])]
+            char = Character(cdata["primary_name"], cdata["aliases"], cdata["first_appearance"], mentions)
+            reg.add_character(cid, char)
+        reg.index()
+        return reg
+
+    def index(self) -> "RegistryIndex":
+        """The position index, built now if the registry changed since the last query."""
+        if self._index is None:
+            self._index = RegistryIndex(self.characters)
+        return self._index
+
+    def find(self, char_name: str) -> Optional[str]:
+        """Id of the character with this id, name or alias (case-insensitive), or None."""
+        return self.index().ids.get(char_name.casefold())
+
+    def character_at(self, char_name: str, position: int) -> Optional[Character]:
+        """
+        The character called char_name with only the mentions up to position.
+
+        None if no character has that name or it has not appeared by position.
+        """
+        cid = self.find(char_name)
+        if cid is None:
+            return None
+
+        ch = self.characters[cid]
+        if ch.first_appearance > position:
+            return None
+
+        index = self.index()
+        safe = index.mentions[cid][:bisect_right(index.mention_starts[cid], position)]
+        return Character(ch.primary_name, ch.aliases, ch.first_appearance, safe)
+
+    def ids_at(self, position: int) -> List[str]:
+        """Ids of all characters that have appeared by position, in order of first appearance."""
+        index = self.index()
+        return index.first_ids[:bisect_right(index.first_appearances, position)]
+
+    def names_at(self, position: int) -> List[str]:
+        """Primary names of all characters that have appeared by position, in order of first appearance."""
+        return [self.characters[cid].primary_name for cid in self.ids_at(position)]
+
+
+class RegistryIndex:
+    """Lookup tables derived from a registry's characters; see CharacterRegistry."""
+
+    def __init__(self, characters: Dict[str, Character]):
+        self.ids: Dict[str, str] = {}
+        # Primary names win over ids and ids over aliases, so an alias shared
+        # by two characters never hides another character's own name
+        for cid, ch in characters.items():
+            self.ids.setdefault(ch.primary_name.casefold(), cid)
+        for cid in characters:
+            self.ids.setdefault(cid.casefold(), cid)
+        for cid, ch in characters.items():
+            for alias in ch.aliases:
+                self.ids.setdefault(alias.casefold(), cid)
+
+        self.mentions: Dict[str, List[Mention]] = {}
+        self.mention_starts: Dict[str, List[int]] = {}
+        for cid, ch in characters.items():
+            mentions = sorted(ch.mentions, key=lambda m: m.start)
+            self.mentions[cid] = mentions
+            self.mention_starts[cid] = [m.start for m in mentions]
+
+        first = sorted((ch.first_appearance, cid) for cid, ch in characters.items())
+        self.first_appearances = [position for position, _ in first]
+        self.first_ids = [cid for _, cid in first]
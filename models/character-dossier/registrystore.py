@@ -0,0 +1,339 @@
+"""
+Compact columnar file format for character registries.
+
+characters.json stores every mention as its own JSON object and loading it
+allocates one Mention per mention. A registry file instead keeps all strings
+(ids, names, aliases, mention texts and contexts) once in a string table and
+every other field in typed columns, so it is a fraction of the size and is
+opened by memory-mapping it: only the per-character records are built on
+load. A character's mentions are read from the columns the first time a
+query returns them and kept for later queries, which then cost a slice like
+those of CharacterRegistry.
+
+File layout (all integers little-endian, every section 8-byte aligned):
+
+    header    magic "TWREGIS1", u32 version, u32 character count,
+              then u64 offset, u64 length per section in SECTIONS order
+    metadata  UTF-8 JSON book metadata
+    strings   UTF-8 string data; string_offsets (u64, count + 1) delimit it
+    characters, one row each: char_ids, char_names (u32 string ids),
+              char_first (i64), alias_offsets (u32, count + 1) into aliases
+              (u32 string ids), mention_offsets (u64, count + 1) into
+    mentions, sorted by start within each character: mention_starts,
+              mention_ends (i64), mention_texts, mention_contexts (u32)
+    first_order   character rows sorted by first appearance (u32), with
+              first_sorted holding their first appearances (i64)
+
+Usage:
+    python registrystore.py export <registry-file> <characters.json>
+    python registrystore.py import <characters.json> <registry-file>
+"""
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+
+from registry import Character, CharacterRegistry, Mention
+
+
+MAGIC = b"TWREGIS1"
+VERSION = 1
+
+# Section name and array typecode; "B" sections are raw bytes
+SECTIONS = (
+    ("metadata", "B"),
+    ("strings", "B"),
+    ("string_offsets", "Q"),
+    ("char_ids", "I"),
+    ("char_names", "I"),
+    ("char_first", "q"),
+    ("alias_offsets", "I"),
+    ("aliases", "I"),
+    ("mention_offsets", "Q"),
+    ("mention_starts", "q"),
+    ("mention_ends", "q"),
+    ("mention_texts", "I"),
+    ("mention_contexts", "I"),
+    ("first_order", "I"),
+    ("first_sorted", "q"),
+)
+HEADER = struct.Struct("<8sII" + "QQ" * len(SECTIONS))
+
+
+def is_registry_file(path) -> bool:
+    """Return True if path is a compact registry file."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IsADirectoryError, FileNotFoundError, PermissionError):
+        return False
+
+
+class StringTable:
+    """Interns strings while a registry file is written."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+
+    def add(self, text: str) -> int:
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.ids)
+            self.data += text.encode("utf-8")
+            self.offsets.append(len(self.data))
+        return string_id
+
+
+def write_registry(registry: CharacterRegistry, path):
+    """Write registry to path in the compact format, replacing any existing file atomically."""
+    strings = StringTable()
+    columns = {name: array(typecode) for name, typecode in SECTIONS if typecode != "B"}
+    columns["alias_offsets"].append(0)
+    columns["mention_offsets"].append(0)
+
+    index = registry.index()
+    rows = {}
+    for cid, ch in registry.characters.items():
+        rows[cid] = len(rows)
+        columns["char_ids"].append(strings.add(cid))
+        columns["char_names"].append(strings.add(ch.primary_name))
+        columns["char_first"].append(ch.first_appearance)
+        columns["aliases"].extend(strings.add(alias) for alias in ch.aliases)
+        columns["alias_offsets"].append(len(columns["aliases"]))
+
+        for m in index.mentions[cid]:
+            columns["mention_starts"].append(m.start)
+            columns["mention_ends"].append(m.end)
+            columns["mention_texts"].append(strings.add(m.text))
+            columns["mention_contexts"].append(strings.add(m.context))
+        columns["mention_offsets"].append(len(columns["mention_starts"]))
+
+    columns["first_order"].extend(rows[cid] for cid in index.first_ids)
+    columns["first_sorted"].extend(index.first_appearances)
+    columns["string_offsets"] = strings.offsets
+
+    sections = {
+        "metadata": json.dumps(registry.metadata, ensure_ascii=False).encode("utf-8"),
+        "strings": bytes(strings.data),
+    }
+    for name, column in columns.items():
+        if sys.byteorder != "little":
+            column.byteswap()
+        sections[name] = column.tobytes()
+
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(bytes(HEADER.size))
+        table = []
+        for name, _ in SECTIONS:
+            f.write(bytes(-f.tell() % 8))
+            table += [f.tell(), len(sections[name])]
+            f.write(sections[name])
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(rows), *table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CharacterRecord:
+    """One character of a registry file; its mentions stay in the file's columns."""
+
+    __slots__ = ("char_id", "primary_name", "aliases", "first_appearance", "mention_start", "mention_end")
+
+    def __init__(self, char_id, primary_name, aliases, first_appearance, mention_start, mention_end):
+        self.char_id = char_id
+        self.primary_name = primary_name
+        self.aliases = aliases
+        self.first_appearance = first_appearance
+        self.mention_start = mention_start
+        self.mention_end = mention_end
+
+
+class RegistryFile:
+    """
+    A memory-mapped registry file, answering the same position queries as CharacterRegistry.
+
+    Use as a context manager or call close() when done.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, *table = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"Not a registry file: {self.path}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported registry file version {version}: {self.path}")
+
+        self._views = []
+        self._columns = {}
+        self._strings: Dict[int, str] = {}
+        for (name, typecode), offset, length in zip(SECTIONS, table[0::2], table[1::2]):
+            self._columns[name] = self._column(typecode, offset, length)
+
+        self.metadata = json.loads(bytes(self._columns["metadata"]).decode("utf-8"))
+
+        char_names = self._columns["char_names"]
+        char_first = self._columns["char_first"]
+        alias_offsets = self._columns["alias_offsets"]
+        aliases = self._columns["aliases"]
+        mention_offsets = self._columns["mention_offsets"]
+
+        self.characters: Dict[str, CharacterRecord] = {}
+        for row, id_string in enumerate(self._columns["char_ids"]):
+            cid = self._string(id_string)
+            self.characters[cid] = CharacterRecord(
+                cid,
+                self._string(char_names[row]),
+                [self._string(aliases[i]) for i in range(alias_offsets[row], alias_offsets[row + 1])],
+                char_first[row],
+                mention_offsets[row],
+                mention_offsets[row + 1],
+            )
+        if len(self.characters) != count:
+            raise ValueError(f"Corrupt registry file, {len(self.characters)} of {count} characters: {self.path}")
+
+        # Same precedence as RegistryIndex: names, then ids, then aliases
+        self._ids: Dict[str, str] = {}
+        for cid, record in self.characters.items():
+            self._ids.setdefault(record.primary_name.casefold(), cid)
+        for cid in self.characters:
+            self._ids.setdefault(cid.casefold(), cid)
+        for cid, record in self.characters.items():
+            for alias in record.aliases:
+                self._ids.setdefault(alias.casefold(), cid)
+        self._row_ids = list(self.characters)
+        # Ids and names in order of first appearance, sliced by ids_at and names_at
+        self._first_ids = [self._row_ids[row] for row in self._columns["first_order"]]
+        self._first_names = [self.characters[cid].primary_name for cid in self._first_ids]
+        # Decoded mentions of the characters queried so far
+        self._mentions: Dict[str, List[Mention]] = {}
+
+    def _column(self, typecode: str, offset: int, length: int):
+        view = memoryview(self._mmap)[offset:offset + length]
+        self._views.append(view)
+        if typecode == "B":
+            return view
+        if sys.byteorder == "little":
+            column = view.cast(typecode)
+            self._views.append(column)
+            return column
+        column = array(typecode)
+        column.frombytes(view)
+        column.byteswap()
+        return column
+
+    def _string(self, string_id: int) -> str:
+        text = self._strings.get(string_id)
+        if text is None:
+            offsets = self._columns["string_offsets"]
+            text = str(self._columns["strings"][offsets[string_id]:offsets[string_id + 1]], "utf-8")
+            self._strings[string_id] = text
+        return text
+
+    def __enter__(self) -> "RegistryFile":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views into the map have to be released before it can be closed
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._columns = {}
+        self._mmap.close()
+        self._file.close()
+
+    def find(self, char_name: str) -> Optional[str]:
+        """Id of the character with this id, name or alias (case-insensitive), or None."""
+        return self._ids.get(char_name.casefold())
+
+    def mentions(self, char_id: str, position: Optional[int] = None) -> List[Mention]:
+        """Mentions of a character in book order, only those starting at or before position if given."""
+        record = self.characters[char_id]
+        mentions = self._mentions.get(char_id)
+        if mentions is None:
+            rows = slice(record.mention_start, record.mention_end)
+            columns = [self._columns[name][rows].tolist()
+                       for name in ("mention_starts", "mention_ends", "mention_texts", "mention_contexts")]
+            starts, ends, texts, contexts = columns
+            mentions = self._mentions[char_id] = list(map(
+                Mention, starts, ends, map(self._string, texts), map(self._string, contexts)))
+        if position is None:
+            return list(mentions)
+        end = bisect_right(self._columns["mention_starts"], position, record.mention_start, record.mention_end)
+        return mentions[:end - record.mention_start]
+
+    def character_at(self, char_name: str, position: int) -> Optional[Character]:
+        """See CharacterRegistry.character_at."""
+        cid = self.find(char_name)
+        if cid is None:
+            return None
+
+        record = self.characters[cid]
+        if record.first_appearance > position:
+            return None
+        return Character(record.primary_name, list(record.aliases), record.first_appearance,
+                         self.mentions(cid, position))
+
+    def ids_at(self, position: int) -> List[str]:
+        """Ids of all characters that have appeared by position, in order of first appearance."""
+        return self._first_ids[:bisect_right(self._columns["first_sorted"], position)]
+
+    def names_at(self, position: int) -> List[str]:
+        """Primary names of all characters that have appeared by position, in order of first appearance."""
+        return self._first_names[:bisect_right(self._columns["first_sorted"], position)]
+
+    def to_registry(self) -> CharacterRegistry:
+        """Load everything into a CharacterRegistry, e.g. to export it as JSON."""
+        registry = CharacterRegistry()
+        registry.metadata = self.metadata
+        for cid, record in self.characters.items():
+            registry.add_character(cid, Character(record.primary_name, list(record.aliases),
+                                                  record.first_appearance, self.mentions(cid)))
+        return registry
+
+
+def load_registry(path):
+    """Open a registry file or characters.json, whichever path is; both answer the same queries."""
+    if is_registry_file(path):
+        return RegistryFile(path)
+    return CharacterRegistry.load_from_json(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between characters.json and compact registry files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_cmd = commands.add_parser("import", help="Build a registry file from characters.json")
+    import_cmd.add_argument("json_file")
+    import_cmd.add_argument("registry")
+    export_cmd = commands.add_parser("export", help="Write a registry file out as characters.json")
+    export_cmd.add_argument("registry")
+    export_cmd.add_argument("json_file")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        write_registry(CharacterRegistry.load_from_json(args.json_file), args.registry)
+        print(f"Imported {args.json_file} into {args.registry}")
+    else:
+        with RegistryFile(args.registry) as registry_file:
+            registry_file.to_registry().save_to_json(args.json_file)
+        print(f"Exported {args.registry} to {args.json_file}")
+
+
+if __name__ == "__main__":
+    main()
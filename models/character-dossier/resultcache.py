@@ -0,0 +1,121 @@
+"""
+Content-addressed on-disk cache for extraction results.
+
+Results are keyed by a hash of the scene text, the extractor identity (model,
+pipeline versions, prompt signature) and the extraction parameters. When a
+book is re-segmented, only scenes whose text actually changed miss the cache;
+when a model is upgraded its identity changes and every entry misses. The
+cache is a single SQLite file with least-recently-used eviction once it grows
+past max_bytes. The total size is kept as a running count and only summed up
+from the table again when it crosses the limit, since other processes may
+share the file.
+
+The same module is kept in characters-in-scene and character-dossier;
+test_shared_modules.py there fails when the copies differ.
+"""
+from pathlib import Path
+from typing import Any, Callable, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("THREADWELL_CACHE_DIR", Path.home() / ".cache" / "threadwell"))
+DEFAULT_MAX_BYTES = int(os.environ.get("THREADWELL_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+def make_key(stage: str, identity: dict, params: dict, text: str) -> str:
+    """Return the cache key for running `stage` with the given extractor identity and parameters on text."""
+    payload = json.dumps(
+        {"stage": stage, "identity": identity, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    digest = hashlib.sha256(payload.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """JSON-serializable results stored by key, evicting least recently used entries past max_bytes."""
+
+    def __init__(self, path=None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path) if path else DEFAULT_CACHE_DIR / "results.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._db.commit()
+        # Running total of the value sizes, exact as far as this instance knows
+        self._size = self.size()
+
+    def close(self):
+        self._db.close()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        """Store value under key and evict old entries if the cache is over its size limit."""
+        data = json.dumps(value, ensure_ascii=False)
+        row = self._db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        self._size += len(data) - (row[0] if row else 0)
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, data, len(data), time.time()),
+        )
+        self._db.commit()
+        self._evict()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for key, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def size(self) -> int:
+        """Total size in bytes of all cached values."""
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        # Other processes may have added or evicted entries meanwhile
+        self._size = self.size()
+        excess = self._size - self.max_bytes
+        if excess <= 0:
+            return
+
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY last_used"):
+            evicted.append((key,))
+            excess -= size
+            self._size -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self._db.commit()
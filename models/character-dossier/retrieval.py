@@ -0,0 +1,298 @@
+"""
+Spoiler-bounded full-text search over the scenes of a book, for Ask Me Anything.
+
+An inverted index maps every term to its postings: the scenes it occurs in,
+ascending, with the token positions of every occurrence. Queries are ranked
+with BM25 over the scenes up to a cutoff only. Document frequencies and the
+average scene length are taken from those scenes too, so not even the
+ranking depends on text the listener has not heard yet. Each hit carries
+the passage of the scene where the query terms cluster most densely, found
+from the term positions.
+
+The index is rebuilt incrementally: scenes whose text hash an earlier build
+lists keep their postings (renumbered if scenes moved) and only new or
+changed scenes are tokenized.
+
+Stored as one file: a JSON header line, then the postings of every term as
+JSON arrays, then the UTF-8 text of every scene. The header locates each by
+(byte offset, byte length) after it, so a query parses only the header and
+the postings of its own terms, and reads the text of its top hits only:
+
+    {"version": 2,
+     "scenes": [{"id", "hash", "length", "tokens"}, ...],
+     "terms": {term: [offset, length]},
+     "texts": [[offset, length], ...]}
+    [[scene number, [positions]], ...] per term
+    scene texts
+"""
+from bisect import bisect_right
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from math import log
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+
+
+VERSION = 2
+TOKEN = re.compile(r"[a-z0-9]+(?:['’][a-z]+)?")
+STOPWORDS = frozenset("""
+a an and are as at be but by did do does for from had has have he her him his how i if in is it its me my no not
+of on or she so than that the their them then there they this to was we were what when where which who why will
+with would you your
+""".split())
+
+K1 = 1.2
+B = 0.75
+DEFAULT_PASSAGE_TOKENS = 60
+# Scene number past the end of any book, for queries over the whole book
+END = 2 ** 31 - 1
+
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """(term, start, end) of every word of text; stopwords keep their position but are not indexed."""
+    return [(m.group().replace("’", "'"), m.start(), m.end()) for m in TOKEN.finditer(text.lower())]
+
+
+def scene_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def query_terms(query: str) -> List[str]:
+    terms = []
+    for term, _, _ in tokenize(query):
+        if term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def read_range(path, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+class SavedPostings(Mapping):
+    """Postings of a saved index, parsed a term at a time when first looked up."""
+
+    def __init__(self, path, body: int, terms: Dict[str, List[int]]):
+        self.path = path
+        self.body = body
+        self.terms = terms
+        self._parsed: Dict[str, List[list]] = {}
+
+    def __getitem__(self, term: str) -> List[list]:
+        if term not in self._parsed:
+            offset, length = self.terms[term]
+            self._parsed[term] = json.loads(read_range(self.path, self.body + offset, length))
+        return self._parsed[term]
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def items(self) -> List[Tuple[str, List[list]]]:
+        """Every (term, postings), reading the postings in one go, for rebuilding the index."""
+        if not self.terms:
+            return []
+        data = read_range(self.path, self.body, max(offset + length for offset, length in self.terms.values()))
+        return [(term, json.loads(data[offset:offset + length])) for term, (offset, length) in self.terms.items()]
+
+
+class SavedTexts(Sequence):
+    """Scene texts of a saved index, read from the file one at a time."""
+
+    def __init__(self, path, body: int, texts: List[List[int]]):
+        self.path = path
+        self.body = body
+        self.texts = texts
+
+    def __getitem__(self, i: int) -> str:
+        offset, length = self.texts[i]
+        return read_range(self.path, self.body + offset, length).decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+@dataclass
+class Hit:
+    scene: int
+    scene_id: str
+    score: float
+    # Passage in the book text, and in the scene
+    position: int
+    start: int
+    end: int
+    passage: str
+
+
+class SearchIndex:
+    """BM25 index of scene texts with term positions. Scenes are numbered from 1 in reading order."""
+
+    def __init__(self, scenes: List[dict], postings: Mapping, texts: Sequence):
+        self.scenes = scenes
+        self.postings = postings
+        self.texts = texts
+        # Per term looked up, the scene numbers of its postings, for bisecting at a cutoff
+        self._scene_numbers: Dict[str, List[int]] = {}
+
+        self.offsets = [0]
+        self._token_totals = [0]
+        for scene in scenes:
+            self.offsets.append(self.offsets[-1] + scene["length"])
+            self._token_totals.append(self._token_totals[-1] + scene["tokens"])
+
+    @classmethod
+    def build(cls, scenes: Iterable[Tuple[str, str]], previous: Optional["SearchIndex"] = None) -> Tuple["SearchIndex", int]:
+        """
+        Index (scene id, scene text) pairs in reading order, reusing previous for unchanged scenes.
+
+        Returns the index and the number of scenes that had to be tokenized.
+        """
+        reusable = {}
+        if previous is not None:
+            for number, scene in enumerate(previous.scenes, 1):
+                reusable.setdefault(scene["hash"], number)
+
+        entries = []
+        texts = []
+        renumber = {}
+        fresh = []
+        for number, (scene_id, text) in enumerate(scenes, 1):
+            digest = scene_hash(text)
+            texts.append(text)
+            old = reusable.get(digest)
+            if old is not None and old not in renumber:
+                renumber[old] = number
+                entries.append({**previous.scenes[old - 1], "id": scene_id})
+                continue
+
+            tokens = tokenize(text)
+            entries.append({"id": scene_id, "hash": digest, "length": len(text), "tokens": len(tokens)})
+            fresh.append((number, tokens))
+
+        postings: Dict[str, List[list]] = {}
+        if previous is not None:
+            for term, old_entries in previous.postings.items():
+                kept = [[renumber[scene], positions] for scene, positions in old_entries if scene in renumber]
+                if kept:
+                    postings[term] = kept
+
+        for number, tokens in fresh:
+            positions: Dict[str, List[int]] = {}
+            for i, (term, _, _) in enumerate(tokens):
+                if term not in STOPWORDS:
+                    positions.setdefault(term, []).append(i)
+            for term, term_positions in positions.items():
+                postings.setdefault(term, []).append([number, term_positions])
+
+        for entries_of_term in postings.values():
+            entries_of_term.sort(key=lambda entry: entry[0])
+        return cls(entries, postings, texts), len(fresh)
+
+    def save(self, path):
+        """Write the index to path, replacing any existing file atomically."""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        body = []
+        offset = 0
+
+        def locate(data: bytes) -> List[int]:
+            nonlocal offset
+            body.append(data)
+            offset += len(data)
+            return [offset - len(data), len(data)]
+
+        terms = {term: locate(json.dumps(entries, separators=(",", ":")).encode("ascii"))
+                 for term, entries in self.postings.items()}
+        texts = [locate(text.encode("utf-8")) for text in self.texts]
+        header = {"version": VERSION, "scenes": self.scenes, "terms": terms, "texts": texts}
+        with open(tmp_path, "wb") as f:
+            # JSON escapes newlines inside strings, so the header is exactly the first line
+            f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+            f.writelines(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> "SearchIndex":
+        """Open a saved index, reading only its header; postings and texts are read when needed."""
+        with open(path, "rb") as f:
+            data = json.loads(f.readline())
+            body = f.tell()
+        if data.get("version") != VERSION:
+            raise ValueError(f"Unsupported search index version {data.get('version')}: {path}")
+        return cls(data["scenes"], SavedPostings(path, body, data["terms"]), SavedTexts(path, body, data["texts"]))
+
+    def __len__(self) -> int:
+        return len(self.scenes)
+
+    def search(self, query: str, scene: int = END, top: int = 5,
+               passage_tokens: int = DEFAULT_PASSAGE_TOKENS) -> List[Hit]:
+        """The top scenes up to scene for query by BM25, best first, each with its best passage."""
+        cutoff = min(scene, len(self.scenes))
+        if cutoff <= 0:
+            return []
+        avgdl = self._token_totals[cutoff] / cutoff or 1.0
+
+        scores: Dict[int, float] = {}
+        weights: Dict[str, float] = {}
+        for term in query_terms(query):
+            numbers = self._numbers(term)
+            if not numbers:
+                continue
+            df = bisect_right(numbers, cutoff)
+            if df == 0:
+                continue
+            idf = log(1 + (cutoff - df + 0.5) / (df + 0.5))
+            weights[term] = idf
+            for number, positions in self.postings[term][:df]:
+                tf = len(positions)
+                length = self.scenes[number - 1]["tokens"]
+                scores[number] = scores.get(number, 0.0) + idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avgdl))
+
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top]
+        return [self._hit(number, score, weights, passage_tokens) for number, score in best]
+
+    def _numbers(self, term: str) -> Optional[List[int]]:
+        if term not in self._scene_numbers:
+            if term not in self.postings:
+                return None
+            self._scene_numbers[term] = [scene for scene, _ in self.postings[term]]
+        return self._scene_numbers[term]
+
+    def _positions(self, term: str, number: int) -> List[int]:
+        numbers = self._numbers(term)
+        i = bisect_right(numbers, number) - 1
+        return self.postings[term][i][1] if i >= 0 and numbers[i] == number else []
+
+    def _hit(self, number: int, score: float, weights: Dict[str, float], passage_tokens: int) -> Hit:
+        """Hit for a scene, with the window of passage_tokens tokens holding the most query term weight."""
+        hits = sorted((position, term) for term in weights for position in self._positions(term, number))
+
+        best_start, best_weight = hits[0][0], -1.0
+        j = 0
+        for i, (start, _) in enumerate(hits):
+            while j < len(hits) and hits[j][0] < start + passage_tokens:
+                j += 1
+            # Distinct terms count once, so a window with several query terms beats one repeating one
+            weight = sum(weights[term] for term in {term for _, term in hits[i:j]}) + (j - i) * 1e-3
+            if weight > best_weight:
+                best_start, best_weight = start, weight
+
+        scene = self.scenes[number - 1]
+        text = self.texts[number - 1]
+        tokens = tokenize(text)
+        # Start a little before the first hit, so it is read in context
+        first = max(best_start - passage_tokens // 6, 0)
+        last = min(first + passage_tokens, len(tokens)) - 1
+        start, end = tokens[first][1], tokens[last][2]
+        return Hit(number, scene["id"], score, self.offsets[number - 1] + start, start, end,
+                   text[start:end])
@@ -0,0 +1,191 @@
+"""
+Resident dossier query service.
+
+Keeps the registries of several books loaded and answers query, list and
+batch requests over localhost HTTP, so players polling on every playback tick
+do not start a Python process per lookup. Registries are reloaded when their
+file changes on disk.
+
+Results are cached per (book, character, position bucket): the answer for the
+last position of a bucket is computed once and trimmed to the requested
+position, which is exact because mentions and first appearances are sorted.
+
+Endpoints (JSON responses):
+
+    GET  /query?book=B&character=C&position=P    character data up to P
+    GET  /list?book=B&position=P                 names of characters known at P
+    POST /batch  {"requests": [{"type": "query" | "list", "book": ..., ...}]}
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from urllib.parse import parse_qs, urlparse
+import json
+import logging
+import os
+import threading
+
+from registrystore import load_registry
+
+
+DEFAULT_BUCKET_SIZE = 1000
+DEFAULT_CACHE_SIZE = 10_000
+
+
+class LRUCache:
+    """Thread-safe mapping that drops the least recently used entry past max_entries."""
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        # Computed outside the lock; two threads may race to fill the same key
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+class Book:
+    """A registry file (or characters.json) that is reloaded when it changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.registry = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Return (version, registry), reloading the registry if its file changed since the last call."""
+        stat = os.stat(self.path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if version != self.version:
+                logging.info(f"Loading registry {self.path}")
+                # The previous registry is not closed: requests in flight may still use it
+                self.registry = load_registry(self.path)
+                self.version = version
+            return self.version, self.registry
+
+
+class DossierService:
+    """Answers dossier requests for a set of books, caching results per position bucket."""
+
+    def __init__(self, books: Dict[str, str], bucket_size: int = DEFAULT_BUCKET_SIZE,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        self.books = {name: Book(path) for name, path in books.items()}
+        self.bucket_size = bucket_size
+        self.cache = LRUCache(cache_size)
+
+    def _book(self, name: str):
+        if name not in self.books:
+            raise KeyError(f"Unknown book {name!r}")
+        return self.books[name].current()
+
+    def _bucket_end(self, position: int) -> int:
+        return (position // self.bucket_size + 1) * self.bucket_size - 1
+
+    def character_at(self, book: str, character: str, position: int) -> Optional[dict]:
+        """Character data up to position as a JSON-ready dict, or None if not known there."""
+        version, registry = self._book(book)
+        end = self._bucket_end(position)
+
+        def compute():
+            result = registry.character_at(character, end)
+            if result is None:
+                return None
+            return [m.start for m in result.mentions], asdict(result)
+
+        cached = self.cache.get_or_compute(("query", book, version, character.casefold(), end), compute)
+        if cached is None or cached[1]["first_appearance"] > position:
+            return None
+        starts, data = cached
+        return {**data, "mentions": data["mentions"][:bisect_right(starts, position)]}
+
+    def names_at(self, book: str, position: int) -> List[str]:
+        """Names of the characters known at position, in order of first appearance."""
+        version, registry = self._book(book)
+        end = self._bucket_end(position)
+
+        def compute():
+            ids = registry.ids_at(end)
+            characters = [registry.characters[cid] for cid in ids]
+            return [ch.first_appearance for ch in characters], [ch.primary_name for ch in characters]
+
+        first_appearances, names = self.cache.get_or_compute(("list", book, version, end), compute)
+        return names[:bisect_right(first_appearances, position)]
+
+    def handle(self, request: dict) -> dict:
+        """Answer one request dict as used by /batch; errors are returned, not raised."""
+        try:
+            kind = request.get("type")
+            if kind == "query":
+                result = self.character_at(request["book"], request["character"], int(request["position"]))
+                if result is None:
+                    return {"error": f"Character {request['character']} not found"}
+                return {"character": result}
+            if kind == "list":
+                return {"names": self.names_at(request["book"], int(request["position"]))}
+            return {"error": f"Unknown request type {kind!r}"}
+        except (KeyError, ValueError, TypeError) as e:
+            return {"error": str(e)}
+
+
+class DossierRequestHandler(BaseHTTPRequestHandler):
+    service: DossierService
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path not in ("/query", "/list"):
+            self._send(404, {"error": f"Unknown endpoint {url.path}"})
+            return
+
+        result = self.service.handle({"type": url.path[1:], **params})
+        self._send(404 if "error" in result else 200, result)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/batch":
+            self._send(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            requests = body["requests"]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": f"Invalid batch request: {e}"})
+            return
+        self._send(200, {"results": [self.service.handle(request) for request in requests]})
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def create_server(service: DossierService, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """An HTTP server answering requests with service, one thread per connection."""
+    handler = type("BoundDossierRequestHandler", (DossierRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
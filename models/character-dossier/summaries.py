@@ -0,0 +1,201 @@
+"""
+Spoiler-safe character summaries with rolling checkpoints.
+
+Summarizing everything a character did up to the listener's position in one
+request resends a longer prefix of the book for every position. Instead a
+summary is rolled forward scene by scene group: the checkpoint after a
+character's first k * N scenes is the summarizer's update of checkpoint k - 1
+with the next N scenes. A query at position p takes the last checkpoint
+before p and makes at most one more update with the scenes since then,
+cutting the current scene at p. The cost of a query stays at most N scenes
+however far into the book the listener is.
+
+Every update is stored in the result cache, keyed by the summarizer identity,
+the character, the summary it updates and the scene texts. Checkpoints are
+thereby shared between queries and runs. When an early scene changes, only
+the checkpoints after it are recomputed.
+
+Summarizers are pluggable: anything with an identity dict and a summarize()
+method like ExtractiveSummarizer, the local stand-in used offline and in
+tests.
+"""
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+import re
+
+from registry import character_id
+from resultcache import ResultCache, make_key
+from tracing import get_tracer
+
+
+DEFAULT_CHECKPOINT_EVERY = 8
+FIELDS = ("characters_present",)
+SENTENCE_END = re.compile(r"(?<=[.!?])[\"”’_)]*\s+")
+
+
+class Summarizer(Protocol):
+    # Model and settings, part of every cache key
+    identity: dict
+
+    def summarize(self, name: str, aliases: List[str], previous: str, passages: List[str]) -> str:
+        """The summary previous of character name, updated with passages of the following scenes."""
+        ...
+
+
+class ExtractiveSummarizer:
+    """
+    Stand-in summarizer that needs no model: keeps the sentences naming the character.
+
+    The summary is the first such sentence, to introduce the character, and
+    the latest max_sentences - 1, one per line.
+    """
+
+    def __init__(self, max_sentences: int = 8):
+        self.max_sentences = max_sentences
+        self.identity = {"summarizer": "extractive", "max_sentences": max_sentences}
+
+    def summarize(self, name: str, aliases: List[str], previous: str, passages: List[str]) -> str:
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(alias) for alias in {name, *aliases}) + r")\b", re.IGNORECASE)
+        sentences = previous.splitlines() if previous else []
+        for passage in passages:
+            for sentence in SENTENCE_END.split(passage):
+                sentence = " ".join(sentence.split())
+                if sentence and pattern.search(sentence):
+                    sentences.append(sentence)
+        if len(sentences) > self.max_sentences:
+            sentences = sentences[:1] + sentences[len(sentences) - self.max_sentences + 1:]
+        return "\n".join(sentences)
+
+
+class SummaryEngine:
+    """
+    Summaries of the characters of a book at any reading position.
+
+    Built from scene dicts in reading order; the characters listed in fields
+    count as being in a scene, and positions are offsets into the
+    concatenated scene texts, as in the registry.
+    """
+
+    def __init__(self, scenes: Iterable[dict], summarizer: Summarizer, cache: Optional[ResultCache] = None,
+                 checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY, fields: Tuple[str, ...] = FIELDS):
+        if checkpoint_every < 1:
+            raise ValueError("checkpoint_every must be at least 1")
+        self.summarizer = summarizer
+        self.cache = cache
+        self.checkpoint_every = checkpoint_every
+        # Summarizer calls made, and scenes sent to them, cache hits excluded
+        self.calls = 0
+        self.scenes_sent = 0
+
+        self.texts = []
+        self.offsets = [0]
+        self.names: Dict[str, str] = {}
+        self.aliases: Dict[str, List[str]] = {}
+        # Per character, the scene numbers it is in and where it is first mentioned in each
+        self.scenes: Dict[str, List[int]] = {}
+        self.first_mentions: Dict[str, List[int]] = {}
+        lookup = {}
+        for number, scene in enumerate(scenes, 1):
+            text = scene.get("scene_text", "")
+            self.texts.append(text)
+            self.offsets.append(self.offsets[-1] + len(text))
+            for field in fields:
+                for entry in scene.get(field) or []:
+                    # characters_present holds character dicts, characters_mentioned plain names
+                    name = entry["primary_name"] if isinstance(entry, dict) else str(entry)
+                    cid = character_id(name)
+                    if cid not in self.names:
+                        self.names[cid] = name
+                        self.aliases[cid] = []
+                        self.scenes[cid] = []
+                        self.first_mentions[cid] = []
+                    for alias in entry.get("aliases", []) if isinstance(entry, dict) else [name]:
+                        if alias not in self.aliases[cid]:
+                            self.aliases[cid].append(alias)
+                        lookup.setdefault(alias.casefold(), cid)
+                    mentions = entry.get("mentions") if isinstance(entry, dict) else None
+                    first = min((m["start"] for m in mentions), default=0) if mentions else 0
+                    if self.scenes[cid] and self.scenes[cid][-1] == number:
+                        self.first_mentions[cid][-1] = min(self.first_mentions[cid][-1], first)
+                    else:
+                        self.scenes[cid].append(number)
+                        self.first_mentions[cid].append(first)
+
+        # Primary names win over ids and ids over aliases, as in the registry
+        for cid in self.names:
+            lookup[cid.casefold()] = cid
+        for cid, name in self.names.items():
+            lookup[name.casefold()] = cid
+        self._lookup = lookup
+        self._checkpoints: Dict[str, List[str]] = {}
+
+    def find(self, name: str) -> Optional[str]:
+        """Id of the character with this id, name or alias, in any case."""
+        return self._lookup.get(name.casefold())
+
+    def _update(self, cid: str, previous: str, passages: List[str], scene: int) -> str:
+        """previous updated with passages by the summarizer, or from the cache."""
+        def compute():
+            self.calls += 1
+            self.scenes_sent += len(passages)
+            with get_tracer().span("summarize", f"scene_{scene:03d}", character=cid, passages=len(passages)):
+                return self.summarizer.summarize(self.names[cid], self.aliases[cid], previous, passages)
+
+        if self.cache is None:
+            return compute()
+        key = make_key("summary", self.summarizer.identity, {"character": cid}, "\0".join([previous, *passages]))
+        return self.cache.get_or_compute(key, compute)
+
+    def checkpoint(self, cid: str, k: int) -> str:
+        """The summary after the character's first k * checkpoint_every scenes, computing earlier ones as needed."""
+        checkpoints = self._checkpoints.setdefault(cid, [""])
+        scenes = self.scenes[cid]
+        n = self.checkpoint_every
+        while len(checkpoints) <= k:
+            done = len(checkpoints) - 1
+            group = scenes[done * n:(done + 1) * n]
+            checkpoints.append(self._update(cid, checkpoints[-1], [self.texts[s - 1] for s in group], group[-1]))
+        return checkpoints[k]
+
+    def precompute(self, name: str) -> int:
+        """Compute every checkpoint of a character; returns how many it has."""
+        cid = self._character(name)
+        k = len(self.scenes[cid]) // self.checkpoint_every
+        self.checkpoint(cid, k)
+        return k
+
+    def _character(self, name: str) -> str:
+        cid = self.find(name)
+        if cid is None:
+            raise KeyError(name)
+        return cid
+
+    def summary(self, name: str, position: int) -> Optional[str]:
+        """
+        Summary of the character from the text up to position.
+
+        None if the character is not mentioned by then. Raises KeyError for
+        an unknown character.
+        """
+        cid = self._character(name)
+        scenes = self.scenes[cid]
+        # Scene containing position, and where in it
+        current = bisect_right(self.offsets, position)
+        cut = position - self.offsets[current - 1] if current <= len(self.texts) else None
+
+        complete = bisect_left(scenes, current)
+        partial = None
+        if complete < len(scenes) and scenes[complete] == current and cut is not None \
+                and self.first_mentions[cid][complete] <= cut:
+            partial = self.texts[current - 1][:cut]
+        if complete == 0 and partial is None:
+            return None
+
+        k = complete // self.checkpoint_every
+        previous = self.checkpoint(cid, k)
+        delta = [self.texts[s - 1] for s in scenes[k * self.checkpoint_every:complete]]
+        if partial is not None:
+            delta.append(partial)
+        if not delta:
+            return previous
+        return self._update(cid, previous, delta, current if partial is not None else scenes[complete - 1])
@@ -0,0 +1,44 @@
+from cooccurrence import CooccurrenceIndex
+
+
+def present(*names):
+    return [{"primary_name": name, "aliases": [name], "mentions": []} for name in names]
+
+
+SCENES = [
+    {"characters_present": present("Alice", "White Rabbit")},
+    {"characters_present": present("Alice", "Dinah"), "characters_mentioned": ["Queen"]},
+    {"characters_present": []},
+    {"characters_present": present("Alice", "Cheshire Cat", "White Rabbit")},
+    {"characters_present": present("Alice", "White Rabbit")},
+]
+
+
+def test_met_lists_partners_in_order_of_first_meeting_up_to_scene():
+    """Test that partners, their first shared scene and shared counts respect the scene cutoff."""
+    index = CooccurrenceIndex.build(SCENES)
+
+    assert index.met("Alice", 2) == [("White Rabbit", 1, 1), ("Dinah", 2, 1)]
+    assert index.met("alice") == [("White Rabbit", 1, 3), ("Dinah", 2, 1), ("Cheshire Cat", 4, 1)]
+    assert index.met("Cheshire Cat", 3) == []
+    assert index.first_met("Cheshire Cat", "Alice") == 4
+    assert index.first_met("Dinah", "White Rabbit") is None
+
+
+def test_pair_counts_and_appearances_match_a_rescan(tmp_path):
+    """Test that the saved index answers pair and appearance counts like counting the scenes directly."""
+    CooccurrenceIndex.build(SCENES, ("characters_present", "characters_mentioned")).save(tmp_path / "index.npz")
+    index = CooccurrenceIndex.load(tmp_path / "index.npz")
+
+    for scene in range(len(SCENES) + 1):
+        rows = [index.characters_in(number) for number in range(1, scene + 1)]
+        expected = {}
+        for row in rows:
+            for i, a in enumerate(row):
+                for b in row[i + 1:]:
+                    expected[frozenset((a, b))] = expected.get(frozenset((a, b)), 0) + 1
+        assert {frozenset((a, b)): n for a, b, n in index.pair_counts(scene)} == expected
+        assert index.count("Alice", "Queen", scene) == expected.get(frozenset(("Alice", "Queen")), 0)
+        assert index.appearances("White Rabbit", scene) == sum("White Rabbit" in row for row in rows)
+
+    assert index.pair_counts()[0] == ("Alice", "White Rabbit", 3)
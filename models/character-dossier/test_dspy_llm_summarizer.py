@@ -0,0 +1,28 @@
+from dspy.utils import DummyLM
+
+from dspy_llm_summarizer import LLMSummarizer
+from resultcache import ResultCache
+from summaries import SummaryEngine
+
+
+SCENES = [
+    {"scene_text": f"Alice walked on in scene {i}.",
+     "characters_present": [{"primary_name": "Alice", "aliases": ["Alice"], "mentions": [{"start": 0, "end": 5}]}]}
+    for i in range(1, 7)
+]
+
+
+def test_summaries_run_offline_with_stand_in_lm(tmp_path):
+    """Test the LM summarizer behind the summary engine against a local stand-in LM, reusing cached updates."""
+    lm = DummyLM([{"summary": f"Alice has walked through {n} scenes."} for n in (2, 4, 5)])
+    summarizer = LLMSummarizer(lm=lm)
+    cache = ResultCache(tmp_path / "results.sqlite")
+    engine = SummaryEngine(SCENES, summarizer, cache, checkpoint_every=2)
+
+    assert engine.summary("Alice", engine.offsets[4] + 3) == "Alice has walked through 5 scenes."
+    assert engine.calls == 3
+    assert summarizer.identity["model"] == "dummy"
+
+    again = SummaryEngine(SCENES, LLMSummarizer(lm=DummyLM([])), cache, checkpoint_every=2)
+    assert again.summary("Alice", engine.offsets[4] + 3) == "Alice has walked through 5 scenes."
+    assert again.calls == 0
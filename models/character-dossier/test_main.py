@@ -0,0 +1,86 @@
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+
+from registry import Character, CharacterRegistry, Mention
+
+
+# Packages that take a second or more to import, which read-only commands must
+# not load: spaCy and its pipelines, and the LM stack of the llm summarizer
+HEAVY_MODULES = ("spacy", "thinc", "torch", "spacy_experimental", "dspy", "litellm")
+# Wall time a read-only command may take on top of starting a bare interpreter.
+# Loading spaCy alone takes about a second, the transformer pipelines much longer.
+STARTUP_BUDGET_SECONDS = 1.0
+
+
+@pytest.fixture
+def book(tmp_path):
+    registry = CharacterRegistry()
+    registry.add_character("alice", Character("Alice", ["Alice"], 10, [
+        Mention(10, 15, "Alice", "ran. Alice fell"),
+        Mention(400, 405, "Alice", "said Alice to"),
+    ]))
+    registry.add_character("white_rabbit", Character("White Rabbit", ["White Rabbit"], 200, [
+        Mention(200, 212, "White Rabbit", "the White Rabbit ran"),
+    ]))
+    path = tmp_path / "characters.json"
+    registry.save_to_json(str(path))
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def bare_startup():
+    """Seconds a bare interpreter takes to start and exit on this machine."""
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.monotonic() - start
+
+
+def run_cli(*args):
+    """Run main.py in a fresh interpreter. Returns (stdout, seconds, the HEAVY_MODULES it imported)."""
+    code = "import json, runpy, sys; sys.argv = ['main.py', *sys.argv[1:]]\n" \
+           "try:\n    runpy.run_path('main.py', run_name='__main__')\n" \
+           "except SystemExit:\n    pass\n" \
+           f"print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))"
+    start = time.monotonic()
+    result = subprocess.run([sys.executable, "-c", code, *args], capture_output=True, text=True, check=True)
+    elapsed = time.monotonic() - start
+    *lines, imported = result.stdout.splitlines()
+    return "\n".join(lines), elapsed, json.loads(imported)
+
+
+@pytest.mark.parametrize("args", [
+    ["--help"],
+    ["list", "--book", "{book}", "--position", "300"],
+    ["query", "--book", "{book}", "--character", "alice", "--position", "300"],
+])
+def test_read_only_commands_start_fast_without_heavy_imports(book, bare_startup, args):
+    """Test that help and read-only commands never import spaCy or the LM stack and stay within the startup budget."""
+    _, elapsed, imported = run_cli(*(arg.format(book=book) for arg in args))
+
+    assert imported == []
+    assert elapsed < bare_startup + STARTUP_BUDGET_SECONDS
+
+
+def test_list_and_query_answer_from_the_character_file(book):
+    """Test that list and query only report what has appeared by the reading position."""
+    names, _, _ = run_cli("list", "--book", book, "--position", "100")
+    assert names.splitlines() == ["Alice"]
+
+    output, _, _ = run_cli("query", "--book", book, "--character", "alice", "--position", "300")
+    alice = json.loads(output)
+    assert [m["start"] for m in alice["mentions"]] == [10]
+
+
+def test_scene_files_are_read_in_scene_number_order(tmp_path):
+    """Test that scene files are processed by number, not in file system or plain name order."""
+    from main import read_scenes
+
+    for number in [10, 2, 1000, 1]:
+        with open(tmp_path / f"scene_{number:03d}.json", "w") as f:
+            json.dump({"scene_text": f"text {number}"}, f)
+
+    assert [scene_id for scene_id, _ in read_scenes(str(tmp_path))] == ["scene_001", "scene_002", "scene_010", "scene_1000"]
@@ -0,0 +1,72 @@
+import time
+
+from registry import Character, CharacterRegistry, Mention
+
+
+def make_registry():
+    registry = CharacterRegistry()
+    registry.add_character("alice", Character("Alice", ["Alice", "Miss Alice"], 10, [
+        Mention(400, 405, "Alice", "said Alice to"),
+        Mention(10, 15, "Alice", "ran. Alice fell"),
+        Mention(250, 255, "Alice", "and Alice saw"),
+    ]))
+    registry.add_character("white_rabbit", Character("White Rabbit", ["White Rabbit", "the Rabbit"], 200, [
+        Mention(200, 212, "White Rabbit", "the White Rabbit ran"),
+    ]))
+    return registry
+
+
+def test_character_at_returns_sorted_mentions_up_to_position():
+    """Test that only mentions starting at or before the position are returned, in book order."""
+    alice = make_registry().character_at("Alice", 250)
+
+    assert [m.start for m in alice.mentions] == [10, 250]
+
+
+def test_character_at_matches_names_aliases_and_ids_case_insensitively():
+    """Test that a character is found by its id, any alias or its name in any case."""
+    registry = make_registry()
+
+    for name in ["ALICE", "miss alice", "white_rabbit", "The Rabbit"]:
+        assert registry.character_at(name, 1000) is not None
+    assert registry.character_at("Queen", 1000) is None
+
+
+def test_character_not_yet_appeared_is_not_revealed():
+    """Test that queries before a character's first appearance do not return it."""
+    registry = make_registry()
+
+    assert registry.character_at("White Rabbit", 199) is None
+    assert registry.names_at(199) == ["Alice"]
+    assert registry.names_at(200) == ["Alice", "White Rabbit"]
+    assert registry.names_at(0) == []
+
+
+def test_index_is_rebuilt_after_changes():
+    """Test that characters and mentions added after a query are seen by the next one."""
+    registry = make_registry()
+    assert registry.names_at(1000) == ["Alice", "White Rabbit"]
+
+    registry.add_character("hatter", Character("Hatter", ["Hatter"], 500, []))
+    registry.add_mention("hatter", Mention(500, 506, "Hatter", "the Hatter said"))
+
+    assert registry.names_at(1000) == ["Alice", "White Rabbit", "Hatter"]
+    assert [m.start for m in registry.character_at("hatter", 1000).mentions] == [500]
+
+
+def test_queries_stay_fast_on_book_scale_registry():
+    """Test that position queries do not scan every character and mention."""
+    registry = CharacterRegistry()
+    for i in range(5000):
+        mentions = [Mention(i + j * 5000, i + j * 5000 + 4, f"c{i}", "") for j in range(60)]
+        registry.add_character(f"c{i}", Character(f"C{i}", [f"C{i}"], i, mentions))
+    registry.index()
+
+    start = time.perf_counter()
+    for position in range(0, 300_000, 300):
+        registry.character_at(f"C{position % 5000}", position)
+        registry.ids_at(position)
+    elapsed = time.perf_counter() - start
+
+    # 1000 ticks over 5000 characters and 300000 mentions
+    assert elapsed < 0.5
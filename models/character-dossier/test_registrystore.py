@@ -0,0 +1,71 @@
+import json
+
+from registry import Character, CharacterRegistry, Mention
+from registrystore import RegistryFile, is_registry_file, load_registry, write_registry
+
+
+def make_registry():
+    registry = CharacterRegistry()
+    registry.metadata = {"title": "Alice's Adventures in Wonderland"}
+    registry.add_character("alice", Character("Alice", ["Alice", "Miss Alice"], 10, [
+        Mention(400, 405, "Alice", "said Alice to"),
+        Mention(10, 15, "Alice", "ran. Alice fell"),
+    ]))
+    registry.add_character("white_rabbit", Character("White Rabbit", ["White Rabbit", "the Rabbit"], 200, [
+        Mention(200, 212, "White Rabbit", "the White Rabbit ran"),
+    ]))
+    registry.add_character("dinah", Character("Dinah", ["Dinah"], 5, []))
+    return registry
+
+
+def test_registry_file_answers_like_the_registry(tmp_path):
+    """Test that a registry file gives the same query results as the registry it was written from."""
+    registry = make_registry()
+    write_registry(registry, tmp_path / "characters.twreg")
+
+    with RegistryFile(tmp_path / "characters.twreg") as registry_file:
+        assert registry_file.metadata == registry.metadata
+        for position in [0, 5, 10, 199, 200, 399, 400, 1000]:
+            assert registry_file.names_at(position) == registry.names_at(position)
+            for name in ["alice", "THE RABBIT", "white_rabbit", "Dinah", "Queen"]:
+                assert registry_file.character_at(name, position) == registry.character_at(name, position)
+
+
+def test_json_round_trip(tmp_path):
+    """Test that exporting a registry file as JSON gives back the original data with mentions in book order."""
+    write_registry(make_registry(), tmp_path / "characters.twreg")
+    with RegistryFile(tmp_path / "characters.twreg") as registry_file:
+        registry_file.to_registry().save_to_json(tmp_path / "characters.json")
+
+    with open(tmp_path / "characters.json") as f:
+        data = json.load(f)
+    assert data["book_metadata"] == {"title": "Alice's Adventures in Wonderland"}
+    assert list(data["characters"]) == ["alice", "white_rabbit", "dinah"]
+    assert [m["start"] for m in data["characters"]["alice"]["mentions"]] == [10, 400]
+    assert data["characters"]["white_rabbit"]["aliases"] == ["White Rabbit", "the Rabbit"]
+
+
+def test_registry_file_is_smaller_than_json(tmp_path):
+    """Test that interned strings and typed columns make the file much smaller than characters.json."""
+    registry = CharacterRegistry()
+    for i in range(50):
+        mentions = [Mention(j * 1000 + i, j * 1000 + i + 5, f"Name{i}", f"... Name{i} said {j % 7} ...")
+                    for j in range(200)]
+        registry.add_character(f"name{i}", Character(f"Name{i}", [f"Name{i}"], i, mentions))
+    registry.save_to_json(tmp_path / "characters.json")
+    write_registry(registry, tmp_path / "characters.twreg")
+
+    assert (tmp_path / "characters.twreg").stat().st_size * 4 < (tmp_path / "characters.json").stat().st_size
+
+
+def test_load_registry_detects_the_format(tmp_path):
+    """Test that load_registry opens either format."""
+    registry = make_registry()
+    registry.save_to_json(tmp_path / "characters.json")
+    write_registry(registry, tmp_path / "characters.twreg")
+
+    assert is_registry_file(tmp_path / "characters.twreg")
+    assert not is_registry_file(tmp_path / "characters.json")
+    assert isinstance(load_registry(tmp_path / "characters.json"), CharacterRegistry)
+    with load_registry(tmp_path / "characters.twreg") as registry_file:
+        assert registry_file.names_at(1000) == ["Dinah", "Alice", "White Rabbit"]
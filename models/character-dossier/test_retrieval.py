@@ -0,0 +1,57 @@
+from retrieval import SearchIndex
+
+
+SCENES = [
+    ("scene_001", "Alice was beginning to get very tired of sitting by her sister on the bank."),
+    ("scene_002", "The White Rabbit ran close by her, muttering about being late."),
+    ("scene_003", "The Hatter was angry. The Hatter shouted at the March Hare about the time."),
+    ("scene_004", "The Queen was furious and the Hatter trembled in the court."),
+]
+
+
+def test_search_ranks_by_bm25_and_never_looks_past_the_cutoff():
+    """Test that hits are ranked, carry their passage and come only from scenes up to the cutoff."""
+    index, tokenized = SearchIndex.build(SCENES)
+    assert tokenized == len(SCENES)
+
+    hits = index.search("why is the Hatter angry")
+    assert [hit.scene_id for hit in hits] == ["scene_003", "scene_004"]
+    best = hits[0]
+    assert "Hatter was angry" in best.passage
+    assert SCENES[2][1][best.start:best.end] == best.passage
+    assert best.position == sum(len(text) for _, text in SCENES[:2]) + best.start
+
+    assert [hit.scene for hit in index.search("Hatter", scene=2)] == []
+    assert [hit.scene for hit in index.search("Hatter", scene=3)] == [3]
+    assert index.search("the why", scene=4) == []
+
+
+def test_incremental_build_only_tokenizes_changed_scenes(tmp_path):
+    """Test that a rebuild reuses unchanged scenes, renumbered, and answers like a fresh build."""
+    SearchIndex.build(SCENES)[0].save(tmp_path / "search.json")
+    previous = SearchIndex.load(tmp_path / "search.json")
+
+    changed = [("scene_000", "A prologue about the Rabbit."), *SCENES[:2], ("scene_003", "The Hatter sang."), SCENES[3]]
+    index, tokenized = SearchIndex.build(changed, previous)
+    fresh, _ = SearchIndex.build(changed)
+
+    assert tokenized == 2
+    assert index.scenes == fresh.scenes
+    for query in ("Hatter", "rabbit", "Alice sister", "angry"):
+        for scene in range(len(changed) + 1):
+            assert index.search(query, scene) == fresh.search(query, scene)
+
+
+def test_saved_index_reads_only_the_postings_and_texts_a_query_needs(tmp_path):
+    """Test that a loaded index parses just its header up front and answers like the index it was saved from."""
+    built, _ = SearchIndex.build(SCENES)
+    built.save(tmp_path / "search.json")
+    with open(tmp_path / "search.json", encoding="utf-8") as f:
+        header = f.readline()
+    assert "Hatter was angry" not in header
+
+    index = SearchIndex.load(tmp_path / "search.json")
+    assert len(index.postings) == len(built.postings)
+    assert index.search("why is the Hatter angry", top=1) == built.search("why is the Hatter angry", top=1)
+    assert sorted(index.postings._parsed) == ["angry", "hatter"]
+    assert dict(index.postings.items()) == built.postings
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+import pytest
+
+from registry import Character, CharacterRegistry, Mention
+from registrystore import write_registry
+from service import DossierService, create_server
+
+
+def write_book(path, extra_mentions=()):
+    registry = CharacterRegistry()
+    registry.add_character("alice", Character("Alice", ["Alice"], 10, [
+        Mention(10, 15, "Alice", "ran. Alice fell"),
+        Mention(1500, 1505, "Alice", "said Alice to"),
+        Mention(1900, 1905, "Alice", "and Alice saw"),
+        *extra_mentions,
+    ]))
+    registry.add_character("white_rabbit", Character("White Rabbit", ["White Rabbit"], 1200, [
+        Mention(1200, 1212, "White Rabbit", "the White Rabbit ran"),
+    ]))
+    write_registry(registry, path)
+
+
+def test_bucketed_results_are_exact_for_every_position(tmp_path):
+    """Test that answers trimmed from a cached bucket match direct registry queries."""
+    write_book(tmp_path / "alice.twreg")
+    service = DossierService({"alice": str(tmp_path / "alice.twreg")}, bucket_size=1000)
+    registry = service.books["alice"].current()[1]
+
+    for position in [0, 10, 999, 1000, 1199, 1200, 1500, 1899, 1900, 1999]:
+        expected = registry.character_at("alice", position)
+        actual = service.character_at("alice", "alice", position)
+        assert actual == (None if expected is None else {
+            "primary_name": expected.primary_name,
+            "aliases": expected.aliases,
+            "first_appearance": expected.first_appearance,
+            "mentions": [m.__dict__ for m in expected.mentions],
+        })
+        assert service.names_at("alice", position) == registry.names_at(position)
+
+    # Two buckets per kind of request, everything else answered from the cache
+    assert service.cache.misses == 4
+
+
+def test_registry_is_reloaded_when_its_file_changes(tmp_path):
+    """Test that a rewritten registry file is picked up without restarting the service."""
+    path = tmp_path / "alice.twreg"
+    write_book(path)
+    service = DossierService({"alice": str(path)})
+    assert len(service.character_at("alice", "Alice", 2500)["mentions"]) == 3
+
+    write_book(path, [Mention(2100, 2105, "Alice", "cried Alice")])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert len(service.character_at("alice", "Alice", 2500)["mentions"]) == 4
+
+
+@pytest.fixture
+def server(tmp_path):
+    write_book(tmp_path / "alice.twreg")
+    server = create_server(DossierService({"alice": str(tmp_path / "alice.twreg")}), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_endpoints(server):
+    """Test the query, list and batch endpoints and their errors."""
+    with urlopen(f"{server}/list?book=alice&position=1300") as response:
+        assert json.load(response) == {"names": ["Alice", "White Rabbit"]}
+
+    with urlopen(f"{server}/query?book=alice&character=alice&position=1600") as response:
+        assert [m["start"] for m in json.load(response)["character"]["mentions"]] == [10, 1500]
+
+    with pytest.raises(HTTPError) as error:
+        urlopen(f"{server}/query?book=alice&character=White%20Rabbit&position=100")
+    assert error.value.code == 404
+
+    body = json.dumps({"requests": [
+        {"type": "list", "book": "alice", "position": 100},
+        {"type": "query", "book": "alice", "character": "White Rabbit", "position": 1300},
+        {"type": "list", "book": "bob", "position": 100},
+    ]}).encode()
+    with urlopen(Request(f"{server}/batch", data=body, method="POST")) as response:
+        names, rabbit, unknown = json.load(response)["results"]
+    assert names == {"names": ["Alice"]}
+    assert rabbit["character"]["primary_name"] == "White Rabbit"
+    assert "error" in unknown
@@ -0,0 +1,55 @@
+from resultcache import ResultCache
+from summaries import ExtractiveSummarizer, SummaryEngine
+
+
+def scene(text, *names):
+    return {
+        "scene_text": text,
+        "characters_present": [
+            {"primary_name": name, "aliases": [name], "mentions": [{"start": text.index(name), "end": 0, "text": name}]}
+            for name in names
+        ],
+    }
+
+
+SCENES = [
+    scene(f"Alice walked on. Scene {i} was quiet. The Hatter poured tea number {i}. Nobody spoke.", "Alice", "Hatter")
+    if i % 3 else scene(f"Alice sat alone in scene {i}.", "Alice")
+    for i in range(1, 21)
+]
+
+
+def test_summary_matches_summarizing_the_whole_prefix_at_once():
+    """Test that checkpoint plus delta summaries equal one summary of all text up to the position."""
+    summarizer = ExtractiveSummarizer(max_sentences=4)
+    engine = SummaryEngine(SCENES, summarizer, checkpoint_every=3)
+    book = "".join(s["scene_text"] for s in SCENES)
+    hatter_scenes = [s["scene_text"] for s in SCENES if len(s["characters_present"]) == 2]
+
+    assert engine.summary("hatter", book.index("Hatter") - 1) is None
+    for position in range(book.index("Hatter"), len(book), 37):
+        expected = []
+        for offset, text in zip(engine.offsets, engine.texts):
+            if text in hatter_scenes and offset + text.index("Hatter") <= position:
+                expected.append(text[:position - offset])
+        assert engine.summary("Hatter", position) == summarizer.summarize("Hatter", ["Hatter"], "", expected)
+    assert "tea number 2." in engine.summary("Hatter", engine.offsets[2])
+    assert "tea number 4" not in engine.summary("Hatter", engine.offsets[3])
+
+
+def test_queries_send_at_most_one_checkpoint_of_scenes_and_reuse_the_cache(tmp_path):
+    """Test that a query late in the book stays cheap and a second engine answers from the disk cache."""
+    cache = ResultCache(tmp_path / "cache.sqlite")
+    engine = SummaryEngine(SCENES, ExtractiveSummarizer(), cache, checkpoint_every=4)
+    engine.precompute("Alice")
+
+    for position in (engine.offsets[5] + 3, engine.offsets[-1] - 1):
+        calls, sent = engine.calls, engine.scenes_sent
+        engine.summary("Alice", position)
+        assert engine.calls - calls == 1
+        assert engine.scenes_sent - sent <= 4
+
+    again = SummaryEngine(SCENES, ExtractiveSummarizer(), cache, checkpoint_every=4)
+    assert again.summary("Alice", engine.offsets[-1] - 1) == engine.summary("Alice", engine.offsets[-1] - 1)
+    assert again.calls == 0
+    cache.close()
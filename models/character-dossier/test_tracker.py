@@ -0,0 +1,122 @@
+import re
+from types import SimpleNamespace
+
+import tracing
+from tracker import CharacterTracker
+
+
+class FakeProcessor:
+    """Finds capitalized words as persons and records which texts and scene ids it was given."""
+
+    def __init__(self):
+        self.texts = []
+        self.scene_ids = []
+
+    def extract_persons_batch(self, texts, batch_size, n_process, scene_ids=None):
+        self.scene_ids.extend(scene_ids or [])
+        for text in texts:
+            self.texts.append(text)
+            yield [SimpleNamespace(text=m.group(), start_char=m.start(), end_char=m.end())
+                   for m in re.finditer(r"\b[A-Z][a-z]+", text)]
+
+
+def build(scenes, previous=None):
+    tracker = CharacterTracker(previous=previous)
+    tracker._processor = FakeProcessor()
+    tracker.process_scenes(scenes)
+    return tracker
+
+
+SCENES = [
+    ("scene_001", "the rabbit ran by Alice. "),
+    ("scene_002", "then Dinah slept and Alice read. "),
+    ("scene_003", "the Hatter poured tea. "),
+]
+
+
+def test_mentions_are_at_global_book_positions():
+    """Test that mention offsets include the length of all earlier scenes."""
+    registry = build(SCENES).registry
+    book = "".join(text for _, text in SCENES)
+
+    for cid, ch in registry.characters.items():
+        for m in ch.mentions:
+            assert book[m.start:m.end] == m.text
+    assert registry.characters["alice"].first_appearance == book.index("Alice")
+    assert registry.characters["hatter"].first_appearance == book.index("Hatter")
+    assert [entry["offset"] for entry in registry.metadata["scenes"]] == [0, 25, 58]
+
+
+def test_rebuild_only_processes_changed_scenes_and_matches_full_build():
+    """Test that an incremental build runs NER on changed scenes only and equals a build from scratch."""
+    first = build(SCENES)
+    changed = [SCENES[0], ("scene_002", "then the Queen shouted at Alice. "), SCENES[2]]
+
+    incremental = build(changed, previous=first.registry)
+    full = build(changed)
+
+    assert incremental._processor.texts == [changed[1][1]]
+    assert incremental.registry.metadata == full.registry.metadata
+    assert incremental.registry.characters == full.registry.characters
+    assert "dinah" not in incremental.registry.characters
+
+
+def test_unchanged_scenes_move_with_earlier_changes():
+    """Test that reused scenes are shifted to their new position when an earlier scene changes length."""
+    first = build(SCENES)
+    changed = [("scene_001", "a much longer opening where the rabbit ran by Alice. "), SCENES[1], SCENES[2]]
+
+    incremental = build(changed, previous=first.registry)
+
+    assert incremental.registry.characters == build(changed).registry.characters
+    assert len(incremental._processor.texts) == 1
+
+
+def test_identical_scenes_each_reuse_only_their_own_mentions():
+    """Test that rebuilding a book with repeated scenes keeps one set of mentions per copy, however often."""
+    scenes = [("scene_001", "Alice ran.\n\n"), ("scene_002", "Alice ran.\n\n"), ("scene_003", "the end")]
+    first = build(scenes)
+
+    second = build(scenes, previous=first.registry)
+    third = build(scenes, previous=second.registry)
+
+    for rebuilt in (second, third):
+        assert rebuilt._processor.texts == []
+        assert [m.start for m in rebuilt.registry.characters["alice"].mentions] == [0, 12]
+        assert rebuilt.registry.characters == first.registry.characters
+
+    # Copies beyond those of the previous build are new scenes
+    longer = build(scenes[:2] + scenes[:2], previous=third.registry)
+    assert longer._processor.texts == ["Alice ran.\n\n"] * 2
+    assert [m.start for m in longer.registry.characters["alice"].mentions] == [0, 12, 24, 36]
+
+
+def test_gazetteer_explained_scenes_skip_ner():
+    """Test that changed scenes with only known names are matched by the gazetteer and others escalated."""
+    from tracker import registry_gazetteer
+
+    first = build(SCENES)
+    changed = [SCENES[0], ("scene_002", "then Alice slept. "), ("scene_003", "the Queen shouted at Alice. ")]
+
+    tracker = CharacterTracker(previous=first.registry)
+    tracker._processor = FakeProcessor()
+    tracker.process_scenes(changed, gazetteer=registry_gazetteer(first.registry))
+
+    assert tracker._processor.texts == [changed[2][1]]
+    assert tracker.registry.characters == build(changed).registry.characters
+
+
+def test_trace_attributes_stages_to_scenes():
+    """Test that a traced rebuild sends only the changed scene's id to NER, and records a merge for every scene."""
+    first = build(SCENES)
+    changed = [SCENES[0], ("scene_002", "then the Queen shouted at Alice. "), SCENES[2]]
+
+    tracer = tracing.configure(collect=True)
+    try:
+        incremental = build(changed, previous=first.registry)
+    finally:
+        tracing.configure()
+
+    assert incremental._processor.scene_ids == ["scene_002"]
+    merges = {record["scene"]: record for record in tracing.collector(tracer).spans() if record["name"] == "merge"}
+    assert [merges[scene]["reused"] for scene in sorted(merges)] == [True, False, True]
@@ -0,0 +1,41 @@
+from whoshere import WhosHereBundle, write_bundle
+
+
+def present(*names):
+    return [{"primary_name": name, "aliases": [name], "mentions": []} for name in names]
+
+
+SCENES = [
+    {"scene_text": "Alice and the White Rabbit.", "characters_present": present("Alice", "White Rabbit")},
+    {"scene_text": "Dinah.", "characters_present": present("Dinah"), "characters_mentioned": ["Alice"]},
+    {"scene_text": "Nobody here. ", "characters_present": []},
+    {"scene_text": "The Rabbit and Alice.", "characters_present": [
+        {"primary_name": "White Rabbit", "aliases": ["the Rabbit"], "mentions": []}, *present("Alice")]},
+    {"scene_text": "Bill.", "characters_present": present("Bill")},
+]
+
+
+def test_bundle_round_trips_scene_characters_across_pages(tmp_path):
+    """Test that every scene's characters come back from a multi-page bundle, with one table entry each."""
+    size = write_bundle(SCENES, tmp_path / "book.twhere", page_size=2)
+
+    with WhosHereBundle(tmp_path / "book.twhere") as bundle:
+        assert size == {"scenes": 5, "characters": 4, "pages": 3}
+        assert [[c["name"] for c in bundle.characters_in(n)] for n in range(1, 6)] == [
+            ["Alice", "White Rabbit"], ["Dinah"], [], ["White Rabbit", "Alice"], ["Bill"]]
+        assert bundle.characters[1] == {"id": "white_rabbit", "name": "White Rabbit",
+                                        "aliases": ["White Rabbit", "the Rabbit"]}
+
+
+def test_scene_at_follows_scene_boundaries(tmp_path):
+    """Test that text positions map to the scene containing them, and past the end to none."""
+    write_bundle(SCENES, tmp_path / "book.twhere", fields=("characters_present", "characters_mentioned"))
+    starts = [0]
+    for scene in SCENES:
+        starts.append(starts[-1] + len(scene["scene_text"]))
+
+    with WhosHereBundle(tmp_path / "book.twhere") as bundle:
+        assert [bundle.scene_at(start) for start in starts[:-1]] == [1, 2, 3, 4, 5]
+        assert bundle.scene_at(starts[2] - 1) == 2
+        assert bundle.scene_at(starts[-1]) is None
+        assert [c["name"] for c in bundle.characters_at(starts[1])] == ["Dinah", "Alice"]
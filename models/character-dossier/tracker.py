@@ -0,0 +1,325 @@
+"""
+spaCy-based character extraction into a CharacterRegistry.
+
+spaCy is imported and its pipelines loaded only when the first scene is
+processed, so importing this module stays cheap.
+"""
+from bisect import bisect_right
+from itertools import repeat
+import hashlib
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from gazetteer import AliasGazetteer
+from registry import Character, CharacterRegistry, Mention
+from resultcache import ResultCache, make_key
+from tracing import get_tracer
+
+
+NER_MODEL = "en_core_web_trf"
+COREF_MODEL = "en_coreference_web_trf"
+
+# Defaults for nlp.pipe; transformer pipelines are much faster on batches
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_N_PROCESS = 1
+
+
+def extractor_identity():
+    """Identify the pipelines by package version without loading them, for result caching."""
+    import spacy
+
+    return {
+        "extractor": "spacy",
+        "spacy": spacy.__version__,
+        "pipelines": {name: spacy.util.get_package_version(name) for name in (NER_MODEL, COREF_MODEL)},
+        "labels": ["PERSON"],
+    }
+
+
+# Components of en_core_web_trf nothing here reads. NER only listens to the
+# transformer, so leaving them out changes no entity and saves their compute.
+UNUSED_COMPONENTS = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+
+def person_entities(doc) -> List:
+    return [ent for ent in doc.ents if ent.label_ == "PERSON"]
+
+
+class SpacyProcessor:
+    """
+    NER pipeline, plus the coreference pipeline once coref output is asked for.
+
+    The two pipelines are separately trained transformers, so their passes
+    cannot be shared; the PERSON-only methods skip the coref pass entirely.
+    """
+
+    def __init__(self):
+        import spacy
+
+        logging.info(f"Loading spaCy model '{NER_MODEL}' without {', '.join(UNUSED_COMPONENTS)}")
+        with get_tracer().span("load", model=NER_MODEL):
+            self.nlp = spacy.load(NER_MODEL, exclude=UNUSED_COMPONENTS)
+        logging.info(f"Pipeline components: {self.nlp.pipe_names}")
+
+        self._coref_nlp = None
+
+    @property
+    def coref_nlp(self):
+        """The coreference pipeline, loaded on first use."""
+        if self._coref_nlp is None:
+            import spacy
+
+            logging.info("Loading pre-trained coreference model")
+            # Load the pre-trained coreference model instead of adding experimental component
+            with get_tracer().span("load", model=COREF_MODEL):
+                self._coref_nlp = spacy.load(COREF_MODEL)
+            logging.info("Pre-trained coreference model loaded successfully")
+        return self._coref_nlp
+
+    def extract_persons(self, text: str, scene_id=None) -> List:
+        """PERSON entities of text, without running coreference."""
+        with get_tracer().span("ner", scene_id) as span:
+            doc = self.nlp(text)
+            span.set(tokens=len(doc))
+
+        # The whole doc only at debug verbosity; serializing it costs about as much as a small scene's NER
+        get_tracer().debug("doc", doc.to_json, scene_id)
+        return person_entities(doc)
+
+    def extract_persons_batch(
+        self,
+        texts: Iterable[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_process: int = DEFAULT_N_PROCESS,
+        scene_ids: Optional[Iterable] = None,
+    ) -> Iterator[List]:
+        """
+        Like extract_persons for many texts, streamed through nlp.pipe. Yields in input order.
+
+        Each batch's time is traced as "ner" spans of scene_ids, split by token count.
+        """
+        scene_ids = list(scene_ids) if scene_ids is not None else None
+        docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        docs = get_tracer().attribute("ner", docs, scene_ids if scene_ids is not None else repeat(None),
+                                      batch_size, weight=len)
+        for scene_id, doc in zip(scene_ids if scene_ids is not None else repeat(None), docs):
+            get_tracer().debug("doc", doc.to_json, scene_id)
+            yield person_entities(doc)
+
+    def extract_entities_and_coref(self, text: str) -> Tuple[List, List]:
+        persons = self.extract_persons(text)
+
+        # Use separate coref model
+        with get_tracer().span("coref"):
+            coref_doc = self.coref_nlp(text)
+        coref = coref_doc.spans.get("coref_clusters", [])
+
+        return persons, coref
+
+    def extract_entities_and_coref_batch(
+        self,
+        texts: Iterable[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_process: int = DEFAULT_N_PROCESS,
+    ) -> Iterator[Tuple[List, List]]:
+        """
+        Like extract_entities_and_coref for many texts, streamed through nlp.pipe.
+
+        Yields (persons, coref clusters) per text, in input order.
+        """
+        texts = list(texts)
+        docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        coref_docs = self.coref_nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        coref_docs = get_tracer().attribute("coref", coref_docs, repeat(None), batch_size, weight=len)
+
+        for doc, coref_doc in zip(docs, coref_docs):
+            yield person_entities(doc), coref_doc.spans.get("coref_clusters", [])
+
+def scene_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def occurrence_keys(manifest: List[dict]) -> List[Tuple[str, int]]:
+    """
+    (content hash, occurrence) of every scene of a manifest.
+
+    occurrence counts the earlier scenes with the same text, so repeated
+    scenes like separators or boilerplate each keep a key of their own.
+    """
+    seen = {}
+    keys = []
+    for entry in manifest:
+        occurrence = seen.get(entry["hash"], 0)
+        seen[entry["hash"]] = occurrence + 1
+        keys.append((entry["hash"], occurrence))
+    return keys
+
+
+def scene_mentions(registry: CharacterRegistry) -> Dict[Tuple[str, int], List[Tuple[str, Mention]]]:
+    """
+    Mentions of a registry built by process_scenes, grouped by the occurrence_keys of their scene.
+
+    Mention positions are made relative to the start of their scene. Registries
+    without a scene manifest give no mentions.
+    """
+    manifest = registry.metadata.get("scenes", [])
+    offsets = [entry["offset"] for entry in manifest]
+    keys = occurrence_keys(manifest)
+    grouped = {key: [] for key in keys}
+
+    index = registry.index()
+    for cid in registry.characters:
+        for m in index.mentions[cid]:
+            i = bisect_right(offsets, m.start) - 1
+            offset = manifest[i]["offset"]
+            grouped[keys[i]].append((cid, Mention(m.start - offset, m.end - offset, m.text, m.context)))
+
+    for mentions in grouped.values():
+        mentions.sort(key=lambda item: item[1].start)
+    return grouped
+
+
+def registry_gazetteer(registry: CharacterRegistry) -> AliasGazetteer:
+    """Gazetteer of the primary names and aliases of every character in registry."""
+    return AliasGazetteer(name for ch in registry.characters.values() for name in [ch.primary_name, *ch.aliases])
+
+
+class CharacterTracker:
+    def __init__(self, cache: Optional[ResultCache] = None, previous: Optional[CharacterRegistry] = None):
+        self._processor = None
+        self.registry = CharacterRegistry()
+        self.cache = cache
+        # An earlier build of the same book, whose unchanged scenes are reused
+        self.previous = previous
+
+    @property
+    def processor(self) -> SpacyProcessor:
+        """The spaCy pipelines, loaded when the first scene misses the cache."""
+        if self._processor is None:
+            self._processor = SpacyProcessor()
+        return self._processor
+
+    def find_persons(self, text: str) -> List[Tuple[str, int, int]]:
+        """Return (text, start_char, end_char) of every PERSON entity, from the result cache when possible."""
+        def extract():
+            persons = self.processor.extract_persons(text)
+            return [(ent.text, ent.start_char, ent.end_char) for ent in persons]
+
+        if self.cache is None:
+            return extract()
+
+        key = make_key("persons", extractor_identity(), {}, text)
+        return [tuple(person) for person in self.cache.get_or_compute(key, extract)]
+
+    def find_persons_batch(
+        self,
+        texts: List[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_process: int = DEFAULT_N_PROCESS,
+        scene_ids: Optional[List] = None,
+    ) -> List[List[Tuple[str, int, int]]]:
+        """find_persons for many texts; cache misses go through the pipelines in batches."""
+        scene_ids = scene_ids if scene_ids is not None else [None] * len(texts)
+        keys = [make_key("persons", extractor_identity(), {}, text) for text in texts]
+        results = [None] * len(texts)
+        if self.cache is not None:
+            for i, key in enumerate(keys):
+                with get_tracer().span("cache", scene_ids[i]) as span:
+                    results[i] = self.cache.get(key)
+                    span.set(cache_hit=results[i] is not None)
+
+        missing = [i for i, persons in enumerate(results) if persons is None]
+        if missing:
+            logging.info(f"Running NER on {len(missing)} of {len(texts)} scenes")
+            batches = self.processor.extract_persons_batch(
+                (texts[i] for i in missing), batch_size=batch_size, n_process=n_process,
+                scene_ids=[scene_ids[i] for i in missing])
+            for i, persons in zip(missing, batches):
+                results[i] = [(ent.text, ent.start_char, ent.end_char) for ent in persons]
+                if self.cache is not None:
+                    self.cache.put(keys[i], results[i])
+
+        return [[tuple(person) for person in persons] for persons in results]
+
+    def process_scenes(
+        self,
+        scenes: List[Tuple[str, str]],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_process: int = DEFAULT_N_PROCESS,
+        gazetteer: Optional[AliasGazetteer] = None,
+    ) -> int:
+        """
+        Build the registry from (scene id, scene text) pairs in reading order.
+
+        Each scene starts in the book where the previous one ended, and mentions
+        are stored at these global positions. The scene manifest (id, offset,
+        length and content hash per scene) goes into the registry metadata.
+        Scenes whose hash the previous build lists reuse its mentions, the n-th
+        copy of a repeated scene those of the previous n-th copy; only new
+        and changed scenes are processed; with a gazetteer, those it fully
+        explains are matched against the known names instead of running NER.
+        Returns how many scenes were processed.
+        """
+        reusable = scene_mentions(self.previous) if self.previous is not None else {}
+
+        manifest = []
+        offset = 0
+        for scene_id, text in scenes:
+            manifest.append({"id": scene_id, "offset": offset, "length": len(text), "hash": scene_hash(text)})
+            offset += len(text)
+
+        keys = occurrence_keys(manifest)
+        changed = [i for i, key in enumerate(keys) if key not in reusable]
+        logging.info(f"{len(changed)} of {len(scenes)} scenes are new or changed")
+        extracted = {}
+        if gazetteer is not None:
+            scanned = get_tracer().attribute("gazetteer", gazetteer.scan(scenes[i][1] for i in changed),
+                                             (scenes[i][0] for i in changed))
+            for i, spans in zip(changed, scanned):
+                if spans is not None:
+                    extracted[i] = [(span.text, span.start_char, span.end_char) for span in spans]
+            logging.info(f"Gazetteer explained {len(extracted)} of {len(changed)} scenes")
+
+        escalated = [i for i in changed if i not in extracted]
+        extracted.update(zip(escalated, self.find_persons_batch([scenes[i][1] for i in escalated],
+                                                                batch_size, n_process,
+                                                                [scenes[i][0] for i in escalated])))
+
+        for i, ((scene_id, text), entry) in enumerate(zip(scenes, manifest)):
+            with get_tracer().span("merge", scene_id, reused=i not in extracted) as span:
+                if i in extracted:
+                    self.add_persons(text, extracted[i], entry["offset"])
+                    span.set(mentions=len(extracted[i]))
+                else:
+                    for cid, m in reusable[keys[i]]:
+                        start = entry["offset"] + m.start
+                        self.add_mention(cid, m.text, Mention(start, entry["offset"] + m.end, m.text, m.context))
+                    span.set(mentions=len(reusable[keys[i]]))
+
+        self.registry.metadata["scenes"] = manifest
+        return len(changed)
+
+    def add_persons(self, text: str, persons: List[Tuple[str, int, int]], offset: int = 0):
+        """Add the persons found in a scene that starts at offset in the book."""
+        logging.debug(f"Processing scene text of length {len(text)} ({text[:50]}...)")
+        logging.debug(f"Found {len(persons)} person entities in scene")
+        for ent_text, start_char, end_char in persons:
+            logging.debug(f"Entity '{ent_text}' at tokens {start_char}-{end_char}")
+            cid = ent_text.lower().replace(' ', '_')
+
+            # TODO: this should be the whole sentence actually
+            context = text[max(start_char-5, 0):end_char+5]
+            mention = Mention(offset + start_char, offset + end_char, ent_text, context)
+            self.add_mention(cid, ent_text, mention)
+
+    def add_mention(self, cid: str, name: str, mention: Mention):
+        """Add a mention, creating the character (with its previous name and aliases, if any) on first mention."""
+        if cid not in self.registry.characters:
+            logging.debug(f"Adding new character '{name}' with id '{cid}' at position {mention.start}")
+            known = self.previous.characters.get(cid) if self.previous is not None else None
+            if known is not None:
+                character = Character(known.primary_name, list(known.aliases), mention.start, [])
+            else:
+                character = Character(name, [name], mention.start, [])
+            self.registry.add_character(cid, character)
+
+        self.registry.add_mention(cid, mention)
@@ -0,0 +1,202 @@
+"""
+Compact Who's Here bundle for the app.
+
+The Who's Here pane only needs the characters of the current scene, but the
+scene JSON files carry the whole text and every mention. A bundle keeps the
+scene boundaries, one table of the book's characters and, per scene, the
+table rows of its characters, in a file small enough to ship with the app.
+The app reads the header, character table, boundaries and page index at
+startup (one contiguous range) and pages in the character lists of scene
+ranges as playback reaches them.
+
+File layout (all integers little-endian, every section 8-byte aligned; see
+docs/architecture/data-model.md):
+
+    header        magic "TWWHERE1", u32 version, u32 scene count,
+                  u32 character count, u32 scenes per page,
+                  then u64 offset, u64 length per section in SECTIONS order
+    characters    UTF-8 JSON array of {"id", "name", "aliases"}, in order of
+                  first appearance; rows are indices into it
+    boundaries    u32 start of every scene in the book text, then its length
+    page_offsets  u32 byte offset of every page within pages, then its length
+    pages         per page of up to "scenes per page" scenes: u16 offsets
+                  (scenes in page + 1) into the page's u16 character rows,
+                  followed by those rows
+"""
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+import json
+import os
+import struct
+import sys
+
+from registry import character_id
+
+
+MAGIC = b"TWWHERE1"
+VERSION = 1
+SECTIONS = ("characters", "boundaries", "page_offsets", "pages")
+HEADER = struct.Struct("<8sIIII" + "QQ" * len(SECTIONS))
+
+DEFAULT_PAGE_SIZE = 32
+FIELDS = ("characters_present",)
+
+
+def pack(typecode: str, values) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column.tobytes()
+
+
+def unpack(typecode: str, data: bytes) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def write_bundle(scenes: Iterable[dict], path, page_size: int = DEFAULT_PAGE_SIZE,
+                 fields: Tuple[str, ...] = FIELDS) -> dict:
+    """
+    Write a bundle of scene dicts in reading order to path, replacing any existing file atomically.
+
+    The characters listed in fields count as being in a scene. Returns the
+    bundle's scene, character and page counts.
+    """
+    rows = {}
+    characters = []
+    boundaries = [0]
+    scene_rows = []
+    for scene in scenes:
+        boundaries.append(boundaries[-1] + len(scene.get("scene_text", "")))
+        here = []
+        for field in fields:
+            for entry in scene.get(field) or []:
+                # characters_present holds character dicts, characters_mentioned plain names
+                name = entry["primary_name"] if isinstance(entry, dict) else str(entry)
+                cid = character_id(name)
+                if cid not in rows:
+                    rows[cid] = len(characters)
+                    characters.append({"id": cid, "name": name, "aliases": []})
+                character = characters[rows[cid]]
+                for alias in entry.get("aliases", []) if isinstance(entry, dict) else [name]:
+                    if alias not in character["aliases"]:
+                        character["aliases"].append(alias)
+                if rows[cid] not in here:
+                    here.append(rows[cid])
+        scene_rows.append(here)
+
+    if len(characters) > 0xFFFF:
+        raise ValueError(f"{len(characters)} characters do not fit the bundle's u16 rows")
+
+    pages = bytearray()
+    page_offsets = [0]
+    for first in range(0, len(scene_rows), page_size):
+        page = scene_rows[first:first + page_size]
+        offsets = [0]
+        for here in page:
+            offsets.append(offsets[-1] + len(here))
+        if offsets[-1] > 0xFFFF:
+            raise ValueError(f"Page of scenes {first + 1}-{first + len(page)} has too many rows; use a smaller page size")
+        pages += pack("H", offsets) + pack("H", [row for here in page for row in here])
+        page_offsets.append(len(pages))
+
+    sections = {
+        "characters": json.dumps(characters, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        "boundaries": pack("I", boundaries),
+        "page_offsets": pack("I", page_offsets),
+        "pages": bytes(pages),
+    }
+
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(bytes(HEADER.size))
+        table = []
+        for name in SECTIONS:
+            f.write(bytes(-f.tell() % 8))
+            table += [f.tell(), len(sections[name])]
+            f.write(sections[name])
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(scene_rows), len(characters), page_size, *table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return {"scenes": len(scene_rows), "characters": len(characters), "pages": len(page_offsets) - 1}
+
+
+class WhosHereBundle:
+    """
+    Reads a bundle the way the app does: the header sections once, pages on demand.
+
+    Scenes are numbered from 1. Use as a context manager or call close() when done.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+
+        magic, version, self.scene_count, character_count, self.page_size, *table = \
+            HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a Who's Here bundle: {self.path}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported Who's Here bundle version {version}: {self.path}")
+        self._sections = {name: (offset, length) for name, offset, length in zip(SECTIONS, table[0::2], table[1::2])}
+
+        self.characters = json.loads(self._read("characters").decode("utf-8"))
+        if len(self.characters) != character_count:
+            raise ValueError(f"Corrupt bundle, {len(self.characters)} of {character_count} characters: {self.path}")
+        self.boundaries = unpack("I", self._read("boundaries"))
+        self.page_offsets = unpack("I", self._read("page_offsets"))
+        self._page = (None, None, None)
+
+    def _read(self, section: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        offset, length = self._sections[section]
+        end = length if end is None else end
+        self._file.seek(offset + start)
+        return self._file.read(end - start)
+
+    def __enter__(self) -> "WhosHereBundle":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def scene_at(self, position: int) -> Optional[int]:
+        """Number of the scene containing text position, or None past the end of the book."""
+        if not 0 <= position < self.boundaries[-1]:
+            return None
+        return bisect_right(self.boundaries, position)
+
+    def _load_page(self, page: int):
+        if self._page[0] != page:
+            data = self._read("pages", self.page_offsets[page], self.page_offsets[page + 1])
+            scenes = min(self.page_size, self.scene_count - page * self.page_size)
+            offsets = unpack("H", data[:2 * (scenes + 1)])
+            self._page = (page, offsets, unpack("H", data[2 * (scenes + 1):]))
+        return self._page[1], self._page[2]
+
+    def rows_in(self, scene: int) -> List[int]:
+        """Character table rows of the characters in scene."""
+        if not 1 <= scene <= self.scene_count:
+            raise IndexError(f"Scene {scene} out of range 1..{self.scene_count}")
+        page, slot = divmod(scene - 1, self.page_size)
+        offsets, rows = self._load_page(page)
+        return list(rows[offsets[slot]:offsets[slot + 1]])
+
+    def characters_in(self, scene: int) -> List[dict]:
+        """Character table entries of the characters in scene."""
+        return [self.characters[row] for row in self.rows_in(scene)]
+
+    def characters_at(self, position: int) -> List[dict]:
+        """Characters of the scene containing text position."""
+        scene = self.scene_at(position)
+        return [] if scene is None else self.characters_in(scene)
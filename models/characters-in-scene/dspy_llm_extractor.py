@@ -1,6 +1,11 @@
 import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
 import dspy
-from typing import List
+from dspy.utils.exceptions import AdapterParseError
 
 class CharacterExtraction(dspy.Signature):
     """Extract all characters from a scene text."""
@@ -9,27 +14,322 @@ class CharacterExtraction(dspy.Signature):
     characters: List[str] = dspy.OutputField(desc="A list of character names found in the scene")
 
 
-def create_predictor():
+class BatchCharacterExtraction(dspy.Signature):
+    """Extract all characters from each of several consecutive scenes of a book.
+    Return exactly one list of character names per scene, in the same order as the scenes."""
+
+    scenes: List[str] = dspy.InputField(desc="Consecutive scenes from a book, in reading order")
+    characters_per_scene: List[List[str]] = dspy.OutputField(
+        desc="For each scene, in order, the list of character names found in it")
+
+
+# Using Anthropic's Claude model
+MODEL = "anthropic/claude-opus-4-20250514"
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_TOKENS_PER_MINUTE = 40_000
+DEFAULT_MAX_RETRIES = 5
+
+# Scenes are packed into one request until their estimated size reaches this
+DEFAULT_BATCH_TOKENS = 4000
+DEFAULT_MAX_BATCH_SCENES = 20
+# How long a partially filled batch waits for more scenes before it is sent
+BATCH_DELAY_SECONDS = 0.05
+
+# HTTP status codes worth retrying: rate limited, server errors, Anthropic overloaded
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "ServiceUnavailableError", "InternalServerError",
+                         "APIConnectionError", "APITimeoutError", "Timeout"}
+
+# Prompt overhead of the ChainOfThought template on top of the scene text
+PROMPT_OVERHEAD_TOKENS = 300
+
+
+def estimate_tokens(text: str, overhead: int = PROMPT_OVERHEAD_TOKENS) -> int:
+    """Rough token count used for rate limiting and batching before the real usage is known."""
+    return len(text) // 4 + overhead
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate limiting (429), overload and 5xx errors from the provider."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def signature_fields(signature):
+    return {name: field.json_schema_extra["desc"] for name, field in signature.fields.items()}
+
+
+def create_lm(model: str = MODEL):
     # Load API key from secret file
     with open("anthropic-api-key.secret", "r") as f:
         api_key = f.read().strip()
 
-    # Using Anthropic's Claude model
-    lm = dspy.LM("anthropic/claude-opus-4-20250514", api_key=api_key)
-    dspy.configure(lm=lm)
+    # Retries are handled by LLMCharacterExtractor so they respect the shared budget
+    return dspy.LM(model, api_key=api_key, num_retries=0)
 
-    # Create the predictor
-    return dspy.ChainOfThought(CharacterExtraction)
 
+class TokenRateLimiter:
+    """Token bucket holding a tokens-per-minute budget shared by all requests of an extractor."""
 
-async def extract_characters_from_scene(scene_text):
-    """Extract characters from the scene text using DSPy model."""
+    def __init__(self, tokens_per_minute: Optional[int]):
+        self.tokens_per_minute = tokens_per_minute
+        self._available = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        rate = self.tokens_per_minute / 60.0
+        self._available = min(self.tokens_per_minute, self._available + (now - self._updated) * rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int):
+        """Wait until `tokens` fit in the budget, then take them."""
+        if not self.tokens_per_minute:
+            return
+        # A single request larger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            self._refill()
+            if self._available >= tokens:
+                self._available -= tokens
+                return
+            await asyncio.sleep((tokens - self._available) * 60.0 / self.tokens_per_minute)
+
+    def adjust(self, tokens: int):
+        """Charge (or refund, if negative) the difference between estimated and actual usage."""
+        if self.tokens_per_minute:
+            self._available -= tokens
+
+
+@dataclass
+class ExtractorStats:
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    batched_scenes: int = 0
+    tokens: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    def record(self, latency: float, tokens: int):
+        self.requests += 1
+        self.tokens += tokens
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def summary(self) -> str:
+        mean = self.total_latency / self.requests if self.requests else 0.0
+        return (f"{self.requests} LLM requests ({self.batched_scenes} scenes batched), "
+                f"{self.retries} retries, {self.failures} failures, "
+                f"{self.tokens} tokens, latency mean {mean:.2f}s max {self.max_latency:.2f}s")
+
+
+class LLMCharacterExtractor:
+    """
+    Long-lived DSPy character extractor.
 
-    # Run the synchronous DSPy call in a thread pool to avoid blocking
-    predictor = create_predictor()
+    Holds one LM and predictor for the whole run, bounds the number of
+    requests in flight, keeps within a tokens-per-minute budget and retries
+    rate limit and server errors with jittered exponential backoff. Pass any
+    dspy LM as `lm` (e.g. dspy.utils.DummyLM or a local model) to run without
+    the Anthropic API.
 
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(None, lambda: predictor(scene_text=scene_text))
+    With batch_tokens set, concurrent extract() calls are packed in call
+    order into multi-scene requests of up to batch_tokens estimated tokens.
+    If a batch response cannot be parsed or split back into one result per
+    scene, its scenes are retried one request each; provider and transport
+    errors are raised as they are.
+    """
 
-    return result.characters
+    def __init__(
+        self,
+        lm=None,
+        model: str = MODEL,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        tokens_per_minute: Optional[int] = DEFAULT_TOKENS_PER_MINUTE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        batch_tokens: Optional[int] = None,
+        max_batch_scenes: int = DEFAULT_MAX_BATCH_SCENES,
+    ):
+        self.lm = lm if lm is not None else create_lm(model)
+        self.predictor = dspy.ChainOfThought(CharacterExtraction)
+        self.batch_predictor = dspy.ChainOfThought(BatchCharacterExtraction)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.batch_tokens = batch_tokens
+        self.max_batch_scenes = max_batch_scenes
+        self.stats = ExtractorStats()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_limiter = TokenRateLimiter(tokens_per_minute)
+        self._pending = []
+        self._pending_tokens = 0
+        self._flush_handle = None
+        # The event loop only keeps weak references to tasks, so running batches are held here
+        self._batch_tasks = set()
+
+    def identity(self):
+        """
+        Identify the prompts and model, so cached results are dropped when either changes.
+
+        Both prompts are included whether batching is on or not: a batched run
+        answers some scenes with single-scene requests anyway, so results are
+        shared between the two modes and switching does not empty the cache.
+        """
+        return {
+            "extractor": "dspy",
+            "module": "ChainOfThought",
+            "signature": CharacterExtraction.__name__,
+            "instructions": CharacterExtraction.instructions,
+            "fields": signature_fields(CharacterExtraction),
+            "batch_instructions": BatchCharacterExtraction.instructions,
+            "batch_fields": signature_fields(BatchCharacterExtraction),
+            "model": self.lm.model,
+        }
+
+    def _predict(self, scene_text: str):
+        # Scoped to this call instead of dspy.configure, which is global
+        with dspy.context(lm=self.lm, track_usage=True):
+            return self.predictor(scene_text=scene_text)
+
+    def _predict_batch(self, scene_texts: List[str]):
+        with dspy.context(lm=self.lm, track_usage=True):
+            return self.batch_predictor(scenes=scene_texts)
+
+    async def _request(self, predict, estimated: int):
+        """Run predict() in a thread within the concurrency and token limits, retrying transient errors."""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._rate_limiter.acquire(estimated)
+                start = time.monotonic()
+                try:
+                    # Run the synchronous DSPy call in a thread to avoid blocking
+                    result = await asyncio.to_thread(predict)
+                except Exception as e:
+                    if attempt < self.max_retries and is_retryable(e):
+                        self.stats.retries += 1
+                        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                        print(f"LLM request failed ({e!r}), retrying in {delay:.1f}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    self.stats.failures += 1
+                    raise
+
+                tokens = usage_tokens(result) or estimated
+                self._rate_limiter.adjust(tokens - estimated)
+                self.stats.record(time.monotonic() - start, tokens)
+                return result
+
+    async def extract_single(self, scene_text: str) -> List[str]:
+        """Extract the character names in a scene with a request of its own."""
+        result = await self._request(lambda: self._predict(scene_text), estimate_tokens(scene_text))
+        return list(result.characters)
+
+    async def extract_batch(self, scene_texts: List[str]) -> Optional[List[List[str]]]:
+        """
+        Extract the character names of several scenes in one request.
+
+        None when the answer cannot be parsed or does not hold one list per
+        scene, so the scenes have to be sent one request each. Rate limiting,
+        transport and other provider errors are raised, as single-scene
+        requests would hit them too.
+        """
+        estimated = sum(estimate_tokens(text, overhead=0) for text in scene_texts) + PROMPT_OVERHEAD_TOKENS
+        try:
+            result = await self._request(lambda: self._predict_batch(scene_texts), estimated)
+            per_scene = result.characters_per_scene
+            if len(per_scene) != len(scene_texts) or not all(isinstance(names, list) for names in per_scene):
+                raise ValueError(f"Expected {len(scene_texts)} character lists, got {len(per_scene)}")
+        except (AdapterParseError, ValueError) as e:
+            print(f"Batch of {len(scene_texts)} scenes failed ({e!r}), falling back to single-scene requests")
+            return None
+        self.stats.batched_scenes += len(scene_texts)
+        return [[str(name) for name in names] for names in per_scene]
+
+    async def extract(self, scene_text: str) -> List[str]:
+        """Extract the character names in a scene, batched with concurrent calls when batching is on."""
+        if not self.batch_tokens:
+            return await self.extract_single(scene_text)
+
+        tokens = estimate_tokens(scene_text, overhead=0)
+        if self._pending and self._pending_tokens + tokens > self.batch_tokens:
+            self._flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((scene_text, future))
+        self._pending_tokens += tokens
+
+        if self._pending_tokens >= self.batch_tokens or len(self._pending) >= self.max_batch_scenes:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(BATCH_DELAY_SECONDS, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        results = None
+        if len(batch) > 1:
+            try:
+                results = await self.extract_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    settle(future, exception=e)
+                return
+        if results is None:
+            # One request per scene; each scene succeeds or fails on its own
+            await asyncio.gather(*(self._run_single(text, future) for text, future in batch))
+            return
+        for (_, future), characters in zip(batch, results):
+            settle(future, characters)
+
+    async def _run_single(self, scene_text: str, future):
+        try:
+            characters = await self.extract_single(scene_text)
+        except Exception as e:
+            settle(future, exception=e)
+        else:
+            settle(future, characters)
+
+
+def settle(future, result=None, exception: Optional[BaseException] = None):
+    """Set the result or exception of future, unless its caller has cancelled it."""
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+def usage_tokens(result) -> int:
+    """Total tokens reported by the LM for a prediction, 0 if the LM does not report usage."""
+    get_lm_usage = getattr(result, "get_lm_usage", None)
+    usage = get_lm_usage() if get_lm_usage else None
+    return sum((model_usage or {}).get("total_tokens") or 0 for model_usage in (usage or {}).values())
+
+
+_default_extractor = None
+
+
+async def extract_characters_from_scene(scene_text):
+    """Extract characters from the scene text using a shared default extractor."""
+    global _default_extractor
+    if _default_extractor is None:
+        _default_extractor = LLMCharacterExtractor()
 
+    return await _default_extractor.extract(scene_text)
@@ -46,10 +46,14 @@ def validate_and_load_scene_file(file_path):
 
 
 def update_scene(file_path, scene_data):
-    """Save the extracted characters back to the JSON file."""
+    """Save the extracted characters back to the JSON file, through a temporary file so it is never half-written."""
 
-    with open(file_path, "w") as f:
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as f:
         json.dump(scene_data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
 
     print(f"Updated JSON file: {file_path}")
 
@@ -1,66 +1,116 @@
-import sys
+import argparse
 import asyncio
-from dataclasses import asdict
-from fileutils import validate_and_load_scene_file, get_json_files, update_scene
+from fileutils import get_json_files
+from pipeline import PipelineOptions, SceneFiles, StoredScenes, run_pipeline
+from resultcache import ResultCache
+from scenestore import SceneStore, is_scene_store
+from tracing import LEVELS, collector, configure
 import dspy_llm_extractor
 import spacy_ner_extractor
 
 
-async def process_single_scene(path_to_scene_file):
-    """Process a single JSON file for character extraction."""
+async def process_scene_files(json_files, cache, llm_extractor, options=None):
+    """Process JSON scene files for character extraction. Returns the number of files updated."""
 
-    print(f"Processing: {path_to_scene_file}")
+    progress = await run_pipeline(SceneFiles(json_files), cache, llm_extractor, options)
+    if progress.tiers:
+        print(f"Answered by tier: {progress.tier_summary()}")
+    return progress.written
 
-    # Load and validate the scene file
-    scene_data = validate_and_load_scene_file(path_to_scene_file)
-    if scene_data is None:
-        return False
 
-    if "characters_mentioned" not in scene_data:
-        print("Extracting characters mentioned in scene using dspy...")
-        characters = await dspy_llm_extractor.extract_characters_from_scene(scene_data["scene_text"])
-        print(f"Found characters: {characters}")
-        scene_data["characters_mentioned"] = [asdict(char) for char in characters]
+async def process_scene_store(store_path, cache, llm_extractor, options=None):
+    """Process every scene in a scene store, patching the results back in chunks."""
 
-    if "characters_present" not in scene_data:
-        print("Extracting characters present in scene using spaCy...")
-        characters = spacy_ner_extractor.extract_characters_from_scene(scene_data["scene_text"])
-        print(f"Found characters: {characters}")
-        # Convert Character dataclass objects to dictionaries for JSON serialization
-        scene_data["characters_present"] = [asdict(char) for char in characters]
+    with SceneStore(store_path) as store:
+        print(f"Found {len(store)} scene(s) in store {store_path}")
+        print()
 
-    # Save the results back to the file
-    update_scene(path_to_scene_file, scene_data)
-    return True
+        progress = await run_pipeline(StoredScenes(store), cache, llm_extractor, options)
+
+        print()
+        print(f"Successfully processed {progress.written} out of {len(store)} scenes")
+        if progress.tiers:
+            print(f"Answered by tier: {progress.tier_summary()}")
 
 
 async def main():
-    # Check command line arguments
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <path-to-scene-json-file-or-directory>")
-        print("")
-        print("Examples:")
-        print("  python main.py scene.json")
-        print("  python main.py /path/to/scenes/")
-        print("")
-        print("JSON files should contain a 'scene_text' field with the text to analyze.")
-        sys.exit(1)
-
-    # Get list of JSON files to process
-    json_files = get_json_files(sys.argv[1])
-
-    print(f"Found {len(json_files)} JSON file(s) to process")
-    print()
-
-    # Process all files in parallel
-    tasks = [process_single_scene(file_path) for file_path in json_files]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-
-    # Count successful processes
-    processed_count = sum(1 for result in results if result is True)
-
-    print()
-    print(f"Successfully processed {processed_count} out of {len(json_files)} files")
+    parser = argparse.ArgumentParser(
+        description="Extract characters from scene JSON files",
+        epilog="Examples:\n"
+               "  python main.py scene.json\n"
+               "  python main.py /path/to/scenes/\n"
+               "  python main.py /path/to/scenes.store\n\n"
+               "JSON files should contain a 'scene_text' field with the text to analyze.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("path", help="Scene JSON file, directory of scene JSON files or scene store")
+    parser.add_argument("--model", default=dspy_llm_extractor.MODEL, help="LM used for character extraction")
+    parser.add_argument("--max-concurrency", type=int, default=dspy_llm_extractor.DEFAULT_MAX_CONCURRENCY,
+                        help="Maximum number of LLM requests in flight")
+    parser.add_argument("--tokens-per-minute", type=int, default=dspy_llm_extractor.DEFAULT_TOKENS_PER_MINUTE,
+                        help="Token budget per minute for LLM requests (0 for no limit)")
+    parser.add_argument("--batch-tokens", type=int, default=dspy_llm_extractor.DEFAULT_BATCH_TOKENS,
+                        help="Pack consecutive scenes into LLM requests of up to this many tokens (0 for one scene per request)")
+    parser.add_argument("--spacy-batch-size", type=int, default=spacy_ner_extractor.DEFAULT_BATCH_SIZE,
+                        help="Scenes per nlp.pipe batch")
+    parser.add_argument("--spacy-processes", type=int, default=spacy_ner_extractor.DEFAULT_N_PROCESS,
+                        help="Worker processes running spaCy batches, each loading its own pipeline")
+    parser.add_argument("--llm-tasks", type=int, default=PipelineOptions.llm_tasks,
+                        help="Scenes waiting on LLM requests at once; keep above --max-concurrency to fill batches")
+    parser.add_argument("--queue-size", type=int, default=PipelineOptions.queue_size,
+                        help="Scenes held between two pipeline stages, which bounds memory use")
+    parser.add_argument("--gazetteer", action="store_true",
+                        help="Match names already found in other scenes instead of running NER where they explain a scene")
+    parser.add_argument("--tiered", action="store_true",
+                        help="Answer each scene by the cheapest tier confident about it (heuristics, then NER, then the LLM)")
+    parser.add_argument("--min-confidence", type=float, default=PipelineOptions.min_confidence,
+                        help="Confidence a tier needs to answer a scene with --tiered instead of escalating it")
+    parser.add_argument("--trace", metavar="FILE", help="Append a JSONL record of every traced stage and scene to FILE")
+    parser.add_argument("--trace-level", choices=sorted(LEVELS), default="spans",
+                        help="What --trace and --profile record; debug adds per-scene pipeline dumps")
+    parser.add_argument("--profile", action="store_true", help="Print the time spent per stage and the costliest scenes")
+    args = parser.parse_args()
+
+    tracer = configure(args.trace, args.trace_level, collect=args.profile)
+
+    cache = ResultCache()
+    llm_extractor = dspy_llm_extractor.LLMCharacterExtractor(
+        model=args.model,
+        max_concurrency=args.max_concurrency,
+        tokens_per_minute=args.tokens_per_minute,
+        batch_tokens=args.batch_tokens,
+    )
+
+    options = PipelineOptions(
+        spacy_batch_size=args.spacy_batch_size,
+        spacy_processes=args.spacy_processes,
+        use_gazetteer=args.gazetteer,
+        tiered=args.tiered,
+        min_confidence=args.min_confidence,
+        llm_tasks=args.llm_tasks,
+        queue_size=args.queue_size,
+    )
+
+    if is_scene_store(args.path):
+        await process_scene_store(args.path, cache, llm_extractor, options)
+    else:
+        # Get list of JSON files to process
+        json_files = get_json_files(args.path)
+
+        print(f"Found {len(json_files)} JSON file(s) to process")
+        print()
+
+        # Scenes stream through loading, spaCy in worker processes, LLM requests and writing at once
+        processed_count = await process_scene_files(json_files, cache, llm_extractor, options)
+
+        print()
+        print(f"Successfully processed {processed_count} out of {len(json_files)} files")
+
+    print(f"Result cache: {cache.hits} hits, {cache.misses} misses")
+    print(llm_extractor.stats.summary())
+    if args.profile:
+        print(collector(tracer).summary())
+    tracer.close()
 
 
 if __name__ == "__main__":
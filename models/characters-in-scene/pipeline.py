@@ -0,0 +1,496 @@
+"""
+Staged pipeline that annotates the scenes of a book.
+
+    load -> present (spaCy, worker processes) -> mentioned (LLM requests) -> write
+
+Stages run concurrently and hand scenes on through bounded queues, so only a
+few batches of scenes are in memory however long the book is, and a slow
+stage holds back the stages before it instead of letting work pile up.
+spaCy batches run in a process pool, so they neither block the event loop
+nor compete with it for the GIL, while up to llm_tasks scenes wait on LLM
+requests. Results go back to their files through a temporary file and a
+rename, or into the scene store in chunks.
+
+With tiered extraction (see tiers.py) scenes are answered by a cheap
+heuristic tier where it is confident, and only the others go through NER and
+the LLM.
+
+A scene whose stage raises skips the later stages and is reported as failed;
+the other scenes carry on.
+"""
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from fileutils import update_scene, validate_and_load_scene_file
+from gazetteer import AliasGazetteer
+from resultcache import make_key
+from scenestore import SceneStore
+from tracing import get_tracer
+import dspy_llm_extractor
+import spacy_ner_extractor
+import tiers
+
+
+@dataclass
+class PipelineOptions:
+    spacy_batch_size: int = spacy_ner_extractor.DEFAULT_BATCH_SIZE
+    # Worker processes, each with its own copy of the spaCy pipeline
+    spacy_processes: int = spacy_ner_extractor.DEFAULT_N_PROCESS
+    use_gazetteer: bool = False
+    # Answer scenes by the cheapest tier at least min_confidence sure of them
+    tiered: bool = False
+    min_confidence: float = tiers.DEFAULT_MIN_CONFIDENCE
+    # Scenes waiting on LLM requests at once; the extractor's own limits still apply
+    llm_tasks: int = 64
+    # Scenes each queue between two stages holds
+    queue_size: int = 256
+    progress_seconds: float = 10.0
+
+
+def use_cached(scene_data, field, key, cache, scene_id=None):
+    """Set scene_data[field] from the result cache. Returns False if the field still has to be extracted."""
+
+    with get_tracer().span("cache", scene_id, field=field) as span:
+        hit = lookup_cached(scene_data, field, key, cache)
+        span.set(cache_hit=hit)
+    return hit
+
+
+def lookup_cached(scene_data, field, key, cache):
+    keys = scene_data.setdefault("extraction_keys", {})
+    if field in scene_data and keys.get(field) == key:
+        return True
+
+    # A value written without a key, e.g. before results were cached, is
+    # extracted again: nothing says which extractor produced it
+    value = cache.get(key)
+    if value is None:
+        return False
+
+    scene_data[field] = value
+    keys[field] = key
+    return True
+
+
+def set_result(scene_data, field, key, cache, value):
+    """Store a freshly extracted field in the scene and the result cache."""
+
+    cache.put(key, value)
+    scene_data[field] = value
+    scene_data.setdefault("extraction_keys", {})[field] = key
+
+
+def set_tier(scene_data, field, tier, confidence=None):
+    """Record which tier answered field, with its confidence and the cache key of the answer."""
+
+    key = scene_data.get("extraction_keys", {}).get(field)
+    scene_data.setdefault("extraction_tiers", {})[field] = {"tier": tier, "confidence": confidence, "key": key}
+
+
+def answering_tier(scene_data, field) -> Optional[dict]:
+    """The tier that answered the current value of field, if recorded."""
+
+    record = scene_data.get("extraction_tiers", {}).get(field)
+    if record is None or record["key"] != scene_data.get("extraction_keys", {}).get(field):
+        return None
+    return record
+
+
+def scene_names(scene_data):
+    """Names and aliases of every character already recorded as present in a scene."""
+
+    return {name
+            for character in scene_data.get("characters_present", [])
+            for name in [character["primary_name"], *character["aliases"]]}
+
+
+@lru_cache(maxsize=1)
+def gazetteer_for(names: Tuple[str, ...]) -> AliasGazetteer:
+    # Workers see the same names batch after batch until a scene adds one
+    return AliasGazetteer(names)
+
+
+def explain_batch(texts: List[str], names: Iterable[str]) -> List[Optional[Tuple[dict, List[dict]]]]:
+    """
+    Characters present in the texts that the known names fully explain.
+
+    Returns, per text, the gazetteer identity and the characters as dicts, or
+    None where the text needs spaCy NER.
+    """
+
+    names = tuple(sorted(set(names)))
+    if not names:
+        return [None] * len(texts)
+
+    gazetteer = gazetteer_for(names)
+    identity = gazetteer.identity()
+    return [None if spans is None else
+            (identity, [asdict(char) for char in spacy_ner_extractor.characters_from_persons(spans)])
+            for spans in gazetteer.scan(texts)]
+
+
+def annotate_present_batch(texts: List[str], names: Iterable[str],
+                           batch_size: int) -> List[Tuple[str, Optional[dict], Optional[float], List[dict]]]:
+    """
+    Characters present in each text, run in a worker process.
+
+    Returns, per text, the tier, its identity where it is not NER, its
+    confidence and the characters as dicts. Texts the known names explain
+    are answered by the gazetteer, the rest by spaCy NER.
+    """
+
+    explained = explain_batch(texts, names)
+    results = [None if result is None else ("gazetteer", result[0], None, result[1]) for result in explained]
+    pending = [i for i, result in enumerate(results) if result is None]
+    extracted = spacy_ner_extractor.extract_characters_from_scenes([texts[i] for i in pending],
+                                                                   batch_size=batch_size, n_process=1)
+    for i, characters in zip(pending, extracted):
+        results[i] = ("ner", None, None, [asdict(char) for char in characters])
+    return results
+
+
+def annotate_tiered_batch(texts: List[str], names: Iterable[str], batch_size: int,
+                          min_confidence: float) -> List[Tuple[str, Optional[dict], Optional[float], List[dict]]]:
+    """
+    Like annotate_present_batch, but by the cheapest tier at least min_confidence sure of each text.
+
+    Texts go to spaCy NER only where the heuristic tier is not confident
+    enough; both tiers report their confidence.
+    """
+
+    gazetteer = gazetteer_for(tuple(sorted(set(names))))
+    identity = tiers.heuristic_identity(gazetteer)
+    results = [None] * len(texts)
+    pending = []
+    for i, doc in enumerate(gazetteer.nlp.tokenizer.pipe(texts)):
+        spans, confidence = tiers.heuristic_scan(gazetteer, doc)
+        if confidence >= min_confidence:
+            characters = spacy_ner_extractor.characters_from_persons(spans)
+            results[i] = ("heuristic", identity, confidence, [asdict(char) for char in characters])
+        else:
+            pending.append(i)
+
+    docs = spacy_ner_extractor.get_processor().ner_docs([texts[i] for i in pending], batch_size=batch_size,
+                                                        n_process=1) if pending else []
+    for i, doc in zip(pending, docs):
+        characters = spacy_ner_extractor.characters_from_persons(spacy_ner_extractor.person_entities(doc))
+        results[i] = ("ner", None, tiers.ner_confidence(doc), [asdict(char) for char in characters])
+    return results
+
+
+async def annotate_mentioned(scene_data, cache, llm_extractor, scene_id=None, min_confidence=None):
+    """
+    Fill characters_mentioned for one scene using the LLM.
+
+    With min_confidence set, a scene whose characters_present answer is at
+    least that confident gets the names of the characters present instead.
+    """
+
+    text = scene_data["scene_text"]
+    key = make_key("characters_mentioned", llm_extractor.identity(), {}, text)
+    if use_cached(scene_data, "characters_mentioned", key, cache, scene_id):
+        if answering_tier(scene_data, "characters_mentioned") is None:
+            set_tier(scene_data, "characters_mentioned", "llm")
+        return scene_data
+
+    present = answering_tier(scene_data, "characters_present") if min_confidence is not None else None
+    if present is not None and present["confidence"] is not None and present["confidence"] >= min_confidence:
+        # Keyed by the answer it is derived from, so a later run without tiers still asks the LLM
+        identity = {"extractor": "tiers", "from": scene_data["extraction_keys"]["characters_present"]}
+        names = [character["primary_name"] for character in scene_data.get("characters_present", [])]
+        set_result(scene_data, "characters_mentioned", make_key("characters_mentioned", identity, {}, text),
+                   cache, names)
+        set_tier(scene_data, "characters_mentioned", present["tier"], present["confidence"])
+        return scene_data
+
+    # Includes waiting for a request slot and the token budget
+    with get_tracer().span("llm", scene_id, tokens=dspy_llm_extractor.estimate_tokens(text, overhead=0)):
+        characters = await llm_extractor.extract(text)
+    set_result(scene_data, "characters_mentioned", key, cache, list(characters))
+    set_tier(scene_data, "characters_mentioned", "llm")
+    return scene_data
+
+
+class SceneFiles:
+    """Scenes in JSON files, each written back through a temporary file and a rename."""
+
+    def __init__(self, paths: List[str]):
+        self.paths = paths
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def ids(self):
+        return iter(self.paths)
+
+    def load(self, path) -> Optional[dict]:
+        return validate_and_load_scene_file(path)
+
+    def write_many(self, updates: Dict[str, dict]):
+        for path, scene_data in updates.items():
+            update_scene(path, scene_data)
+
+
+class StoredScenes:
+    """Scenes of a scene store, patched back in chunks with one index update each."""
+
+    def __init__(self, store: SceneStore):
+        self.store = store
+        # Reads and patches come from different threads and share the file
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def ids(self):
+        return iter(range(1, len(self.store) + 1))
+
+    def load(self, number) -> Optional[dict]:
+        with self._lock:
+            scene = self.store.get(number)
+        return scene if "scene_text" in scene else None
+
+    def write_many(self, updates: Dict[int, dict]):
+        with self._lock:
+            self.store.patch_many(updates)
+
+
+class Progress:
+    """Counts of scenes through each stage, printed while the pipeline runs."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.loaded = 0
+        self.skipped = 0
+        self.present = 0
+        self.mentioned = 0
+        self.written = 0
+        self.failed: Dict = {}
+        # Scenes written per (field, tier that answered it)
+        self.tiers: Counter = Counter()
+        self.start = time.monotonic()
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.start
+        return (f"{self.loaded}/{self.total} loaded, {self.present} present, {self.mentioned} mentioned, "
+                f"{self.written} written, {len(self.failed)} failed, {self.skipped} skipped "
+                f"({self.written / elapsed if elapsed else 0.0:.1f} scenes/s)")
+
+    def tier_summary(self) -> str:
+        fields = sorted({field for field, _ in self.tiers})
+        return "; ".join(f"{field}: " + ", ".join(f"{self.tiers[field, tier]} {tier}"
+                                                   for tier in (*tiers.TIERS, "gazetteer")
+                                                   if self.tiers[field, tier])
+                         for field in fields)
+
+
+class SceneItem:
+    """A scene on its way through the stages."""
+
+    __slots__ = ("scene_id", "data", "present_key", "error")
+
+    def __init__(self, scene_id, data: dict, present_key: Optional[str]):
+        self.scene_id = scene_id
+        self.data = data
+        # Cache key of characters_present while it still has to be extracted
+        self.present_key = present_key
+        self.error: Optional[BaseException] = None
+
+
+# Sent down a queue after the last scene
+DONE = None
+
+
+async def load_stage(source, cache, out: asyncio.Queue, progress: Progress, known_names: set):
+    identity = spacy_ner_extractor.extractor_identity()
+    for scene_id in source.ids():
+        try:
+            with get_tracer().span("load", scene_id):
+                scene_data = await asyncio.to_thread(source.load, scene_id)
+        except Exception as e:
+            progress.failed[scene_id] = e
+            continue
+        if scene_data is None:
+            progress.skipped += 1
+            continue
+
+        key = make_key("characters_present", identity, {}, scene_data["scene_text"])
+        cached = use_cached(scene_data, "characters_present", key, cache, scene_id)
+        if cached and answering_tier(scene_data, "characters_present") is None:
+            set_tier(scene_data, "characters_present", "ner")
+        known_names.update(scene_names(scene_data))
+        progress.loaded += 1
+        await out.put(SceneItem(scene_id, scene_data, None if cached else key))
+    await out.put(DONE)
+
+
+async def present_stage(inbox: asyncio.Queue, out: asyncio.Queue, cache, options: PipelineOptions,
+                        executor: Executor, progress: Progress, known_names: set):
+    slots = asyncio.Semaphore(options.spacy_processes)
+    loop = asyncio.get_running_loop()
+    tracer = get_tracer()
+
+    async def run(batch):
+        texts = [item.data["scene_text"] for item in batch]
+        names = sorted(known_names) if options.use_gazetteer or options.tiered else []
+        start = time.perf_counter()
+        try:
+            if options.tiered:
+                results = await loop.run_in_executor(executor, annotate_tiered_batch, texts, names,
+                                                     options.spacy_batch_size, options.min_confidence)
+            else:
+                results = await loop.run_in_executor(executor, annotate_present_batch, texts, names,
+                                                     options.spacy_batch_size)
+        except Exception as e:
+            for item in batch:
+                item.error = e
+        else:
+            seconds = time.perf_counter() - start
+            total = sum(len(text) for text in texts) or 1
+            for item, text, (tier, identity, confidence, characters) in zip(batch, texts, results):
+                key = item.present_key
+                if identity is not None:
+                    # Stored under the gazetteer's own key, so a later run without it still runs NER
+                    key = make_key("characters_present", identity, {}, text)
+                try:
+                    set_result(item.data, "characters_present", key, cache, characters)
+                    set_tier(item.data, "characters_present", tier, confidence)
+                except Exception as e:
+                    item.error = e
+                # Names found here explain later scenes
+                known_names.update(scene_names(item.data))
+                tracer.record("ner", seconds * len(text) / total, item.scene_id, chars=len(text),
+                              gazetteer=identity is not None, tier=tier, confidence=confidence)
+        for item in batch:
+            progress.present += 1
+            await out.put(item)
+        # Only once the batch is handed on, so batches cannot pile up behind a full queue
+        slots.release()
+
+    running = set()
+    batch = []
+    while True:
+        item = await inbox.get()
+        if item is not DONE:
+            if item.present_key is None:
+                progress.present += 1
+                await out.put(item)
+                continue
+            batch.append(item)
+        if batch and (item is DONE or len(batch) >= options.spacy_batch_size):
+            # At most spacy_processes batches are handed to the pool at once
+            await slots.acquire()
+            task = asyncio.create_task(run(batch))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            batch = []
+        if item is DONE:
+            break
+
+    await asyncio.gather(*running)
+    await out.put(DONE)
+
+
+async def mentioned_stage(inbox: asyncio.Queue, out: asyncio.Queue, cache, llm_extractor,
+                          options: PipelineOptions, progress: Progress):
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is DONE:
+                # Let the other workers see it too
+                await inbox.put(DONE)
+                return
+            if item.error is None:
+                try:
+                    await annotate_mentioned(item.data, cache, llm_extractor, item.scene_id,
+                                             options.min_confidence if options.tiered else None)
+                    progress.mentioned += 1
+                except Exception as e:
+                    item.error = e
+            await out.put(item)
+
+    await asyncio.gather(*(worker() for _ in range(options.llm_tasks)))
+    await out.put(DONE)
+
+
+async def write_stage(inbox: asyncio.Queue, source, progress: Progress, chunk_size: int):
+    done = False
+    while not done:
+        items = [await inbox.get()]
+        # Write whatever has queued up in one go
+        while len(items) < chunk_size and not inbox.empty():
+            items.append(inbox.get_nowait())
+        done = DONE in items
+
+        updates = {}
+        for item in items:
+            if item is DONE:
+                continue
+            if item.error is not None:
+                progress.failed[item.scene_id] = item.error
+                print(f"Failed: {item.scene_id}: {item.error!r}")
+            else:
+                updates[item.scene_id] = item.data
+        if not updates:
+            continue
+
+        try:
+            with get_tracer().span("write", scenes=len(updates)):
+                await asyncio.to_thread(source.write_many, updates)
+            progress.written += len(updates)
+            progress.tiers.update((field, record["tier"]) for scene_data in updates.values()
+                                  for field, record in scene_data.get("extraction_tiers", {}).items())
+        except Exception as e:
+            for scene_id in updates:
+                progress.failed[scene_id] = e
+            print(f"Failed to write {len(updates)} scene(s): {e!r}")
+
+
+async def report_progress(progress: Progress, seconds: float):
+    while True:
+        await asyncio.sleep(seconds)
+        print(f"Progress: {progress.summary()}")
+
+
+async def run_pipeline(source, cache, llm_extractor, options: Optional[PipelineOptions] = None,
+                       executor: Optional[Executor] = None) -> Progress:
+    """
+    Annotate every scene of source and write the results back.
+
+    spaCy batches run on executor, by default a pool of
+    options.spacy_processes worker processes. Returns the final counts,
+    including the error of every failed scene.
+    """
+
+    options = options or PipelineOptions()
+    progress = Progress(len(source))
+    known_names = set()
+    loaded = asyncio.Queue(options.queue_size)
+    present = asyncio.Queue(options.queue_size)
+    mentioned = asyncio.Queue(options.queue_size)
+
+    own_executor = executor is None
+    if own_executor:
+        # Spawned rather than forked: the event loop already runs threads
+        executor = ProcessPoolExecutor(options.spacy_processes, mp_context=multiprocessing.get_context("spawn"))
+
+    reporter = asyncio.create_task(report_progress(progress, options.progress_seconds))
+    try:
+        await asyncio.gather(
+            load_stage(source, cache, loaded, progress, known_names),
+            present_stage(loaded, present, cache, options, executor, progress, known_names),
+            mentioned_stage(present, mentioned, cache, llm_extractor, options, progress),
+            write_stage(mentioned, source, progress, options.queue_size),
+        )
+    finally:
+        reporter.cancel()
+        if own_executor:
+            executor.shutdown()
+    return progress
@@ -0,0 +1,256 @@
+"""
+Single-file scene store with an offset index.
+
+Replaces the directory of scene_NNN.json files with one data file. Scenes are
+stored as JSON records and found through an index of (offset, length) pairs,
+so reading scene n is one index lookup plus one slice of a memory-mapped file.
+Updates append a new version of the record and a new index at the end of
+the file; the fixed-size header is rewritten last, so a crash mid-update
+leaves the previous state readable. compact() drops superseded records.
+
+File layout (all integers little-endian):
+
+    header   magic "TWSCENE1", u32 version, u32 scene count, u64 index offset
+    records  UTF-8 JSON objects, one per scene version
+    index    u64 offset, u64 length per scene, in scene order
+
+The same module is kept in scene-detection, characters-in-scene and
+character-dossier so each tool can read and write stores on its own.
+characters-in-scene/test_shared_modules.py fails when the copies differ.
+
+Usage:
+    python scenestore.py import <scene-json-dir> <store-file>
+    python scenestore.py export <store-file> <scene-json-dir>
+"""
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Tuple
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+
+
+MAGIC = b"TWSCENE1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+
+
+def is_scene_store(path) -> bool:
+    """Return True if path is a scene store file."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IsADirectoryError, FileNotFoundError, PermissionError):
+        return False
+
+
+class SceneStore:
+    """
+    Scenes of one book in a single file, numbered from 1 like scene_NNN.json.
+
+    Opening a path that does not exist raises FileNotFoundError; use
+    create() to make a new store. Use as a context manager or call close()
+    when done.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "r+b")
+        magic, version, count, index_offset = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a scene store: {self.path}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported scene store version {version}: {self.path}")
+
+        self._file.seek(index_offset)
+        self._index = array("Q")
+        self._index.frombytes(self._file.read(count * 16))
+        if sys.byteorder != "little":
+            self._index.byteswap()
+        self._index_offset = index_offset
+        self._mmap = None
+
+    @classmethod
+    def create(cls, path, scenes: Iterable[dict] = ()) -> "SceneStore":
+        """
+        Create (or overwrite) a store at path holding the given scenes.
+
+        The scenes are written to a temporary file that replaces path once
+        they are all in, so a failing scenes iterable leaves an existing store
+        as it was.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, HEADER.size))
+        try:
+            with cls(tmp_path) as store:
+                store.append_many(scenes)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def __enter__(self) -> "SceneStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self._index) // 2
+
+    def _data(self) -> mmap.mmap:
+        # Mapped lazily and dropped after every write, since writes grow the file
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _slot(self, number: int) -> int:
+        if not 1 <= number <= len(self):
+            raise IndexError(f"Scene {number} out of range 1..{len(self)}")
+        return 2 * (number - 1)
+
+    def get(self, number: int) -> dict:
+        """Return the data of scene `number` (1-based)."""
+        slot = self._slot(number)
+        offset, length = self._index[slot], self._index[slot + 1]
+        return json.loads(self._data()[offset:offset + length])
+
+    def items(self) -> Iterator[Tuple[int, dict]]:
+        """Yield (scene number, scene data) in book order."""
+        for number in range(1, len(self) + 1):
+            yield number, self.get(number)
+
+    def __iter__(self) -> Iterator[dict]:
+        for _, scene in self.items():
+            yield scene
+
+    def append(self, scene: dict) -> int:
+        """Add a scene at the end and return its number."""
+        self.append_many([scene])
+        return len(self)
+
+    def append_many(self, scenes: Iterable[dict]) -> int:
+        """Add scenes at the end with a single index update. Returns how many were added."""
+        added = 0
+        self._file.seek(0, os.SEEK_END)
+        for scene in scenes:
+            self._index.extend(self._write_record(scene))
+            added += 1
+        self._commit()
+        return added
+
+    def patch(self, number: int, fields: dict):
+        """Merge fields into scene `number`, e.g. new annotation results."""
+        self.patch_many({number: fields})
+
+    def patch_many(self, updates: Dict[int, dict]):
+        """Merge fields into several scenes with a single index update."""
+        slots = {number: self._slot(number) for number in updates}
+        merged = {number: {**self.get(number), **fields} for number, fields in updates.items()}
+
+        self._file.seek(0, os.SEEK_END)
+        for number, scene in merged.items():
+            slot = slots[number]
+            self._index[slot], self._index[slot + 1] = self._write_record(scene)
+        self._commit()
+
+    def _write_record(self, scene: dict) -> Tuple[int, int]:
+        data = json.dumps(scene, ensure_ascii=False).encode("utf-8")
+        offset = self._file.tell()
+        self._file.write(data)
+        return offset, len(data)
+
+    def _commit(self):
+        """Write the index after the last record, then point the header at it."""
+        index_offset = self._file.tell()
+        index = array("Q", self._index)
+        if sys.byteorder != "little":
+            index.byteswap()
+        self._file.write(index.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(self), index_offset))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._index_offset = index_offset
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def compact(self):
+        """Rewrite the store without superseded record versions."""
+        SceneStore.create(self.path, self).close()
+        self.close()
+        self.__init__(self.path)
+
+
+def scene_sort_key(path: Path):
+    """Order scene files by their number, so scene_1000.json comes after scene_999.json."""
+    numbers = re.findall(r"\d+", path.stem)
+    return (int(numbers[-1]) if numbers else -1, path.name)
+
+
+def import_json_dir(json_dir, store_path) -> SceneStore:
+    """Build a store from a directory of scene_NNN.json files, in scene number order."""
+    json_files = sorted(Path(json_dir).glob("*.json"), key=scene_sort_key)
+
+    def scenes():
+        for json_file in json_files:
+            with open(json_file, encoding="utf-8") as f:
+                yield json.load(f)
+
+    return SceneStore.create(store_path, scenes())
+
+
+def export_json_dir(store_path, json_dir) -> int:
+    """Write every scene in the store to scene_NNN.json files. Returns the number written."""
+    json_dir = Path(json_dir)
+    json_dir.mkdir(parents=True, exist_ok=True)
+
+    with SceneStore(store_path) as store:
+        for number, scene in store.items():
+            with open(json_dir / f"scene_{number:03d}.json", "w", encoding="utf-8") as f:
+                json.dump(scene, f, indent=2, ensure_ascii=False)
+        return len(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between scene JSON directories and scene stores")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_cmd = commands.add_parser("import", help="Build a store from scene_NNN.json files")
+    import_cmd.add_argument("json_dir")
+    import_cmd.add_argument("store")
+    export_cmd = commands.add_parser("export", help="Write a store out as scene_NNN.json files")
+    export_cmd.add_argument("store")
+    export_cmd.add_argument("json_dir")
+    args = parser.parse_args()
+
+    if args.command == "export" and not is_scene_store(args.store):
+        parser.error(f"Not a scene store: {args.store}")
+    if args.command == "import":
+        with import_json_dir(args.json_dir, args.store) as store:
+            print(f"Imported {len(store)} scenes into {args.store}")
+    else:
+        count = export_json_dir(args.store, args.json_dir)
+        print(f"Exported {count} scenes to {args.json_dir}")
+
+
+if __name__ == "__main__":
+    main()
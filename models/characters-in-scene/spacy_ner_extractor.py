@@ -2,9 +2,12 @@
 ## python -m spacy download en_core_web_trf
 ## pip install https://github.com/explosion/spacy-experimental/releases/download/v0.6.1/en_coreference_web_trf-3.4.0a2-py3-none-any.whl
 
-import spacy
 from dataclasses import dataclass
-from typing import List, Tuple
+from functools import cache
+from itertools import repeat
+from typing import Iterable, Iterator, List, Optional, Tuple
+import logging
+from tracing import get_tracer
 
 
 
@@ -22,18 +25,96 @@ class Character:
     mentions: List[Mention]
 
 
+NER_MODEL = "en_core_web_trf"
+COREF_MODEL = "en_coreference_web_trf"
+
+# Defaults for nlp.pipe; transformer pipelines are much faster on batches
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_N_PROCESS = 1
+
+
+def extractor_identity():
+    """Identify the pipelines by package version without loading them, for result caching."""
+    import spacy
+
+    return {
+        "extractor": "spacy",
+        "spacy": spacy.__version__,
+        "pipelines": {name: spacy.util.get_package_version(name) for name in (NER_MODEL, COREF_MODEL)},
+        "labels": ["PERSON"],
+    }
+
+
+# Components of en_core_web_trf nothing here reads. NER only listens to the
+# transformer, so leaving them out changes no entity and saves their compute.
+UNUSED_COMPONENTS = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+
+def person_entities(doc) -> List:
+    return [ent for ent in doc.ents if ent.label_ == "PERSON"]
+
+
 class SpacyProcessor:
-    def __init__(self):
-        print("Loading spaCy model 'en_core_web_trf'")
-        self.nlp = spacy.load("en_core_web_trf")
+    """
+    NER pipeline, plus the coreference pipeline once coref output is asked for.
 
-        # Debug: print pipeline components before adding coref
-        print(f"Pipeline components before coref: {self.nlp.pipe_names}")
+    The two pipelines are separately trained transformers, so their passes
+    cannot be shared; the PERSON-only methods skip the coref pass entirely.
+    """
 
-        print("Loading pre-trained coreference model")
-        # Load the pre-trained coreference model instead of adding experimental component
-        self.coref_nlp = spacy.load("en_coreference_web_trf")
-        print("Pre-trained coreference model loaded successfully")
+    def __init__(self):
+        import spacy
+
+        print(f"Loading spaCy model '{NER_MODEL}' without {', '.join(UNUSED_COMPONENTS)}")
+        with get_tracer().span("load", model=NER_MODEL):
+            self.nlp = spacy.load(NER_MODEL, exclude=UNUSED_COMPONENTS)
+        print(f"Pipeline components: {self.nlp.pipe_names}")
+
+        self._coref_nlp = None
+
+    @property
+    def coref_nlp(self):
+        """The coreference pipeline, loaded on first use."""
+        if self._coref_nlp is None:
+            import spacy
+
+            print("Loading pre-trained coreference model")
+            # Load the pre-trained coreference model instead of adding experimental component
+            with get_tracer().span("load", model=COREF_MODEL):
+                self._coref_nlp = spacy.load(COREF_MODEL)
+            print("Pre-trained coreference model loaded successfully")
+        return self._coref_nlp
+
+    def extract_persons(self, text: str) -> List:
+        """PERSON entities of text, without running coreference."""
+        return person_entities(self.nlp(text))
+
+    def ner_docs(
+        self,
+        texts: Iterable[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_process: int = DEFAULT_N_PROCESS,
+        scene_ids: Optional[Iterable] = None,
+    ) -> Iterator:
+        """
+        NER docs of texts, streamed through nlp.pipe. Yields in input order.
+
+        Each batch's time is traced as "ner" spans of scene_ids, split by token count.
+        """
+        docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        yield from get_tracer().attribute("ner", docs, scene_ids if scene_ids is not None else repeat(None),
+                                          batch_size, weight=len)
+
+    def extract_persons_batch(
+        self,
+        texts: Iterable[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_process: int = DEFAULT_N_PROCESS,
+        scene_ids: Optional[Iterable] = None,
+    ) -> Iterator[List]:
+        """Like extract_persons for many texts, streamed through nlp.pipe. Yields in input order."""
+        for doc in self.ner_docs(texts, batch_size, n_process, scene_ids):
+            yield person_entities(doc)
 
     def extract_entities_and_coref(self, text: str) -> Tuple[List, List]:
         # Use main NLP model for NER
@@ -43,30 +124,75 @@ class SpacyProcessor:
         #print(f"All entities found: {[(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in doc.ents]}")
         #print(json.dumps(doc.to_json(), indent=2))
 
-        persons = [ent for ent in doc.ents if ent.label_ == "PERSON"]
-
         # Use separate coref model
-        coref_doc = self.coref_nlp(text)
+        with get_tracer().span("coref", tokens=len(doc)):
+            coref_doc = self.coref_nlp(text)
         coref = coref_doc.spans.get("coref_clusters", [])
 
-        return persons, coref
+        return person_entities(doc), coref
+
+    def extract_entities_and_coref_batch(
+        self,
+        texts: Iterable[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_process: int = DEFAULT_N_PROCESS,
+    ) -> Iterator[Tuple[List, List]]:
+        """
+        Like extract_entities_and_coref for many texts, streamed through nlp.pipe.
+
+        Yields (persons, coref clusters) per text, in input order.
+        """
+        texts = list(texts)
+        docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        coref_docs = self.coref_nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        coref_docs = get_tracer().attribute("coref", coref_docs, repeat(None), batch_size, weight=len)
 
+        for doc, coref_doc in zip(docs, coref_docs):
+            yield person_entities(doc), coref_doc.spans.get("coref_clusters", [])
+
+
+@cache
+def get_processor() -> SpacyProcessor:
+    """The shared SpacyProcessor, created on first use so importing this module loads no model."""
+    return SpacyProcessor()
 
-processor = SpacyProcessor()
 
 def extract_characters_from_scene(text: str) -> List[Character]:
     """Extract characters from a scene text using spaCy."""
 
-    print(f"Processing scene text of length {len(text)} ({text[:50]}...)")
+    logging.debug(f"Processing scene text of length {len(text)} ({text[:50]}...)")
 
     # TODO: co-reference resolution obv
-    persons, _ = processor.extract_entities_and_coref(text)
-    print(f"Found {len(persons)} person entities in scene")
+    persons = get_processor().extract_persons(text)
+    return characters_from_persons(persons)
+
+
+def extract_characters_from_scenes(
+    texts: Iterable[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    n_process: int = DEFAULT_N_PROCESS,
+    scene_ids: Optional[Iterable] = None,
+) -> Iterator[List[Character]]:
+    """Extract characters from many scene texts in batches. Yields one list per scene, in input order."""
+
+    scene_ids = list(scene_ids) if scene_ids is not None else None
+    batches = get_processor().extract_persons_batch(texts, batch_size=batch_size, n_process=n_process,
+                                                     scene_ids=scene_ids)
+    for scene_id, persons in zip(scene_ids if scene_ids is not None else repeat(None), batches):
+        with get_tracer().span("merge", scene_id, entities=len(persons)):
+            characters = characters_from_persons(persons)
+        yield characters
+
+
+def characters_from_persons(persons) -> List[Character]:
+    """Group PERSON entities of one scene into characters by name."""
+
+    logging.debug(f"Found {len(persons)} person entities in scene")
 
     characters = {}
     for ent in persons:
         cid = ent.text.lower().replace(' ', '_')
-        print(f"  Entity {cid} ('{ent.text}') at tokens {ent.start_char}-{ent.end_char}")
+        logging.debug(f"Entity {cid} ('{ent.text}') at tokens {ent.start_char}-{ent.end_char}")
 
         if cid not in characters:
             characters[cid] = Character(ent.text, [ent.text], [])
@@ -74,7 +200,7 @@ def extract_characters_from_scene(text: str) -> List[Character]:
         mention = Mention(ent.start_char, ent.end_char, ent.text)
         characters[cid].mentions.append(mention)
 
-    print(f"Extracted {len(characters)} characters from scene")
+    logging.debug(f"Extracted {len(characters)} characters from scene")
     return list(characters.values())
 
 
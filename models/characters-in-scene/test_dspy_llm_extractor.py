@@ -0,0 +1,172 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from dspy.utils import DummyLM
+from dspy_llm_extractor import LLMCharacterExtractor, TokenRateLimiter, is_retryable
+
+
+class FakeProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def make_extractor(**kwargs):
+    lm = DummyLM([{"reasoning": "Alice is named.", "characters": ["Alice"]}] * 20)
+    return LLMCharacterExtractor(lm=lm, tokens_per_minute=None, backoff_base=0.0, **kwargs)
+
+
+def test_extract_runs_offline_with_stand_in_lm():
+    """Test the whole DSPy path against a local stand-in LM."""
+    extractor = make_extractor()
+
+    assert asyncio.run(extractor.extract("Alice sat by the river.")) == ["Alice"]
+    assert extractor.stats.requests == 1
+    assert extractor.stats.tokens > 0
+    assert extractor.identity()["model"] == "dummy"
+
+
+def test_concurrency_limit_is_respected():
+    """Test that no more than max_concurrency requests are in flight."""
+    extractor = make_extractor(max_concurrency=2)
+    in_flight = []
+    peak = []
+
+    class Result:
+        characters = ["Alice"]
+
+    def slow_predict(scene_text):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        time.sleep(0.02)
+        in_flight.pop()
+        return Result()
+
+    extractor._predict = slow_predict
+
+    async def run():
+        return await asyncio.gather(*(extractor.extract(f"Scene {i}") for i in range(8)))
+
+    assert asyncio.run(run()) == [["Alice"]] * 8
+    assert max(peak) == 2
+
+
+def test_rate_limit_errors_are_retried():
+    """Test that 429 and 5xx errors are retried and other errors are not."""
+    extractor = make_extractor(max_retries=3)
+    errors = [FakeProviderError(429), FakeProviderError(529)]
+
+    class Result:
+        characters = ["Alice"]
+
+    def flaky_predict(scene_text):
+        if errors:
+            raise errors.pop(0)
+        return Result()
+
+    extractor._predict = flaky_predict
+    assert asyncio.run(extractor.extract("Alice")) == ["Alice"]
+    assert extractor.stats.retries == 2
+
+    def broken_predict(scene_text):
+        raise FakeProviderError(400)
+
+    extractor._predict = broken_predict
+    with pytest.raises(FakeProviderError):
+        asyncio.run(extractor.extract("Alice"))
+    assert extractor.stats.failures == 1
+    assert is_retryable(FakeProviderError(503)) and not is_retryable(ValueError("bad output"))
+
+
+def test_token_rate_limiter_waits_for_budget():
+    """Test that requests beyond the per-minute budget wait for the bucket to refill."""
+    limiter = TokenRateLimiter(tokens_per_minute=6000)
+
+    async def run():
+        start = time.monotonic()
+        await limiter.acquire(6000)
+        await limiter.acquire(50)
+        return time.monotonic() - start
+
+    # 50 tokens at 100 tokens per second take half a second to refill
+    assert asyncio.run(run()) >= 0.4
+
+
+def test_concurrent_scenes_are_packed_into_batches():
+    """Test that consecutive scenes share requests and results come back per scene."""
+    lm = DummyLM([
+        {"reasoning": "r", "characters_per_scene": [["Alice"], ["White Rabbit"], []]},
+        {"reasoning": "r", "characters_per_scene": [["Duchess"], ["Alice", "Cheshire Cat"], []]},
+    ])
+    extractor = LLMCharacterExtractor(lm=lm, tokens_per_minute=None, batch_tokens=1000, max_batch_scenes=3)
+
+    async def run():
+        return await asyncio.gather(*(extractor.extract(f"Scene {i}") for i in range(6)))
+
+    assert asyncio.run(run()) == [["Alice"], ["White Rabbit"], [], ["Duchess"], ["Alice", "Cheshire Cat"], []]
+    assert extractor.stats.requests == 2
+    assert extractor.stats.batched_scenes == 6
+
+
+def test_unparseable_batch_falls_back_to_single_scenes():
+    """Test that a batch answer that cannot be split per scene is redone scene by scene."""
+    # Answers are picked by scene text, so the batch request gets a single-scene answer it cannot parse
+    lm = DummyLM({
+        "Scene one": {"reasoning": "r", "characters": ["Alice"]},
+        "Scene two": {"reasoning": "r", "characters": ["Queen"]},
+    })
+    extractor = LLMCharacterExtractor(lm=lm, tokens_per_minute=None, batch_tokens=1000)
+
+    async def run():
+        return await asyncio.gather(extractor.extract("Scene one"), extractor.extract("Scene two"))
+
+    assert asyncio.run(run()) == [["Alice"], ["Queen"]]
+    assert extractor.stats.batched_scenes == 0
+
+
+def test_provider_errors_of_a_batch_are_raised_without_fallback():
+    """Test that a rate-limited batch fails its scenes instead of sending each of them on its own."""
+    extractor = LLMCharacterExtractor(lm=DummyLM([]), tokens_per_minute=None, batch_tokens=1000, max_retries=1,
+                                      backoff_base=0.0)
+    singles = []
+
+    def rate_limited(scene_texts):
+        raise FakeProviderError(429)
+
+    extractor._predict_batch = rate_limited
+    extractor._predict = lambda scene_text: singles.append(scene_text)
+
+    async def run():
+        return await asyncio.gather(extractor.extract("Scene one"), extractor.extract("Scene two"),
+                                    return_exceptions=True)
+
+    assert [type(e) for e in asyncio.run(run())] == [FakeProviderError, FakeProviderError]
+    assert singles == []
+    assert extractor.stats.retries == 1
+    assert extractor.identity() == LLMCharacterExtractor(lm=DummyLM([]), batch_tokens=None).identity()
+
+
+def test_single_scene_fallback_fails_scenes_one_by_one():
+    """Test that after an unusable batch answer a failing scene does not fail the others of its batch."""
+    extractor = LLMCharacterExtractor(lm=DummyLM([]), tokens_per_minute=None, batch_tokens=1000)
+
+    class Result:
+        characters_per_scene = [["Alice"]]
+
+    def predict(scene_text):
+        if "Boom" in scene_text:
+            raise FakeProviderError(400)
+        return SimpleNamespace(characters=[scene_text.split()[0]])
+
+    extractor._predict_batch = lambda scene_texts: Result()
+    extractor._predict = predict
+
+    async def run():
+        return await asyncio.gather(extractor.extract("Alice ran"), extractor.extract("Boom"),
+                                    extractor.extract("Queen shouted"), return_exceptions=True)
+
+    alice, boom, queen = asyncio.run(run())
+    assert (alice, queen) == (["Alice"], ["Queen"])
+    assert isinstance(boom, FakeProviderError)
+    assert extractor._batch_tasks == set()
@@ -0,0 +1,45 @@
+from gazetteer import AliasGazetteer
+
+
+def test_scene_with_only_known_names_is_explained():
+    """Test that known names are found and capitalized sentence openers are not escalated."""
+    gazetteer = AliasGazetteer(["Alice", "White Rabbit", "Rabbit"])
+    text = "“Oh dear!” the White Rabbit said to Alice.\n\nThen she ran. Alice followed."
+
+    spans = gazetteer.scan_doc(gazetteer.nlp.make_doc(text))
+
+    assert [(span.text, span.start_char, span.end_char) for span in spans] == [
+        ("White Rabbit", 15, 27), ("Alice", 36, 41), ("Alice", 58, 63)]
+    assert all(span.label_ == "PERSON" for span in spans)
+
+
+def test_scene_with_unknown_capitalized_word_is_escalated():
+    """Test that a capitalized word inside a sentence that is no known name sends the scene to NER."""
+    gazetteer = AliasGazetteer(["Alice"])
+
+    results = list(gazetteer.scan(["Alice met the Duchess.", "Alice met her sister.", "I think, said Alice."]))
+
+    assert results[0] is None
+    assert [span.text for span in results[1]] == ["Alice"]
+    assert [span.text for span in results[2]] == ["Alice"]
+
+
+def test_identity_depends_on_names():
+    """Test that cached gazetteer results are dropped when the known names change."""
+    assert AliasGazetteer(["Alice", "Dinah"]).identity() == AliasGazetteer(["Dinah", "Alice"]).identity()
+    assert AliasGazetteer(["Alice"]).identity() != AliasGazetteer(["Alice", "Dinah"]).identity()
+
+
+def test_unknown_name_opening_a_sentence_or_quote_is_escalated():
+    """Test that a capitalized opener that is no stop word and never lower case counts as unexplained."""
+    gazetteer = AliasGazetteer(["Alice"])
+
+    results = list(gazetteer.scan([
+        "Dinah will miss me very much, said Alice.",
+        "Alice looked up. Bill was coming down the chimney.",
+        "“Bill!” cried Alice.",
+        "“Oh dear!” cried Alice. Presently she ran on, presently.",
+    ]))
+
+    assert results[:3] == [None, None, None]
+    assert [span.text for span in results[3]] == ["Alice"]
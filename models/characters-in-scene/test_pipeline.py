@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+
+import pipeline
+from pipeline import PipelineOptions, Progress, SceneFiles, explain_batch, lookup_cached, run_pipeline
+from resultcache import ResultCache
+
+
+def test_gazetteer_explains_scenes_of_known_names_only():
+    """Test that only scenes with unknown capitalized words are left for NER, and others get the known names."""
+    results = explain_batch(["Then Alice met Dinah.", "Oh, said Alice."], ["Alice"])
+
+    assert results[0] is None
+    identity, characters = results[1]
+    assert characters == [
+        {"primary_name": "Alice", "aliases": ["Alice"], "mentions": [{"start": 9, "end": 14, "text": "Alice"}]}]
+
+
+def test_fields_without_a_cache_key_are_extracted_again(tmp_path):
+    """Test that a field written before results were cached is neither trusted nor stored under the current key."""
+    cache = ResultCache(tmp_path / "results.sqlite")
+    scene_data = {"scene_text": "Alice ran.", "characters_mentioned": ["Dinah"]}
+
+    assert not lookup_cached(scene_data, "characters_mentioned", "key", cache)
+    assert cache.get("key") is None
+
+    cache.put("key", ["Alice"])
+    assert lookup_cached(scene_data, "characters_mentioned", "key", cache)
+    assert scene_data["characters_mentioned"] == ["Alice"]
+    assert scene_data["extraction_keys"] == {"characters_mentioned": "key"}
+
+
+class FakeLLMExtractor:
+    """Names the capitalized words of a scene, failing on scenes that contain 'Boom'."""
+
+    def identity(self):
+        return {"extractor": "fake"}
+
+    async def extract(self, text):
+        if "Boom" in text:
+            raise RuntimeError("LLM failed")
+        await asyncio.sleep(0.001)
+        return [word.strip(".,") for word in text.split() if word[0].isupper()]
+
+
+def fake_present_batch(texts, names, batch_size):
+    return [("ner", None, None, [{"primary_name": "Alice", "aliases": ["Alice"], "mentions": []}]) for _ in texts]
+
+
+def write_scenes(tmp_path, texts):
+    paths = []
+    for number, text in enumerate(texts, 1):
+        path = tmp_path / f"scene_{number:03d}.json"
+        path.write_text(json.dumps({"scene_text": text} if text is not None else {"other": 1}))
+        paths.append(str(path))
+    return paths
+
+
+def run(paths, tmp_path, monkeypatch, **options):
+    monkeypatch.setattr(pipeline, "annotate_present_batch", fake_present_batch)
+    with ThreadPoolExecutor(1) as executor:
+        return asyncio.run(run_pipeline(SceneFiles(paths), ResultCache(tmp_path / "results.sqlite"),
+                                        FakeLLMExtractor(), PipelineOptions(**options), executor))
+
+
+def test_pipeline_writes_scenes_and_carries_on_after_failures(tmp_path, monkeypatch):
+    """Test that every good scene is annotated and written, while failed and invalid scenes are reported."""
+    paths = write_scenes(tmp_path, ["Alice ran.", "Boom went Alice.", None, "Dinah slept."])
+
+    progress = run(paths, tmp_path, monkeypatch, spacy_batch_size=2)
+
+    assert progress.written == 2
+    assert progress.skipped == 1
+    assert list(progress.failed) == [paths[1]]
+    scene = json.loads(open(paths[3]).read())
+    assert scene["characters_mentioned"] == ["Dinah"]
+    assert scene["characters_present"][0]["primary_name"] == "Alice"
+    assert "characters_mentioned" not in json.loads(open(paths[1]).read())
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_scenes_in_flight_are_bounded_by_the_queues(tmp_path, monkeypatch):
+    """Test that loading stays a bounded distance ahead of writing, however many scenes there are."""
+    paths = write_scenes(tmp_path, [f"Scene {number} with Alice." for number in range(40)])
+    runs = []
+    ahead = []
+
+    def tracked_progress(total):
+        runs.append(Progress(total))
+        return runs[-1]
+
+    def tracked_load(self, path):
+        ahead.append(runs[-1].loaded - runs[-1].written)
+        return load(self, path)
+
+    load = SceneFiles.load
+    monkeypatch.setattr(pipeline, "Progress", tracked_progress)
+    monkeypatch.setattr(SceneFiles, "load", tracked_load)
+    progress = run(paths, tmp_path, monkeypatch, spacy_batch_size=1, llm_tasks=1, queue_size=1)
+
+    assert progress.written == 40
+    # Three queues of one, one spaCy batch, one LLM task and one chunk being written
+    assert max(ahead) <= 6
+
+
+class FakeNER:
+    """Tags only 'Alice' as a PERSON, on spaCy's blank tokenizer."""
+
+    def ner_docs(self, texts, batch_size, n_process):
+        import spacy
+        from spacy.tokens import Span
+
+        nlp = spacy.blank("en")
+        for doc in nlp.tokenizer.pipe(texts):
+            doc.ents = [Span(doc, token.i, token.i + 1, label="PERSON") for token in doc if token.text == "Alice"]
+            yield doc
+
+
+def test_tiered_pipeline_escalates_only_scenes_the_cheap_tiers_are_unsure_of(tmp_path, monkeypatch):
+    """Test that confident scenes skip NER and the LLM, and the answering tier of every field is recorded."""
+    paths = write_scenes(tmp_path, ["The rain fell on the hills all day.",
+                                    "“Off with her head!” said the Queen.",
+                                    "Alice saw Dinah and Bill by the Mock Turtle."])
+    monkeypatch.setattr(pipeline.spacy_ner_extractor, "get_processor", FakeNER)
+    llm = FakeLLMExtractor()
+    asked = []
+    extract = llm.extract
+    llm.extract = lambda text: asked.append(text) or extract(text)
+
+    with ThreadPoolExecutor(1) as executor:
+        progress = asyncio.run(run_pipeline(SceneFiles(paths), ResultCache(tmp_path / "results.sqlite"), llm,
+                                            PipelineOptions(tiered=True), executor))
+
+    scenes = [json.loads(open(path).read()) for path in paths]
+    tiers = [{field: record["tier"] for field, record in scene["extraction_tiers"].items()} for scene in scenes]
+    assert tiers == [{"characters_present": "heuristic", "characters_mentioned": "heuristic"},
+                     {"characters_present": "heuristic", "characters_mentioned": "heuristic"},
+                     {"characters_present": "ner", "characters_mentioned": "llm"}]
+    assert asked == ["Alice saw Dinah and Bill by the Mock Turtle."]
+    assert [scene["characters_mentioned"] for scene in scenes[:2]] == [[], ["Queen"]]
+    assert [c["primary_name"] for c in scenes[2]["characters_present"]] == ["Alice"]
+    assert progress.tiers[("characters_mentioned", "llm")] == 1
@@ -0,0 +1,63 @@
+from resultcache import ResultCache, make_key
+
+
+def test_key_depends_on_text_identity_and_params():
+    """Test that any change to the inputs of an extraction gives a new key."""
+    identity = {"extractor": "spacy", "pipelines": {"en_core_web_trf": "3.7.3"}}
+    key = make_key("characters_present", identity, {}, "Alice ran.")
+
+    assert key == make_key("characters_present", dict(identity), {}, "Alice ran.")
+    assert key != make_key("characters_present", identity, {}, "Alice walked.")
+    assert key != make_key("characters_present", {**identity, "pipelines": {"en_core_web_trf": "3.8.0"}}, {}, "Alice ran.")
+    assert key != make_key("characters_present", identity, {"labels": ["PERSON"]}, "Alice ran.")
+    assert key != make_key("characters_mentioned", identity, {}, "Alice ran.")
+
+
+def test_get_or_compute_only_computes_on_miss(tmp_path):
+    """Test that a stored result is reused, also by a new cache instance on the same file."""
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return ["Alice", "White Rabbit"]
+
+    cache = ResultCache(tmp_path / "results.sqlite")
+    assert cache.get_or_compute("key", compute) == ["Alice", "White Rabbit"]
+    assert cache.get_or_compute("key", compute) == ["Alice", "White Rabbit"]
+    cache.close()
+
+    reopened = ResultCache(tmp_path / "results.sqlite")
+    assert reopened.get_or_compute("key", compute) == ["Alice", "White Rabbit"]
+    assert len(calls) == 1
+    assert (reopened.hits, reopened.misses) == (1, 0)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    """Test that the cache stays under its size limit by dropping the oldest entries."""
+    cache = ResultCache(tmp_path / "results.sqlite", max_bytes=250)
+    for i in range(5):
+        cache.put(f"key-{i}", "x" * 100)
+        # Keep the first entry in use so it survives
+        cache.get("key-0")
+
+    assert cache.size() <= 250
+    assert cache.get("key-0") is not None
+    assert cache.get("key-1") is None
+    assert cache.get("key-4") is not None
+
+
+def test_running_size_follows_puts_replacements_and_evictions(tmp_path):
+    """Test that the running size total matches the table without summing it on every put."""
+    cache = ResultCache(tmp_path / "results.sqlite", max_bytes=100)
+    cache.put("a", "x" * 20)
+    cache.put("b", "x" * 30)
+    cache.put("a", "x" * 10)
+    assert cache._size == cache.size() == 12 + 32
+
+    cache.put("c", "x" * 70)
+    assert cache._size == cache.size() <= 100
+    assert cache.get("c") is not None
+    size = cache.size()
+    cache.close()
+
+    assert ResultCache(tmp_path / "results.sqlite", max_bytes=100)._size == size
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import pytest
+
+
+MODELS_DIR = Path(__file__).resolve().parent.parent
+
+# Modules kept as identical copies in several projects, and the projects holding them
+SHARED_MODULES = {
+    "scenestore.py": ("scene-detection", "characters-in-scene", "character-dossier"),
+    "resultcache.py": ("characters-in-scene", "character-dossier"),
+    "gazetteer.py": ("characters-in-scene", "character-dossier"),
+    "tracing.py": ("characters-in-scene", "character-dossier"),
+}
+
+
+@pytest.mark.parametrize("module", sorted(SHARED_MODULES))
+def test_shared_module_copies_are_identical(module):
+    """Test that a change to a shared module was copied to every project that keeps it."""
+    copies = {project: (MODELS_DIR / project / module).read_bytes() for project in SHARED_MODULES[module]}
+
+    differing = [project for project, source in copies.items() if source != copies["characters-in-scene"]]
+    assert not differing, f"{module} in {', '.join(differing)} differs from characters-in-scene/{module}"
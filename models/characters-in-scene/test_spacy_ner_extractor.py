@@ -0,0 +1,10 @@
+import subprocess
+import sys
+
+
+def test_import_loads_no_model():
+    """Test that importing the extractor neither imports spaCy nor loads a pipeline."""
+    code = "import sys, spacy_ner_extractor; print('spacy' in sys.modules, spacy_ner_extractor.get_processor.cache_info().currsize)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.split() == ["False", "0"]
@@ -0,0 +1,24 @@
+from gazetteer import AliasGazetteer
+from tiers import heuristic_scan
+
+
+def scan(names, text):
+    gazetteer = AliasGazetteer(names)
+    spans, confidence = heuristic_scan(gazetteer, gazetteer.nlp.make_doc(text))
+    return [span.text for span in spans], confidence
+
+
+def test_heuristic_tier_is_certain_of_scenes_it_can_explain():
+    """Test that descriptive scenes, known names and named speakers give full confidence."""
+    assert scan([], "The rain fell on the hills. It fell all day, and the rivers rose.") == ([], 1.0)
+    assert scan(["Alice"], "Then Alice sat down.\n\nPresently the rain stopped, presently.") == (["Alice"], 1.0)
+    assert scan([], "“Off with her head!” said the Queen. “Never,” Alice replied.") == (["Queen", "Alice"], 1.0)
+
+
+def test_unknown_names_lower_the_heuristic_confidence():
+    """Test that capitalized words no name explains, inside or opening a sentence, count as doubtful."""
+    names, confidence = scan(["Alice"], "Alice met Dinah by the river.")
+    assert (names, confidence) == (["Alice"], 0.5)
+
+    names, confidence = scan([], "Gandalf walked on. The road was long.")
+    assert (names, confidence) == ([], 0.0)
@@ -0,0 +1,54 @@
+import json
+
+from tracing import DEBUG, SPANS, Collector, JsonlSink, Tracer
+
+
+def test_spans_are_summed_per_stage_and_scene():
+    """Test that the collector attributes span time and cache hits to their stages and scenes."""
+    collector = Collector()
+    tracer = Tracer([collector])
+
+    tracer.record("ner", 2.0, "a", tokens=100)
+    tracer.record("ner", 1.0, "b", tokens=50)
+    tracer.record("cache", 0.5, "a", cache_hit=True)
+    with tracer.span("write") as span:
+        span.set(scenes=2)
+
+    stages = collector.by_stage()
+    assert stages["ner"] == {"count": 2, "seconds": 3.0, "tokens": 150, "cache_hits": 0}
+    assert stages["cache"]["cache_hits"] == 1
+    assert collector.by_scene() == {"a": {"ner": 2.0, "cache": 0.5}, "b": {"ner": 1.0}}
+    assert collector.records[-1]["scenes"] == 2
+
+
+def test_batch_time_is_split_by_weight():
+    """Test that attribute() yields every item and splits each group's time among its scenes by weight."""
+    collector = Collector()
+    tracer = Tracer([collector])
+
+    items = list(tracer.attribute("ner", ["xxx", "x", "yy"], ["a", "b", "c"], group_size=2, weight=len))
+
+    assert items == ["xxx", "x", "yy"]
+    a, b, c = collector.records
+    assert (a["scene"], a["tokens"], b["scene"], c["scene"]) == ("a", 3, "b", "c")
+    assert abs(a["seconds"] - 3 * b["seconds"]) < 1e-9
+
+
+def test_debug_payload_only_built_at_debug_level(tmp_path):
+    """Test that debug payloads are neither built nor written below DEBUG, and written as JSONL at it."""
+    def payload():
+        calls.append(1)
+        return {"ents": []}
+
+    calls = []
+    Tracer([Collector()], SPANS).debug("doc", payload)
+    Tracer(level=DEBUG).debug("doc", payload)
+    assert calls == []
+
+    sink = JsonlSink(tmp_path / "trace.jsonl")
+    tracer = Tracer([sink], DEBUG)
+    tracer.debug("doc", payload, scene="a")
+    tracer.close()
+
+    record = json.loads((tmp_path / "trace.jsonl").read_text())
+    assert (record["kind"], record["scene"], record["data"]) == ("debug", "a", {"ents": []})
@@ -0,0 +1,92 @@
+"""
+Tiered extraction: every scene is answered by the cheapest tier confident about it.
+
+    heuristic -> ner -> llm
+
+The heuristic tier reads a scene with spaCy's blank tokenizer. It finds the
+names already known in the book (the alias gazetteer) and the capitalized
+words named as speakers ("said the Hatter", "Alice replied"). The words that
+could still be unknown characters are counted as doubtful: the capitalized
+words the gazetteer leaves unexplained (see AliasGazetteer.match_doc) that
+are not speakers either. A tier's confidence is the share of names among names and doubtful
+words. A scene without either, like a descriptive passage, is certain.
+
+characters_present comes from the heuristic tier if it is confident enough,
+otherwise from en_core_web_trf. The NER tier's confidence counts every
+entity, of any label, as explaining its words. characters_mentioned is the
+names of the characters present when that answer is confident enough, and
+is only sent to the LLM otherwise.
+
+The tier and confidence that answered each field are recorded under
+extraction_tiers in the scene data, so accuracy and cost per tier can be
+compared.
+"""
+from typing import List, Tuple
+
+from gazetteer import ALWAYS_CAPITALIZED, AliasGazetteer, opens_sentence
+
+
+TIERS = ("heuristic", "ner", "llm")
+DEFAULT_MIN_CONFIDENCE = 0.9
+SPEECH_VERBS = {"said", "says", "asked", "replied", "cried", "shouted", "whispered", "exclaimed", "answered",
+                "added", "continued", "remarked", "thought", "muttered"}
+# Version of the heuristics, part of the heuristic tier's cache key
+HEURISTIC_VERSION = 2
+
+
+def confidence(names: int, doubtful: int) -> float:
+    """Share of names among the names and doubtful words of a scene; 1.0 if it has neither."""
+    return names / (names + doubtful) if names + doubtful else 1.0
+
+
+def speaker_spans(doc, covered: set) -> List:
+    """PERSON spans of runs of capitalized words right after or before a speech verb, outside covered tokens."""
+    from spacy.tokens import Span
+
+    spans = []
+    for token in doc:
+        if token.lower_ not in SPEECH_VERBS:
+            continue
+        # "said the March Hare"
+        start = token.i + 1
+        if start < len(doc) and doc[start].lower_ == "the":
+            start += 1
+        end = start
+        while end < len(doc) and doc[end].is_title and end not in covered:
+            end += 1
+        if end > start:
+            spans.append(Span(doc, start, end, label="PERSON"))
+        # "Alice replied"
+        end = token.i
+        start = end
+        while start > 0 and doc[start - 1].is_title and start - 1 not in covered:
+            start -= 1
+        if end > start and doc[start].text not in ALWAYS_CAPITALIZED:
+            spans.append(Span(doc, start, end, label="PERSON"))
+    return spans
+
+
+def heuristic_scan(gazetteer: AliasGazetteer, doc) -> Tuple[List, float]:
+    """PERSON spans of known names and speakers in doc, and the heuristic tier's confidence in them."""
+    from spacy.util import filter_spans
+
+    known, unexplained = gazetteer.match_doc(doc)
+    covered = {i for span in known for i in range(span.start, span.end)}
+    spans = filter_spans(known + speaker_spans(doc, covered))
+    covered = {i for span in spans for i in range(span.start, span.end)}
+
+    doubtful = {token.i for token in unexplained if token.i not in covered}
+    return spans, confidence(len(spans), len(doubtful))
+
+
+def ner_confidence(doc) -> float:
+    """Confidence of the NER tier in doc: entities of any label explain capitalized words inside sentences."""
+    covered = {i for ent in doc.ents for i in range(ent.start, ent.end)}
+    doubtful = [token for token in doc
+                if token.i not in covered and token.is_title and token.text not in ALWAYS_CAPITALIZED
+                and not opens_sentence(token)]
+    return confidence(len(doc.ents), len(doubtful))
+
+
+def heuristic_identity(gazetteer: AliasGazetteer) -> dict:
+    return {"extractor": "heuristic", "version": HEURISTIC_VERSION, "gazetteer": gazetteer.identity()}
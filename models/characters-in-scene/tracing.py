@@ -0,0 +1,238 @@
+"""
+Structured tracing of the extraction pipeline.
+
+A span times one stage of the work on one scene (load, ner, coref, llm,
+merge, write, ...) and becomes a record like
+
+    {"kind": "span", "name": "ner", "scene": "scene_012", "start": 1760000000.0,
+     "seconds": 0.84, "tokens": 712, "cache_hit": false}
+
+Records go to sinks: JsonlSink appends them to a trace file, Collector keeps
+them in memory and sums them up per stage and per scene, so a run shows which
+scenes and stages dominate it.
+
+The verbosity decides what is recorded. At OFF nothing is, and spans cost a
+no-op call. At SPANS every span is. DEBUG adds debug records, whose payload
+(a spaCy doc as JSON, say) is a callable that is only called at that level,
+so debug dumps stay off the hot path otherwise.
+
+The same module is kept in characters-in-scene and character-dossier;
+test_shared_modules.py there fails when the copies differ.
+"""
+from collections import defaultdict
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import json
+import threading
+import time
+
+
+OFF = 0
+SPANS = 1
+DEBUG = 2
+LEVELS = {"off": OFF, "spans": SPANS, "debug": DEBUG}
+
+
+class JsonlSink:
+    """Appends records to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        # LLM requests and spaCy batches record from worker threads
+        self._lock = threading.Lock()
+
+    def __call__(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class Collector:
+    """Keeps records in memory and sums up their cost per stage and per scene."""
+
+    def __init__(self):
+        self.records: List[dict] = []
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+    def spans(self) -> Iterator[dict]:
+        return (record for record in self.records if record["kind"] == "span")
+
+    def by_stage(self) -> Dict[str, dict]:
+        """Count, total seconds, tokens and cache hits of the spans of every stage."""
+        stages = defaultdict(lambda: {"count": 0, "seconds": 0.0, "tokens": 0, "cache_hits": 0})
+        for record in self.spans():
+            stage = stages[record["name"]]
+            stage["count"] += 1
+            stage["seconds"] += record["seconds"]
+            stage["tokens"] += record.get("tokens", 0)
+            stage["cache_hits"] += bool(record.get("cache_hit"))
+        return dict(stages)
+
+    def by_scene(self) -> Dict[Any, Dict[str, float]]:
+        """Seconds spent on every scene, per stage. Spans of no particular scene are left out."""
+        scenes = defaultdict(lambda: defaultdict(float))
+        for record in self.spans():
+            if record["scene"] is not None:
+                scenes[record["scene"]][record["name"]] += record["seconds"]
+        return {scene: dict(stages) for scene, stages in scenes.items()}
+
+    def summary(self, top: int = 5) -> str:
+        lines = ["Time per stage:"]
+        stages = sorted(self.by_stage().items(), key=lambda item: item[1]["seconds"], reverse=True)
+        for name, stage in stages:
+            lines.append(f"  {name:12} {stage['seconds']:9.3f}s in {stage['count']} span(s), "
+                         f"{stage['tokens']} tokens, {stage['cache_hits']} cache hit(s)")
+
+        scenes = sorted(self.by_scene().items(), key=lambda item: sum(item[1].values()), reverse=True)
+        if scenes:
+            lines.append("Costliest scenes:")
+        for scene, cost in scenes[:top]:
+            breakdown = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in
+                                  sorted(cost.items(), key=lambda item: item[1], reverse=True))
+            lines.append(f"  {scene}: {sum(cost.values()):.3f}s ({breakdown})")
+        return "\n".join(lines)
+
+
+class Span:
+    """Times a with block and records it when the block ends, with the error if it raised."""
+
+    def __init__(self, tracer: "Tracer", name: str, scene, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.scene = scene
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Add attributes (tokens, cache_hit, ...) known only once the block has run."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attrs["error"] = repr(exc)
+        self.tracer.record(self.name, time.perf_counter() - self._start, self.scene, start=self._wall, **self.attrs)
+        return False
+
+
+class NullSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """Records spans and debug payloads to its sinks, up to its verbosity level."""
+
+    def __init__(self, sinks: Iterable[Callable[[dict], None]] = (), level: int = SPANS):
+        self.sinks = list(sinks)
+        self.level = level if self.sinks else OFF
+
+    @property
+    def enabled(self) -> bool:
+        return self.level >= SPANS
+
+    def _emit(self, record: dict):
+        for sink in self.sinks:
+            sink(record)
+
+    def span(self, name: str, scene=None, **attrs):
+        """A context manager recording how long its block took for scene."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, scene, attrs)
+
+    def record(self, name: str, seconds: float, scene=None, start: Optional[float] = None, **attrs):
+        """Record a span measured elsewhere."""
+        if not self.enabled:
+            return
+        self._emit({"kind": "span", "name": name, "scene": scene,
+                    "start": time.time() - seconds if start is None else start, "seconds": seconds, **attrs})
+
+    def debug(self, name: str, payload: Callable[[], Any], scene=None):
+        """Record payload() at DEBUG verbosity; below it, payload is never called."""
+        if self.level >= DEBUG:
+            self._emit({"kind": "debug", "name": name, "scene": scene, "time": time.time(), "data": payload()})
+
+    def attribute(self, name: str, items: Iterable, scenes: Iterable, group_size: int = 1,
+                  weight: Optional[Callable[[Any], int]] = None, **attrs) -> Iterator:
+        """
+        Yield items, recording a span per item for the scene at the same position in scenes.
+
+        Items are pulled group_size at a time, as a batched pipeline produces
+        them, and the time a group took is split among its items in proportion
+        to weight(item) (recorded as tokens), or evenly without a weight.
+        Time the consumer spends between items is not counted.
+        """
+        if not self.enabled:
+            yield from items
+            return
+
+        items = iter(items)
+        scenes = iter(scenes)
+        while True:
+            wall = time.time()
+            start = time.perf_counter()
+            group = list(islice(items, group_size))
+            if not group:
+                return
+            seconds = time.perf_counter() - start
+
+            weights = [weight(item) for item in group] if weight else [1] * len(group)
+            total = sum(weights)
+            for item, item_weight in zip(group, weights):
+                share = item_weight / total if total else 1 / len(group)
+                extra = {"tokens": item_weight} if weight else {}
+                self.record(name, seconds * share, next(scenes, None), start=wall, batch=len(group), **extra, **attrs)
+                yield item
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """The tracer of this process; recording nothing until configure() is called."""
+    return _tracer
+
+
+def configure(path=None, level: str = "spans", collect: bool = False) -> Tracer:
+    """
+    Install a tracer writing to the JSONL file at path and/or an in-memory Collector.
+
+    Returns the tracer; its Collector, if any, is among its sinks.
+    """
+    global _tracer
+    sinks = []
+    if path:
+        sinks.append(JsonlSink(path))
+    if collect:
+        sinks.append(Collector())
+    _tracer = Tracer(sinks, LEVELS[level])
+    return _tracer
+
+
+def collector(tracer: Tracer) -> Optional[Collector]:
+    return next((sink for sink in tracer.sinks if isinstance(sink, Collector)), None)
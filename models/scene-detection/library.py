@@ -0,0 +1,169 @@
+"""
+Segment a whole library of books in parallel.
+
+Every book is cut into shards (chapters, or paragraph-aligned pieces of long
+chapters) and all shards of all books go through one process pool, so a run
+over many books keeps every core busy and a single large book scales with the
+number of cores. Books are read and sharded only when the pool has room for
+more work, so memory use does not grow with the size of the library. Scenes
+are stitched back together in book order and written to each book's
+text/scenes/ directory.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import os
+import re
+
+from main import DEFAULT_ENGINE, split_text_into_scenes, write_scenes_to_json, write_scenes_to_store
+
+
+# Chapters longer than this are split further at paragraph breaks so one huge
+# chapter does not end up as a single long-running task
+DEFAULT_MAX_SHARD_CHARS = 100_000
+
+CHAPTER_HEADING = re.compile(r"^CHAPTER [IVXLCDM\d]+\b.*$", re.MULTILINE)
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+# Shards submitted to the pool ahead of the results being written, per worker
+PENDING_SHARDS_PER_WORKER = 4
+
+
+def find_book_text(book_dir: Path) -> Optional[Path]:
+    """
+    Find the full text of a book laid out like assets/books/<book>/text/.
+
+    Prefers a *-full.txt file and falls back to the only .txt file in text/.
+    Returns None when the directory does not look like a book.
+    """
+    text_dir = book_dir / "text"
+    if not text_dir.is_dir():
+        return None
+
+    full_texts = sorted(text_dir.glob("*-full.txt"))
+    if full_texts:
+        return full_texts[0]
+
+    texts = sorted(text_dir.glob("*.txt"))
+    if len(texts) == 1:
+        return texts[0]
+
+    return None
+
+
+def find_books(library_dir: Path) -> Iterator[Tuple[Path, Path]]:
+    """Book directories in library_dir, in name order, with their full text files."""
+    for book_dir in sorted(library_dir.iterdir()):
+        text_file = find_book_text(book_dir) if book_dir.is_dir() else None
+        if text_file is not None:
+            yield book_dir, text_file
+
+
+def split_by_size(text: str, max_shard_chars: int) -> List[str]:
+    """Split text into pieces of at most roughly max_shard_chars, cutting only at paragraph breaks."""
+    shards = []
+    start = 0
+    while len(text) - start > max_shard_chars:
+        # Cut at the last paragraph break before the limit, or the first after it
+        cut = None
+        for match in PARAGRAPH_BREAK.finditer(text, start + 1, start + max_shard_chars):
+            cut = match.end()
+        if cut is None:
+            match = PARAGRAPH_BREAK.search(text, start + max_shard_chars)
+            if match is None:
+                break
+            cut = match.end()
+        shards.append(text[start:cut])
+        start = cut
+
+    shards.append(text[start:])
+    return shards
+
+
+def split_into_shards(text: str, max_shard_chars: int = DEFAULT_MAX_SHARD_CHARS) -> List[str]:
+    """
+    Split a book into chapter shards.
+
+    Front matter before the first chapter heading is a shard of its own and
+    chapters longer than max_shard_chars are split at paragraph breaks. A book
+    without chapter headings is split by size only. Joining the shards gives
+    back the input text.
+    """
+    starts = [match.start() for match in CHAPTER_HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+
+    shards = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        shards.extend(split_by_size(text[start:end], max_shard_chars))
+
+    return [shard for shard in shards if shard]
+
+
+def segment_shard(shard: str, w: int = 20, k: int = 10, engine: str = DEFAULT_ENGINE) -> List[str]:
+    """Segment one shard into scenes. Shards too short for TextTiling become a single scene."""
+    try:
+        return split_text_into_scenes(shard, w=w, k=k, engine=engine)
+    except ValueError:
+        return [shard.strip()] if shard.strip() else []
+
+
+def segment_library(
+    library_dir: str,
+    workers: Optional[int] = None,
+    w: int = 20,
+    k: int = 10,
+    engine: str = DEFAULT_ENGINE,
+    max_shard_chars: int = DEFAULT_MAX_SHARD_CHARS,
+    store: bool = False,
+) -> dict:
+    """
+    Segment every book in a library directory and write each book's scenes.
+
+    Paths are resolved against the current directory, so the scenes are
+    written next to the books wherever the script is run from.
+
+    Args:
+        library_dir: Directory containing one sub-directory per book
+        workers: Number of worker processes (default: one per core)
+        w: Block size - number of sentences in a block (default: 20)
+        k: Number of blocks to compare for boundary detection (default: 10)
+        engine: TextTiling implementation, "numpy" (default) or "nltk"
+        max_shard_chars: Chapters longer than this are split further
+        store: Write text/scenes.store instead of text/scenes/*.json
+
+    Returns:
+        Number of scenes written, keyed by book directory name
+    """
+    books = find_books(Path(library_dir).resolve())
+    max_pending = (workers or os.cpu_count() or 1) * PENDING_SHARDS_PER_WORKER
+
+    scene_counts = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Books whose shards are submitted but not yet written, in book order
+        pending = deque()
+        pending_shards = 0
+        while True:
+            # Read the next books while the pool has room, so it never idles
+            # between books; results are still written back in book order
+            while pending_shards < max_pending:
+                book = next(books, None)
+                if book is None:
+                    break
+                book_dir, text_file = book
+                shards = split_into_shards(text_file.read_text(encoding="utf-8"), max_shard_chars)
+                print(f"{book_dir.name}: {len(shards)} shards from {text_file.name}")
+                pending.append((book_dir, [executor.submit(segment_shard, shard, w, k, engine) for shard in shards]))
+                pending_shards += len(shards)
+            if not pending:
+                break
+
+            book_dir, shard_futures = pending.popleft()
+            pending_shards -= len(shard_futures)
+            scenes = (scene for future in shard_futures for scene in future.result())
+            if store:
+                scene_counts[book_dir.name] = write_scenes_to_store(scenes, str(book_dir / "text" / "scenes.store"))
+            else:
+                scene_counts[book_dir.name] = write_scenes_to_json(scenes, str(book_dir / "text" / "scenes"))
+
+    return scene_counts
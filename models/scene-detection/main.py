@@ -1,8 +1,35 @@
+from functools import cache
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional
+import argparse
 import json
 import nltk
 from nltk.tokenize import TextTilingTokenizer
+from scenestore import SceneStore
+from texttiling import NumpyTextTilingTokenizer
+
+
+# Streaming mode reads the book in chunks of roughly this many characters.
+# nltk refuses inputs over TextTilingTokenizer.MAX_TEXT_LEN, so a window
+# (carried tail + chunk) has to stay well below that.
+DEFAULT_CHUNK_CHARS = 200_000
+# The carried tail is flushed once a window reaches this many chunks, so a
+# window holds at most one chunk more
+MAX_WINDOW_CHUNKS = 3
+
+# Number of trailing segments of each window that are not emitted yet.
+# TextTiling truncates the block comparison window and clips the depth scores
+# at the end of its input, so boundaries close to the end of a chunk are not
+# final until more text has been seen.
+DEFAULT_HOLDBACK = 2
+
+# TextTiling implementations; both produce the same boundaries, "numpy" is
+# orders of magnitude faster on anything longer than a chapter
+ENGINES = {
+    "nltk": TextTilingTokenizer,
+    "numpy": NumpyTextTilingTokenizer,
+}
+DEFAULT_ENGINE = "numpy"
 
 
 def load_text_file(file_path: str) -> str:
@@ -14,19 +41,9 @@ def load_text_file(file_path: str) -> str:
         return file.read()
 
 
-def split_text_into_scenes(text: str, w: int = 20, k: int = 10) -> List[str]:
-    """
-    Split text into scenes using NLTK's TextTiling algorithm.
-
-    Args:
-        text: The input text to split into scenes
-        w: Block size - number of sentences in a block (default: 20)
-        k: Number of blocks to compare for boundary detection (default: 10)
-
-    Returns:
-        List of text scenes as strings
-    """
-    # Download required NLTK data if not present
+@cache
+def ensure_nltk_data() -> None:
+    """Download required NLTK data if not present. Only checks once per process."""
     try:
         nltk.data.find('tokenizers/punkt')
     except LookupError:
@@ -37,11 +54,43 @@ def split_text_into_scenes(text: str, w: int = 20, k: int = 10) -> List[str]:
     except LookupError:
         nltk.download('punkt_tab')
 
+
+def max_chunk_chars(engine: str = DEFAULT_ENGINE) -> Optional[int]:
+    """Largest chunk_chars whose streaming windows the engine accepts, None if it takes any length."""
+    max_text_len = getattr(ENGINES[engine], "MAX_TEXT_LEN", None)
+    return max_text_len // (MAX_WINDOW_CHUNKS + 1) if max_text_len else None
+
+
+def tile_text(text: str, w: int = 20, k: int = 10, engine: str = DEFAULT_ENGINE) -> List[str]:
+    """
+    Run TextTiling over text and return the raw segments.
+
+    Unlike split_text_into_scenes the segments are not stripped, so joining
+    them gives back the input text exactly.
+    """
+    ensure_nltk_data()
+
     # Initialize the TextTiling tokenizer
-    tokenizer = TextTilingTokenizer(w=w, k=k)
+    tokenizer = ENGINES[engine](w=w, k=k)
 
     # Split the text into scenes
-    scenes = tokenizer.tokenize(text)
+    return tokenizer.tokenize(text)
+
+
+def split_text_into_scenes(text: str, w: int = 20, k: int = 10, engine: str = DEFAULT_ENGINE) -> List[str]:
+    """
+    Split text into scenes using the TextTiling algorithm.
+
+    Args:
+        text: The input text to split into scenes
+        w: Block size - number of sentences in a block (default: 20)
+        k: Number of blocks to compare for boundary detection (default: 10)
+        engine: TextTiling implementation, "numpy" (default) or "nltk"
+
+    Returns:
+        List of text scenes as strings
+    """
+    scenes = tile_text(text, w=w, k=k, engine=engine)
 
     # Clean up the scenes by stripping whitespace
     cleaned_scenes = [scene.strip() for scene in scenes if scene.strip()]
@@ -49,13 +98,129 @@ def split_text_into_scenes(text: str, w: int = 20, k: int = 10) -> List[str]:
     return cleaned_scenes
 
 
-def write_scenes_to_json(scenes: List[str], output_dir: str) -> None:
+def read_paragraph_chunks(file_path: str, chunk_chars: int = DEFAULT_CHUNK_CHARS) -> Iterator[str]:
+    """
+    Read a text file in chunks that end on a paragraph break.
+
+    The file is read line by line through a buffered reader, so only the
+    current chunk is held in memory. Each chunk is at least chunk_chars long
+    (except the last one) and joining all chunks gives back the file contents.
+    """
+    current_dir = Path(__file__).parent
+    full_path = current_dir / file_path
+
+    with open(full_path, 'r', encoding='utf-8', newline='') as file:
+        lines = []
+        size = 0
+        for line in file:
+            lines.append(line)
+            size += len(line)
+            # Only cut on a blank line so TextTiling sees whole paragraphs
+            if size >= chunk_chars and not line.strip():
+                yield ''.join(lines)
+                lines = []
+                size = 0
+
+        if lines:
+            yield ''.join(lines)
+
+
+def stream_scenes(
+    file_path: str,
+    w: int = 20,
+    k: int = 10,
+    chunk_chars: int = DEFAULT_CHUNK_CHARS,
+    holdback: int = DEFAULT_HOLDBACK,
+    engine: str = DEFAULT_ENGINE,
+) -> Iterator[str]:
+    """
+    Split a text file into scenes without loading the whole file.
+
+    The file is read in paragraph-aligned chunks and TextTiling runs over a
+    window made of the chunk plus the tentative tail of the previous window.
+    Every segment except the last `holdback` ones is final and yielded right
+    away; the tail is carried over and re-tiled together with the next chunk,
+    so boundaries near a chunk edge are decided with context from both sides.
+
+    Peak memory is bounded by the window size instead of the book size. The
+    depth score cutoff is computed per window rather than over the whole book,
+    so the boundaries can differ slightly from split_text_into_scenes.
+
+    Args:
+        file_path: Path to the text file, relative to this script
+        w: Block size - number of sentences in a block (default: 20)
+        k: Number of blocks to compare for boundary detection (default: 10)
+        chunk_chars: Approximate number of characters read per chunk
+        holdback: Number of trailing segments per window kept tentative
+        engine: TextTiling implementation, "numpy" (default) or "nltk"
+
+    Yields:
+        Scene texts, stripped of surrounding whitespace, in book order
+
+    Raises:
+        ValueError: If chunk_chars is over max_chunk_chars(engine)
+    """
+    limit = max_chunk_chars(engine)
+    if limit is not None and chunk_chars > limit:
+        raise ValueError(f"chunk_chars {chunk_chars} is over {limit}, the most the {engine} engine can tile")
+    max_text_len = getattr(ENGINES[engine], "MAX_TEXT_LEN", None)
+
+    # Never let the carried tail grow past a few chunks; if TextTiling keeps
+    # finding no boundary, the window is flushed as is.
+    max_window_chars = MAX_WINDOW_CHUNKS * chunk_chars
+    carry = ''
+
+    for chunk in read_paragraph_chunks(file_path, chunk_chars):
+        window = carry + chunk
+        try:
+            segments = tile_text(window, w=w, k=k, engine=engine)
+        except ValueError:
+            if max_text_len and len(window) > max_text_len:
+                # Over the engine's input limit, which more text will not fix
+                raise
+            # Too little text to tile yet (no paragraph breaks or too few
+            # token sequences); keep reading
+            segments = [window]
+
+        if len(segments) > holdback:
+            final_count = len(segments) - holdback
+        elif len(window) >= max_window_chars:
+            # Still no usable boundary in a full window: flush what we have
+            final_count = max(len(segments) - 1, 1)
+        else:
+            carry = window
+            continue
+
+        for segment in segments[:final_count]:
+            if segment.strip():
+                yield segment.strip()
+        carry = ''.join(segments[final_count:])
+
+    if carry.strip():
+        try:
+            segments = tile_text(carry, w=w, k=k, engine=engine)
+        except ValueError:
+            if max_text_len and len(carry) > max_text_len:
+                raise
+            segments = [carry]
+        for segment in segments:
+            if segment.strip():
+                yield segment.strip()
+
+
+def write_scenes_to_json(scenes: Iterable[str], output_dir: str) -> int:
     """
     Write each scene to a separate JSON file.
 
+    Scenes are written as they are produced, so passing a generator such as
+    stream_scenes writes each scene as soon as its boundary is final.
+
     Args:
-        scenes: List of scene text strings
+        scenes: Iterable of scene text strings
         output_dir: Directory path to write the JSON files
+
+    Returns:
+        Number of scenes written
     """
     current_dir = Path(__file__).parent
     full_output_dir = current_dir / output_dir
@@ -64,32 +229,95 @@ def write_scenes_to_json(scenes: List[str], output_dir: str) -> None:
     full_output_dir.mkdir(parents=True, exist_ok=True)
 
     # Write each scene to a separate JSON file
+    count = 0
     for i, scene in enumerate(scenes, 1):
         scene_data = {"scene_text": scene}
         output_file = full_output_dir / f"scene_{i:03d}.json"
 
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(scene_data, f, indent=2, ensure_ascii=False)
+        count = i
+
+    print(f"Wrote {count} scenes to {full_output_dir}")
+    return count
 
-    print(f"Wrote {len(scenes)} scenes to {full_output_dir}")
+
+def write_scenes_to_store(scenes: Iterable[str], store_path: str) -> int:
+    """
+    Write all scenes to a single scene store file, replacing any existing store.
+
+    Args:
+        scenes: Iterable of scene text strings
+        store_path: Path of the store file to create
+
+    Returns:
+        Number of scenes written
+    """
+    current_dir = Path(__file__).parent
+    full_store_path = current_dir / store_path
+
+    with SceneStore.create(full_store_path, ({"scene_text": scene} for scene in scenes)) as store:
+        count = len(store)
+
+    print(f"Wrote {count} scenes to {full_store_path}")
+    return count
 
 
 def main():
     """Main function to demonstrate scene detection on Alice in Wonderland."""
+    parser = argparse.ArgumentParser(description="Split a book into scenes using TextTiling")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the book in chunks and write scenes as soon as they are final")
+    parser.add_argument("--chunk-chars", type=int, default=DEFAULT_CHUNK_CHARS,
+                        help="Characters read per chunk in streaming mode")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE,
+                        help="TextTiling implementation to use")
+    parser.add_argument("--library", metavar="DIR",
+                        help="Segment every book in DIR (e.g. assets/books) in parallel")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes for --library (default: one per core)")
+    parser.add_argument("--store", action="store_true",
+                        help="Write a single scenes.store file instead of one JSON file per scene")
+    args = parser.parse_args()
+    limit = max_chunk_chars(args.engine)
+    if args.stream and limit is not None and args.chunk_chars > limit:
+        parser.error(f"--chunk-chars can be at most {limit} with the {args.engine} engine")
+
     print("Scene Detection using TextTiling")
     print("=" * 40)
 
+    if args.library:
+        # Imported here since library.py imports from this module
+        from library import segment_library
+
+        scene_counts = segment_library(args.library, workers=args.workers, engine=args.engine, store=args.store)
+        print(f"Detected {sum(scene_counts.values())} scenes in {len(scene_counts)} books")
+        return
+
     try:
+        if args.stream:
+            scenes = stream_scenes("../../assets/books/alice-in-wonderland/text/alice-full.txt",
+                                   chunk_chars=args.chunk_chars, engine=args.engine)
+            if args.store:
+                count = write_scenes_to_store(scenes, "../../assets/books/alice-in-wonderland/text/scenes.store")
+            else:
+                count = write_scenes_to_json(scenes, "../../assets/books/alice-in-wonderland/text/scenes/")
+            print(f"Detected {count} scenes")
+            return
+
         # Load the Alice in Wonderland text
         text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-full.txt")
         print(f"Loaded text with {len(text)} characters")
 
         # Split into scenes
-        scenes = split_text_into_scenes(text)
+        scenes = split_text_into_scenes(text, engine=args.engine)
         print(f"Detected {len(scenes)} scenes")
 
         # Write scenes to JSON files
-        write_scenes_to_json(scenes, "../../assets/books/alice-in-wonderland/text/scenes/")
+        if args.store:
+            write_scenes_to_store(scenes, "../../assets/books/alice-in-wonderland/text/scenes.store")
+        else:
+            write_scenes_to_json(scenes, "../../assets/books/alice-in-wonderland/text/scenes/")
 
         # Display first few scenes with preview
         for i, scene in enumerate(scenes[:3]):
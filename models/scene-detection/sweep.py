@@ -0,0 +1,261 @@
+"""
+Parameter sweep for tuning TextTiling's w and k on a book.
+
+The text is prepared once (paragraph breaks, term ids, stopwords; see
+TilingInput in texttiling.py) and shared by every setting of the grid. The
+token sequence counts depend on w only, so the settings are grouped by w and
+the groups run in a process pool, each worker receiving the prepared text
+once. For every setting the sweep reports the number of scenes and their
+length distribution and, given reference boundaries, Pk and WindowDiff
+(nltk.metrics.segmentation) over the paragraph breaks of the text.
+
+    python sweep.py ../../assets/books/alice-in-wonderland/text/alice-full.txt \
+        --w 10 20 30 --k 4 6 10 --reference ../../assets/books/alice-in-wonderland/text/alice-chapters
+"""
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import json
+import re
+import statistics
+import time
+import warnings
+
+from nltk.metrics.segmentation import pk, windowdiff
+
+from main import ensure_nltk_data
+from scenestore import SceneStore, is_scene_store
+from texttiling import NumpyTextTilingTokenizer, TilingInput
+
+
+DEFAULT_WS = (10, 15, 20, 25, 30, 40)
+DEFAULT_KS = (4, 6, 8, 10, 12)
+# Characters from the start of each reference segment looked up in the text
+REFERENCE_PREFIX_CHARS = 200
+
+
+@dataclass
+class SweepResult:
+    w: int
+    k: int
+    scenes: int = 0
+    min_length: int = 0
+    median_length: float = 0.0
+    mean_length: float = 0.0
+    p90_length: float = 0.0
+    max_length: int = 0
+    # Agreement with the reference boundaries, lower is better; None without a reference
+    pk: Optional[float] = None
+    windowdiff: Optional[float] = None
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def load_reference(path: str) -> List[str]:
+    """Reference segments in book order: a scene store, or a directory of scene JSON or plain text files."""
+    if is_scene_store(path):
+        with SceneStore(path) as store:
+            return [scene.get("scene_text", "") for _, scene in store.items()]
+
+    def number(file: Path):
+        numbers = re.findall(r"\d+", file.stem)
+        return (int(numbers[-1]) if numbers else -1, file.name)
+
+    segments = []
+    for file in sorted([*Path(path).glob("*.json"), *Path(path).glob("*.txt")], key=number):
+        if file.suffix == ".json":
+            with open(file, encoding="utf-8") as f:
+                segments.append(json.load(f).get("scene_text", ""))
+        else:
+            segments.append(file.read_text(encoding="utf-8"))
+    return segments
+
+
+def collapse_whitespace(text: str) -> Tuple[str, List[int]]:
+    """
+    text with every run of whitespace turned into one space and _emphasis_
+    markup dropped, and the offset in text of each character of the result.
+    """
+    chars = []
+    origin = []
+    space = True
+    word_start = 0
+    for i, char in enumerate(text):
+        if char.isspace():
+            if not space:
+                chars.append(" ")
+                origin.append(i)
+                space = True
+            word_start = i + 1
+        elif char != "_":
+            chars.append(char)
+            # A word starts where its markup does
+            origin.append(word_start if space else i)
+            space = False
+    return "".join(chars), origin
+
+
+def reference_boundaries(text: str, segments: Sequence[str]) -> List[int]:
+    """
+    Offsets in text where each segment after the first starts, found in order.
+
+    Segments are matched by their first REFERENCE_PREFIX_CHARS characters
+    after collapse_whitespace, so a reference wrapped or marked up differently
+    from text (one line per paragraph against fixed-width lines) still lines
+    up. Segments not found in text are skipped with a warning; ValueError if
+    none is found.
+    """
+    collapsed, origin = collapse_whitespace(text)
+    boundaries = []
+    missing = 0
+    position = 0
+    for segment in segments:
+        prefix = collapse_whitespace(segment)[0].strip()[:REFERENCE_PREFIX_CHARS]
+        if not prefix:
+            continue
+        start = collapsed.find(prefix, position)
+        if start < 0:
+            missing += 1
+            continue
+        if origin[start] > 0:
+            boundaries.append(origin[start])
+        position = start + len(prefix)
+
+    if missing and missing == sum(1 for segment in segments if segment.strip()):
+        raise ValueError("None of the reference segments were found in the text")
+    if missing:
+        warnings.warn(f"{missing} of the reference segments were not found in the text and are skipped")
+    return boundaries
+
+
+def boundary_string(boundaries: Sequence[int], paragraph_breaks: Sequence[int]) -> str:
+    """Boundaries as nltk segmentation string over the paragraph breaks: "1" at the break nearest each boundary."""
+    units = ["0"] * len(paragraph_breaks)
+    for boundary in boundaries:
+        right = bisect_left(paragraph_breaks, boundary)
+        if right == len(paragraph_breaks) or \
+                (right > 0 and boundary - paragraph_breaks[right - 1] <= paragraph_breaks[right] - boundary):
+            right -= 1
+        if right >= 0:
+            units[right] = "1"
+    return "".join(units)
+
+
+def evaluate(prepared: TilingInput, w: int, k: int, reference: Optional[str] = None) -> SweepResult:
+    """Tile the prepared text with w and k and describe the scenes; reference is a boundary_string."""
+    result = SweepResult(w, k)
+    start = time.perf_counter()
+    try:
+        segments = NumpyTextTilingTokenizer(w=w, k=k).tokenize_prepared(prepared)
+    except (ValueError, ZeroDivisionError) as e:
+        # Too few token sequences for this w and k
+        result.error = repr(e)
+        return result
+
+    lengths = [len(segment.strip()) for segment in segments if segment.strip()]
+    if not lengths:
+        result.error = "no non-blank scenes"
+        return result
+    result.scenes = len(lengths)
+    result.min_length = min(lengths)
+    result.median_length = statistics.median(lengths)
+    result.mean_length = statistics.fmean(lengths)
+    result.p90_length = statistics.quantiles(lengths, n=10)[-1] if len(lengths) > 1 else lengths[0]
+    result.max_length = max(lengths)
+
+    if reference is not None and "1" in reference:
+        offsets = []
+        position = 0
+        for segment in segments[:-1]:
+            position += len(segment)
+            offsets.append(position)
+        hypothesis = boundary_string(offsets, prepared.paragraph_breaks)
+        # nltk's default window for Pk: half the mean reference segment length
+        window = max(int(round(len(reference) / (reference.count("1") * 2.0))), 1)
+        result.pk = pk(reference, hypothesis, window)
+        result.windowdiff = windowdiff(reference, hypothesis, window)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+# The prepared text of the sweep, sent to every worker process once
+_prepared: Optional[TilingInput] = None
+
+
+def _init_worker(prepared: TilingInput):
+    global _prepared
+    _prepared = prepared
+
+
+def _evaluate_w(w: int, ks: Sequence[int], reference: Optional[str]) -> List[SweepResult]:
+    # All settings of one w share its token sequence counts
+    return [evaluate(_prepared, w, k, reference) for k in ks]
+
+
+def sweep(text: str, ws: Sequence[int] = DEFAULT_WS, ks: Sequence[int] = DEFAULT_KS,
+          reference: Optional[Sequence[str]] = None, workers: Optional[int] = None) -> List[SweepResult]:
+    """
+    Tile text with every combination of ws and ks and return the results in grid order.
+
+    reference holds the segments of a reference segmentation of text, for Pk
+    and WindowDiff. workers=1 runs in this process; otherwise the w groups run
+    in a pool of worker processes (default one per core).
+    """
+    ensure_nltk_data()
+    prepared = NumpyTextTilingTokenizer().prepare(text)
+    reference_units = None
+    if reference is not None:
+        reference_units = boundary_string(reference_boundaries(text, reference), prepared.paragraph_breaks)
+
+    if workers == 1:
+        _init_worker(prepared)
+        grouped = [_evaluate_w(w, ks, reference_units) for w in ws]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(prepared,)) as executor:
+            grouped = list(executor.map(_evaluate_w, ws, [ks] * len(ws), [reference_units] * len(ws)))
+    return [result for results in grouped for result in results]
+
+
+def format_results(results: Sequence[SweepResult]) -> str:
+    """A table of the results, one setting per line."""
+    lines = [f"{'w':>4} {'k':>4} {'scenes':>6} {'min':>7} {'median':>7} {'mean':>7} {'p90':>7} {'max':>7} "
+             f"{'Pk':>6} {'WinDiff':>7}"]
+    for r in results:
+        if r.error is not None:
+            lines.append(f"{r.w:>4} {r.k:>4} failed: {r.error}")
+            continue
+        agreement = f"{r.pk:>6.3f} {r.windowdiff:>7.3f}" if r.pk is not None else f"{'-':>6} {'-':>7}"
+        lines.append(f"{r.w:>4} {r.k:>4} {r.scenes:>6} {r.min_length:>7} {r.median_length:>7.0f} "
+                     f"{r.mean_length:>7.0f} {r.p90_length:>7.0f} {r.max_length:>7} {agreement}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep TextTiling's w and k over a book")
+    parser.add_argument("text", help="Book text file")
+    parser.add_argument("--w", type=int, nargs="+", default=list(DEFAULT_WS), help="Token sequence sizes to try")
+    parser.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_KS), help="Block sizes to try")
+    parser.add_argument("--reference", metavar="PATH",
+                        help="Reference segmentation: scene store, or directory of scene JSON or text files")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE as JSON")
+    args = parser.parse_args()
+
+    text = Path(args.text).read_text(encoding="utf-8")
+    reference = load_reference(args.reference) if args.reference else None
+
+    start = time.perf_counter()
+    results = sweep(text, args.w, args.k, reference, args.workers)
+    print(format_results(results))
+    print(f"{len(results)} settings in {time.perf_counter() - start:.1f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([vars(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
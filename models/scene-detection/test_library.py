@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+
+from library import segment_library, split_into_shards
+from main import load_text_file
+
+
+def test_split_into_shards_splits_on_chapters():
+    """Test that the full book is split into front matter plus one shard per chapter."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-full.txt")
+
+    shards = split_into_shards(text)
+
+    assert len(shards) == 13
+    assert shards[1].startswith("CHAPTER I.")
+    assert shards[12].startswith("CHAPTER XII.")
+    assert "".join(shards) == text
+
+
+def test_split_into_shards_splits_long_chapters_at_paragraphs():
+    """Test that chapters over the size limit are cut at paragraph breaks."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt")
+
+    shards = split_into_shards(text, max_shard_chars=2000)
+
+    assert len(shards) > 1
+    assert all(shard.endswith("\n\n") for shard in shards[:-1])
+    assert "".join(shards) == text
+
+
+def test_segment_library_writes_scenes_per_book(tmp_path):
+    """Test that every book in the library gets its own numbered scene files."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt")
+    for book in ["book-a", "book-b"]:
+        (tmp_path / book / "text").mkdir(parents=True)
+        (tmp_path / book / "text" / f"{book}-full.txt").write_text(text + text, encoding="utf-8")
+    (tmp_path / "not-a-book").mkdir()
+
+    scene_counts = segment_library(str(tmp_path), workers=2, max_shard_chars=4000)
+
+    assert set(scene_counts) == {"book-a", "book-b"}
+    for book, count in scene_counts.items():
+        scene_files = sorted((tmp_path / book / "text" / "scenes").glob("scene_*.json"))
+        assert len(scene_files) == count > 1
+        with open(scene_files[0], encoding="utf-8") as f:
+            assert "Alice was beginning to get very tired" in json.load(f)["scene_text"]
+
+
+def test_segment_library_writes_next_to_books_from_any_directory(tmp_path, monkeypatch):
+    """Test that a library path relative to the current directory gets its scenes written into the books."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt")
+    for book in ["book-a", "book-b", "book-c"]:
+        (tmp_path / "books" / book / "text").mkdir(parents=True)
+        (tmp_path / "books" / book / "text" / f"{book}-full.txt").write_text(text, encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    scene_counts = segment_library("books", workers=1, max_shard_chars=4000, store=True)
+
+    assert list(scene_counts) == ["book-a", "book-b", "book-c"]
+    for book in scene_counts:
+        assert (tmp_path / "books" / book / "text" / "scenes.store").is_file()
+    assert not (Path(__file__).parent / "books").exists()
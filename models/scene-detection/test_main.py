@@ -1,5 +1,7 @@
+import json
+import re
 import pytest
-from main import split_text_into_scenes, load_text_file
+from main import max_chunk_chars, split_text_into_scenes, load_text_file, stream_scenes, write_scenes_to_json
 
 
 def test_load_text_file():
@@ -76,3 +78,43 @@ def test_split_text_into_scenes_with_custom_parameters():
 
     assert isinstance(scenes, list)
     assert len(scenes) > 0
+
+
+def test_stream_scenes_covers_whole_text():
+    """Test that streaming scenes from small chunks loses no text and keeps order."""
+    path = "../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt"
+    text = load_text_file(path)
+
+    scenes = list(stream_scenes(path, chunk_chars=2000))
+
+    assert len(scenes) > 1
+    assert "Alice was beginning to get very tired" in scenes[0]
+    # Scenes are stripped, so compare without whitespace
+    assert re.sub(r"\s+", "", "".join(scenes)) == re.sub(r"\s+", "", text)
+
+
+def test_stream_scenes_rejects_chunks_over_the_engine_limit():
+    """Test that chunks whose windows nltk would refuse are an error up front instead of untiled scenes."""
+    path = "../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt"
+
+    assert max_chunk_chars("numpy") is None
+    with pytest.raises(ValueError, match="chunk_chars"):
+        next(stream_scenes(path, chunk_chars=max_chunk_chars("nltk") + 1, engine="nltk"))
+
+
+def test_write_scenes_to_json_consumes_generator(tmp_path):
+    """Test that scenes are written from a generator as they are produced."""
+    written = []
+
+    def scenes():
+        for scene in ["First scene.", "Second scene."]:
+            # The previous scene must already be on disk
+            written.append(sorted(p.name for p in tmp_path.iterdir()))
+            yield scene
+
+    count = write_scenes_to_json(scenes(), str(tmp_path))
+
+    assert count == 2
+    assert written == [[], ["scene_001.json"]]
+    with open(tmp_path / "scene_002.json", encoding="utf-8") as f:
+        assert json.load(f) == {"scene_text": "Second scene."}
@@ -0,0 +1,92 @@
+import json
+import pytest
+from scenestore import SceneStore, export_json_dir, import_json_dir, is_scene_store
+
+
+def test_scene_store_random_access(tmp_path):
+    """Test that scenes can be read back by number in any order."""
+    scenes = [{"scene_text": f"Scene number {i}"} for i in range(1, 51)]
+    SceneStore.create(tmp_path / "scenes.store", scenes).close()
+
+    with SceneStore(tmp_path / "scenes.store") as store:
+        assert len(store) == 50
+        assert store.get(37) == {"scene_text": "Scene number 37"}
+        assert store.get(1) == {"scene_text": "Scene number 1"}
+        assert list(store) == scenes
+        with pytest.raises(IndexError):
+            store.get(51)
+
+
+def test_scene_store_patch_and_append_survive_reopen(tmp_path):
+    """Test that patched fields and appended scenes are persisted."""
+    with SceneStore.create(tmp_path / "scenes.store", [{"scene_text": "One"}, {"scene_text": "Two"}]) as store:
+        store.patch(2, {"characters_mentioned": ["Alice"]})
+        assert store.append({"scene_text": "Three"}) == 3
+
+    with SceneStore(tmp_path / "scenes.store") as store:
+        assert store.get(2) == {"scene_text": "Two", "characters_mentioned": ["Alice"]}
+        assert store.get(3) == {"scene_text": "Three"}
+
+
+def test_scene_store_compact_drops_old_versions(tmp_path):
+    """Test that compaction shrinks the file and keeps the latest data."""
+    path = tmp_path / "scenes.store"
+    with SceneStore.create(path, [{"scene_text": "x" * 1000}]) as store:
+        for i in range(10):
+            store.patch(1, {"revision": i})
+        size_before = path.stat().st_size
+        store.compact()
+
+        assert path.stat().st_size < size_before
+        assert store.get(1) == {"scene_text": "x" * 1000, "revision": 9}
+
+
+def test_json_import_export_round_trip(tmp_path):
+    """Test the bridge between scene_NNN.json directories and stores."""
+    source = tmp_path / "source"
+    source.mkdir()
+    for i in range(1, 4):
+        with open(source / f"scene_{i:03d}.json", "w", encoding="utf-8") as f:
+            json.dump({"scene_text": f"Scene “{i}”"}, f)
+
+    import_json_dir(source, tmp_path / "scenes.store").close()
+    assert is_scene_store(tmp_path / "scenes.store")
+    assert not is_scene_store(source / "scene_001.json")
+
+    assert export_json_dir(tmp_path / "scenes.store", tmp_path / "exported") == 3
+    with open(tmp_path / "exported" / "scene_003.json", encoding="utf-8") as f:
+        assert json.load(f) == {"scene_text": "Scene “3”"}
+
+
+def test_json_import_orders_scenes_by_number(tmp_path):
+    """Test that scene_1000.json is imported after scene_999.json, not after scene_100.json."""
+    json_dir = tmp_path / "scenes"
+    json_dir.mkdir()
+    for number in range(1, 1006):
+        with open(json_dir / f"scene_{number:03d}.json", "w", encoding="utf-8") as f:
+            json.dump({"scene_text": f"Scene {number}"}, f)
+
+    with import_json_dir(json_dir, tmp_path / "scenes.store") as store:
+        assert len(store) == 1005
+        assert [store.get(n)["scene_text"] for n in (100, 999, 1000, 1005)] == \
+            ["Scene 100", "Scene 999", "Scene 1000", "Scene 1005"]
+
+
+def test_only_create_makes_store_files(tmp_path):
+    """Test that opening a missing store fails and a failed create leaves the old store as it was."""
+    with pytest.raises(FileNotFoundError):
+        SceneStore(tmp_path / "missing.store")
+    assert not (tmp_path / "missing.store").exists()
+
+    path = tmp_path / "scenes.store"
+    SceneStore.create(path, [{"scene_text": "Old"}]).close()
+
+    def failing_scenes():
+        yield {"scene_text": "New"}
+        raise RuntimeError("segmentation failed")
+
+    with pytest.raises(RuntimeError):
+        SceneStore.create(path, failing_scenes())
+    with SceneStore(path) as store:
+        assert list(store) == [{"scene_text": "Old"}]
+    assert [file.name for file in tmp_path.iterdir()] == ["scenes.store"]
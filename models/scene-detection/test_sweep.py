@@ -0,0 +1,68 @@
+from dataclasses import replace
+
+import pytest
+
+from main import load_text_file, split_text_into_scenes
+from sweep import boundary_string, evaluate, load_reference, reference_boundaries, sweep
+from texttiling import NumpyTextTilingTokenizer
+
+
+CHAPTER = "../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt"
+
+
+def test_sweep_matches_tiling_each_setting_from_scratch():
+    """Test that settings sharing one prepared text find the same scenes as separate runs, in or out of process."""
+    text = load_text_file(CHAPTER)
+
+    results = sweep(text, ws=(10, 20), ks=(4, 10), workers=1)
+
+    assert [(r.w, r.k) for r in results] == [(10, 4), (10, 10), (20, 4), (20, 10)]
+    for result in results:
+        scenes = split_text_into_scenes(text, w=result.w, k=result.k)
+        assert result.scenes == len(scenes)
+        assert (result.min_length, result.max_length) == (min(map(len, scenes)), max(map(len, scenes)))
+        assert result.pk is None
+    pooled = sweep(text, ws=(10, 20), ks=(4, 10), workers=2)
+    assert [replace(r, seconds=0) for r in pooled] == [replace(r, seconds=0) for r in results]
+
+
+def test_agreement_with_a_reference_segmentation():
+    """Test that a setting scores zero Pk and WindowDiff against its own scenes and worse with others."""
+    text = load_text_file(CHAPTER)
+    reference = split_text_into_scenes(text, w=10, k=4)
+
+    results = {(r.w, r.k): r for r in sweep(text, ws=(10, 20), ks=(4,), reference=reference, workers=1)}
+
+    assert (results[10, 4].pk, results[10, 4].windowdiff) == (0.0, 0.0)
+    assert results[20, 4].pk > 0 and results[20, 4].windowdiff > 0
+    with pytest.warns(UserWarning, match="1 of the reference segments"):
+        assert reference_boundaries("aa bb cc", ["aa", "missing", "cc"]) == [6]
+    with pytest.raises(ValueError):
+        reference_boundaries("aa bb cc", ["missing"])
+    # Boundaries go to the nearest paragraph break, the earlier one on a tie
+    assert boundary_string([4, 15], [5, 10, 20]) == "110"
+    assert boundary_string([30], [5, 10, 20]) == "001"
+
+
+def test_reference_matches_across_line_wrapping():
+    """Test that a chapter file lines up with the differently wrapped and marked up full text of the book."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-full.txt")
+    chapters = load_reference("../../assets/books/alice-in-wonderland/text/alice-chapters")
+
+    boundaries = reference_boundaries(text, chapters)
+
+    # The chapter, not its entry in the table of contents
+    assert len(boundaries) == 1
+    assert text[boundaries[0]:].startswith("CHAPTER I.\nDown the Rabbit-Hole\n\n\nAlice was beginning")
+    assert reference_boundaries("aa\nbb  _cc_\n\ndd", ["aa bb", "cc\ndd"]) == [7]
+
+
+def test_blank_scenes_are_reported_as_an_error():
+    """Test that a setting finding only blank scenes reports an error instead of failing the sweep."""
+    prepared = NumpyTextTilingTokenizer().prepare(load_text_file(CHAPTER))
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(NumpyTextTilingTokenizer, "tokenize_prepared", lambda self, prepared: ["  ", "\n\n"])
+        result = evaluate(prepared, 10, 4)
+
+    assert (result.scenes, result.error) == (0, "no non-blank scenes")
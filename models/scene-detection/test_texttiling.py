@@ -0,0 +1,63 @@
+import pytest
+from nltk.tokenize import TextTilingTokenizer
+from main import load_text_file
+from texttiling import NumpyTextTilingTokenizer
+
+
+SAMPLE_TEXT = """
+    CHAPTER I.
+    Down the Rabbit-Hole
+
+    Alice was beginning to get very tired of sitting by her sister on the
+    bank, and of having nothing to do. She was considering in her own mind
+    whether the pleasure of making a daisy-chain would be worth the trouble.
+
+    Suddenly a White Rabbit with pink eyes ran close by her. There was nothing
+    so very remarkable in that; nor did Alice think it so very much out of the
+    way to hear the Rabbit say to itself, "Oh dear! Oh dear! I shall be late!"
+
+    Alice started to her feet, for it flashed across her mind that she had
+    never before seen a rabbit with either a waistcoat-pocket, or a watch to
+    take out of it, and burning with curiosity, she ran across the field.
+    """
+
+
+@pytest.mark.parametrize("w,k", [(20, 10), (2, 2)])
+def test_numpy_engine_matches_nltk_on_sample(w, k):
+    """Test that the NumPy engine segments the sample text exactly like nltk."""
+    expected = TextTilingTokenizer(w=w, k=k).tokenize(SAMPLE_TEXT)
+
+    assert NumpyTextTilingTokenizer(w=w, k=k).tokenize(SAMPLE_TEXT) == expected
+
+
+@pytest.mark.parametrize("w,k", [(20, 10), (10, 5), (5, 3), (40, 6)])
+def test_numpy_engine_matches_nltk_on_chapter(w, k):
+    """Test boundary parity on a real chapter for several parameter settings."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt")
+    expected = TextTilingTokenizer(w=w, k=k).tokenize(text)
+
+    assert NumpyTextTilingTokenizer(w=w, k=k).tokenize(text) == expected
+
+
+def test_numpy_engine_matches_nltk_on_full_book():
+    """Test boundary parity on the whole of Alice in Wonderland (slow: nltk takes about a minute)."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-full.txt")
+    expected = TextTilingTokenizer().tokenize(text)
+
+    assert NumpyTextTilingTokenizer().tokenize(text) == expected
+
+
+def test_numpy_engine_demo_mode_scores_match_nltk():
+    """Test that the intermediate gap, smoothed and depth scores are identical to nltk's."""
+    text = load_text_file("../../assets/books/alice-in-wonderland/text/alice-chapters/chapter-1.txt")
+    expected = TextTilingTokenizer(demo_mode=True).tokenize(text)
+    actual = NumpyTextTilingTokenizer(demo_mode=True).tokenize(text)
+
+    for expected_scores, actual_scores in zip(expected, actual):
+        assert list(actual_scores) == list(expected_scores)
+
+
+def test_numpy_engine_rejects_text_without_paragraphs():
+    """Test that short text fails the same way as with nltk."""
+    with pytest.raises(ValueError):
+        NumpyTextTilingTokenizer().tokenize("Just one short line of text.")
@@ -0,0 +1,265 @@
+"""
+NumPy implementation of the TextTiling block comparison algorithm.
+
+nltk's TextTilingTokenizer scores every token sequence gap by looping over the
+whole token table in Python, which makes segmentation quadratic-ish and slow
+for anything longer than a chapter. This engine builds term-frequency counts
+for the token sequences once and computes gap similarities, depth scores and
+boundaries with array operations. It follows nltk's implementation step by
+step (including its quirks), so it returns the same segments for the same
+text and parameters.
+
+Everything derived from the text before w and k come in (paragraph breaks,
+term ids, stopword mask, word ends) is kept in a TilingInput, and its token
+sequence counts per w, so a parameter sweep computes them once per text.
+"""
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+from nltk.tokenize.texttiling import LC, TextTilingTokenizer, smooth
+
+
+# Number of gaps scored per batch in the block comparison. Each batch builds a
+# dense (token sequences x vocabulary) prefix sum for its part of the text, so
+# this bounds memory on book-length inputs.
+GAP_BATCH_SIZE = 512
+
+
+class TilingInput:
+    """What TextTiling derives from a text before w and k are used; made by NumpyTextTilingTokenizer.prepare."""
+
+    def __init__(self, text: str, paragraph_breaks: List[int], term_ids: np.ndarray, keep: np.ndarray,
+                 word_ends: np.ndarray):
+        self.text = text
+        self.paragraph_breaks = paragraph_breaks
+        # Term id of every word, and which words are not stopwords
+        self.term_ids = term_ids
+        self.keep = keep
+        # Character index nltk counts a word at, for placing gaps in the text
+        self.word_ends = word_ends
+        self._cells: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray, int]] = {}
+
+    def sequence_cells(self, w: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """
+        Term counts of the token sequences of w words, as (sequence, term, count)
+        triples sorted by sequence, plus the number of sequences. Computed once per w.
+        """
+        if w not in self._cells:
+            # Sequences are cut before stopwords are dropped, so they count towards num_seqs
+            num_seqs = -(-len(self.term_ids) // w)
+            seq_ids = (np.arange(len(self.term_ids), dtype=np.int64) // w)[self.keep]
+            term_ids = self.term_ids[self.keep]
+
+            num_terms = int(term_ids.max(initial=0)) + 1
+            cells, counts = np.unique(seq_ids * num_terms + term_ids, return_counts=True)
+            cell_seqs, cell_terms = np.divmod(cells, num_terms)
+            self._cells[w] = (cell_seqs, cell_terms, counts, num_seqs)
+        return self._cells[w]
+
+
+class NumpyTextTilingTokenizer(TextTilingTokenizer):
+    """
+    Drop-in replacement for nltk's TextTilingTokenizer using NumPy arrays.
+
+    Takes the same constructor arguments. Only the default block comparison
+    similarity method and default smoothing are supported, and unlike nltk
+    there is no cap on the input length since every step is linear in it.
+    """
+
+    MAX_TEXT_LEN = None
+
+    def tokenize(self, text: str) -> List[str]:
+        """Return text split into topical segments; joining them gives back text."""
+        return self.tokenize_prepared(self.prepare(text))
+
+    def prepare(self, text: str) -> TilingInput:
+        """The w- and k-independent part of tokenizing text, to share between tokenizers with other w and k."""
+        lowercase_text = text.lower()
+        paragraph_breaks = self._mark_paragraph_breaks(text)
+
+        # Same character filter as nltk, but in one pass instead of per character
+        nopunct_text = re.sub(r"[^a-z\-' \n\t]", "", lowercase_text)
+        if len(self._mark_paragraph_breaks(nopunct_text)) < 2:
+            raise ValueError("No paragraph breaks were found(text too short perhaps?)")
+
+        term_ids, keep = self._terms(nopunct_text)
+
+        # nltk counts a word each time a space, tab or newline follows a
+        # non-whitespace character, and handles at most one gap per character
+        chars = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        is_space = np.isin(chars, [ord(" "), ord("\t"), ord("\n")])
+        word_ends = np.flatnonzero(is_space[1:] & ~is_space[:-1]) + 1
+
+        return TilingInput(text, paragraph_breaks, term_ids, keep, word_ends)
+
+    def tokenize_prepared(self, prepared: TilingInput) -> List[str]:
+        """Like tokenize, for a text prepared by this or any other NumpyTextTilingTokenizer with the same stopwords."""
+        if self.similarity_method != "block_comparison":
+            raise ValueError(f"Similarity method {self.similarity_method} not supported")
+
+        text = prepared.text
+        gap_scores = self._block_comparison_scores(*prepared.sequence_cells(self.w))
+        smooth_scores = smooth(gap_scores, window_len=self.smoothing_width + 1)
+        depth_scores = self._depth_scores(smooth_scores)
+        segment_boundaries = self._identify_boundaries(depth_scores)
+
+        normalized_boundaries = self._normalize_boundaries(prepared, segment_boundaries)
+
+        segmented_text = []
+        prevb = 0
+        for b in normalized_boundaries:
+            if b == 0:
+                continue
+            segmented_text.append(text[prevb:b])
+            prevb = b
+
+        if prevb < len(text):
+            segmented_text.append(text[prevb:])
+
+        if not segmented_text:
+            segmented_text = [text]
+
+        if self.demo_mode:
+            return gap_scores, smooth_scores, depth_scores, segment_boundaries
+        return segmented_text
+
+    def _terms(self, nopunct_text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Term id of every word of the text, and a mask of the words that are not stopwords."""
+        vocabulary = {}
+        term_ids = np.fromiter(
+            (vocabulary.setdefault(match.group(), len(vocabulary)) for match in re.finditer(r"\w+", nopunct_text)),
+            dtype=np.int64,
+        )
+        stop_ids = [vocabulary[word] for word in self.stopwords if word in vocabulary]
+        return term_ids, ~np.isin(term_ids, stop_ids)
+
+    def _block_comparison_scores(self, cell_seqs: np.ndarray, cell_terms: np.ndarray, counts: np.ndarray,
+                                 num_seqs: int) -> np.ndarray:
+        """
+        Cosine similarity between the k token sequences on either side of each gap.
+
+        Uses the same shrinking window as nltk near the start and end of the
+        text. Counts are summed as integers, so the scores are bit for bit the
+        ones nltk computes with Python floats.
+        """
+        num_gaps = max(num_seqs - 1, 0)
+        gaps = np.arange(num_gaps, dtype=np.int64)
+
+        window = np.full(num_gaps, self.k, dtype=np.int64)
+        tail = gaps > num_gaps - self.k
+        window[tail] = num_gaps - gaps[tail]
+        head = gaps < self.k - 1
+        window[head] = gaps[head] + 1
+
+        left_start = gaps - window + 1
+        middle = gaps + 1
+        right_end = np.minimum(gaps + window + 1, num_seqs)
+
+        scores = np.zeros(num_gaps, dtype=np.float64)
+        for batch_start in range(0, num_gaps, GAP_BATCH_SIZE):
+            batch = slice(batch_start, min(batch_start + GAP_BATCH_SIZE, num_gaps))
+            first_row = int(left_start[batch].min())
+            last_row = int(right_end[batch].max())
+
+            lo, hi = np.searchsorted(cell_seqs, [first_row, last_row])
+            local_terms, local_ids = np.unique(cell_terms[lo:hi], return_inverse=True)
+
+            # prefix[i] holds the term counts of sequences first_row .. first_row + i - 1
+            prefix = np.zeros((last_row - first_row + 1, len(local_terms)), dtype=np.int64)
+            prefix[cell_seqs[lo:hi] - first_row + 1, local_ids] = counts[lo:hi]
+            np.cumsum(prefix, axis=0, out=prefix)
+
+            block1 = prefix[middle[batch] - first_row] - prefix[left_start[batch] - first_row]
+            block2 = prefix[right_end[batch] - first_row] - prefix[middle[batch] - first_row]
+
+            dividend = np.einsum("ij,ij->i", block1, block2)
+            divisor = np.einsum("ij,ij->i", block1, block1) * np.einsum("ij,ij->i", block2, block2)
+            nonzero = divisor != 0
+            batch_scores = scores[batch]
+            batch_scores[nonzero] = dividend[nonzero] / np.sqrt(divisor[nonzero].astype(np.float64))
+
+        return scores
+
+    def _depth_scores(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Depth of each gap: how far it sits below the peaks to its left and right.
+
+        A peak is found by climbing from the gap while the scores do not
+        decrease, exactly like nltk's nested loops.
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        n = len(scores)
+        depth_scores = np.zeros(n, dtype=np.float64)
+        clip = min(max(n // 10, 2), 5)
+        if n <= 2 * clip:
+            return depth_scores
+
+        index = np.arange(n)
+        # Left climb restarts wherever the score to the left is lower
+        left_restart = np.ones(n, dtype=bool)
+        left_restart[1:] = scores[:-1] < scores[1:]
+        left_peak = np.maximum.accumulate(np.where(left_restart, index, 0))
+        # Right climb restarts wherever the score to the right is lower
+        right_restart = np.ones(n, dtype=bool)
+        right_restart[:-1] = scores[1:] < scores[:-1]
+        right_peak = np.minimum.accumulate(np.where(right_restart, index, n)[::-1])[::-1]
+
+        inner = slice(clip, n - clip)
+        depth_scores[inner] = scores[left_peak[inner]] + scores[right_peak[inner]] - 2 * scores[inner]
+        return depth_scores
+
+    def _identify_boundaries(self, depth_scores: np.ndarray) -> np.ndarray:
+        """Mark the deepest gaps above the cutoff, skipping any within 3 gaps of a deeper one."""
+        depth_list = depth_scores.tolist()
+        boundaries = np.zeros(len(depth_list), dtype=np.int64)
+
+        # Python's sum, not numpy's pairwise sum, to get nltk's exact cutoff
+        avg = sum(depth_list) / len(depth_list)
+        stdev = np.std(depth_list)
+        if self.cutoff_policy == LC:
+            cutoff = avg - stdev
+        else:
+            cutoff = avg - stdev / 2.0
+
+        # Deepest first; ties go to the later gap, as in nltk's reversed sort
+        candidates = np.flatnonzero(depth_scores > cutoff)
+        order = np.lexsort((candidates, depth_scores[candidates]))[::-1]
+        for gap in candidates[order]:
+            if not boundaries[max(gap - 3, 0):gap + 4].any():
+                boundaries[gap] = 1
+
+        return boundaries
+
+    def _normalize_boundaries(self, prepared: TilingInput, boundaries: np.ndarray) -> List[int]:
+        """Move every boundary to the paragraph break closest to where its gap falls in the text."""
+        text, paragraph_breaks, word_ends = prepared.text, prepared.paragraph_breaks, prepared.word_ends
+        boundaries = np.asarray(boundaries)
+        if len(boundaries) == 0 or len(text) == 0:
+            return []
+
+        gaps = np.arange(len(boundaries), dtype=np.int64)
+        thresholds = np.maximum(gaps * self.w, self.w)
+        reached = thresholds < len(word_ends)
+        # Thresholds never decrease, so once one is out of reach all later ones are
+        gaps = gaps[reached]
+        first_char = word_ends[thresholds[reached]]
+        gap_chars = np.maximum.accumulate(first_char - gaps) + gaps
+        gaps = gaps[gap_chars < len(text)]
+        gap_chars = gap_chars[: len(gaps)]
+
+        selected = boundaries[gaps] == 1
+        char_counts = gap_chars[selected] + 1
+
+        breaks = np.asarray(paragraph_breaks, dtype=np.int64)
+        right = np.clip(np.searchsorted(breaks, char_counts), 0, len(breaks) - 1)
+        left = np.clip(right - 1, 0, len(breaks) - 1)
+        # On a tie nltk keeps the earlier break
+        use_left = np.abs(breaks[left] - char_counts) <= np.abs(breaks[right] - char_counts)
+        best = np.where(use_left, breaks[left], breaks[right])
+
+        norm_boundaries = []
+        for br in best.tolist():
+            if br not in norm_boundaries[-1:]:
+                norm_boundaries.append(br)
+        return norm_boundaries